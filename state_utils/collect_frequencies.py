@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 import json
+import time
 import numpy as np
 import argparse
 import os
 from pathlib import Path
+from .references import ReferenceIndex, load_documents
+from .snapshot import load_snapshot
 
 # ANSI escape codes for text formatting
 RED = '\033[91m'
 RESET = '\033[0m'
 
+# Columns of the frequency table, in output order
+FREQUENCY_KEYS = (
+    'qubit',
+    'xy_intermediate_frequency',
+    'xy_lo_frequency',
+    'xy_total_frequency',
+    'rr_intermediate_frequency',
+    'rr_lo_frequency',
+    'rr_total_frequency',
+)
+
 def format_frequency(freq, threshold=400):
     """Format frequency with red if it's close to threshold in absolute value"""
     freq_str = f"{freq:8.3f}"  # Fixed width of 8 characters
@@ -16,105 +30,129 @@ def format_frequency(freq, threshold=400):
         return f"{RED}{freq_str}{RESET}"
     return freq_str
 
-def extract_frequencies(state_file_path, wiring_file_path):
-    # Load both files
-    with open(state_file_path, 'r') as f:
-        state = json.load(f)
-    with open(wiring_file_path, 'r') as f:
-        wiring = json.load(f)
-    
-    # Initialize lists to store frequencies
-    qubit_names = []
-    xy_if_freqs = []
-    xy_lo_freqs = []
-    xy_total_freqs = []
-    rr_if_freqs = []
-    rr_lo_freqs = []
-    rr_total_freqs = []
-    
-    # Create a mapping of port IDs to their frequencies
-    port_freq_map = {}
-    for controller_id, controller_data in state['ports']['mw_outputs'].items():
-        for fem_id, fem_data in controller_data.items():
-            for port_id, port_data in fem_data.items():
-                # Only add ports that have upconverter_frequency
-                if 'upconverter_frequency' in port_data:
-                    port_freq_map[(controller_id, int(fem_id), int(port_id))] = port_data['upconverter_frequency']
-    
-    # Extract frequencies for each qubit
+def qubit_frequency_row(qubit_name, qubit_data, wiring_qubits, index):
+    """Return (xy_if, xy_lo, xy_total, rr_if, rr_lo, rr_total) for a qubit, or None if its
+    XY or RR line does not resolve to a port with an upconverter frequency"""
+    if 'xy' not in qubit_data or 'resonator' not in qubit_data or qubit_name not in wiring_qubits:
+        return None
+
+    # Resolve the XY and RR port references from the wiring
+    xy_port = index.get(wiring_qubits[qubit_name]['xy']['opx_output'])
+    rr_port = index.get(wiring_qubits[qubit_name]['rr']['opx_output'])
+    if not isinstance(xy_port, dict) or not isinstance(rr_port, dict):
+        return None
+
+    # Get LO frequencies from the ports
+    xy_lo_freq = xy_port.get('upconverter_frequency')
+    rr_lo_freq = rr_port.get('upconverter_frequency')
+    if xy_lo_freq is None or rr_lo_freq is None:
+        return None
+
+    # Get intermediate frequencies and calculate total frequencies
+    xy_if_freq = qubit_data['xy'].get('intermediate_frequency', 0)
+    rr_if_freq = qubit_data['resonator'].get('intermediate_frequency', 0)
+    return (xy_if_freq, xy_lo_freq, xy_lo_freq + xy_if_freq,
+            rr_if_freq, rr_lo_freq, rr_lo_freq + rr_if_freq)
+
+def frequencies_from_documents(state, wiring, index=None):
+    """Extract the frequencies of all qubits from loaded state and wiring documents"""
+    if index is None:
+        index = ReferenceIndex(state, wiring)
+    wiring_qubits = wiring['wiring']['qubits']
+
+    output = {key: [] for key in FREQUENCY_KEYS}
     for qubit_name, qubit_data in state['qubits'].items():
-        # XY frequencies
-        if 'xy' in qubit_data:
-            # Get intermediate frequency
-            xy_if_freq = qubit_data['xy'].get('intermediate_frequency', 0)
-            
-            # Get port information from wiring
-            if qubit_name in wiring['wiring']['qubits']:
-                # XY port reference
-                xy_port_ref = wiring['wiring']['qubits'][qubit_name]['xy']['opx_output']
-                if xy_port_ref.startswith('#/ports/mw_outputs/'):
-                    # Extract port information from the reference
-                    path_parts = xy_port_ref.split('/')
-                    controller_id = path_parts[3]
-                    fem_id = int(path_parts[4])
-                    port_id = int(path_parts[5])
-                    
-                    # Get LO frequency from our mapping
-                    xy_lo_freq = port_freq_map.get((controller_id, fem_id, port_id))
-                    if xy_lo_freq is not None:
-                        # Calculate total frequency
-                        xy_total_freq = xy_lo_freq + xy_if_freq
-                        
-                        # RR frequencies
-                        if 'resonator' in qubit_data:
-                            rr_if_freq = qubit_data['resonator'].get('intermediate_frequency', 0)
-                            
-                            # Get RR port reference
-                            rr_port_ref = wiring['wiring']['qubits'][qubit_name]['rr']['opx_output']
-                            if rr_port_ref.startswith('#/ports/mw_outputs/'):
-                                # Extract port information from the reference
-                                path_parts = rr_port_ref.split('/')
-                                controller_id = path_parts[3]
-                                fem_id = int(path_parts[4])
-                                port_id = int(path_parts[5])
-                                
-                                # Get LO frequency from our mapping
-                                rr_lo_freq = port_freq_map.get((controller_id, fem_id, port_id))
-                                if rr_lo_freq is not None:
-                                    # Calculate total frequency
-                                    rr_total_freq = rr_lo_freq + rr_if_freq
-                                    
-                                    # Store all values
-                                    qubit_names.append(qubit_name)
-                                    xy_if_freqs.append(xy_if_freq)
-                                    xy_lo_freqs.append(xy_lo_freq)
-                                    xy_total_freqs.append(xy_total_freq)
-                                    rr_if_freqs.append(rr_if_freq)
-                                    rr_lo_freqs.append(rr_lo_freq)
-                                    rr_total_freqs.append(rr_total_freq)
-    
-    # Create a structured output
-    output = {
-        'qubit': qubit_names,
-        'xy_intermediate_frequency': xy_if_freqs,
-        'xy_lo_frequency': xy_lo_freqs,
-        'xy_total_frequency': xy_total_freqs,
-        'rr_intermediate_frequency': rr_if_freqs,
-        'rr_lo_frequency': rr_lo_freqs,
-        'rr_total_frequency': rr_total_freqs
-    }
-    
+        row = qubit_frequency_row(qubit_name, qubit_data, wiring_qubits, index)
+        if row is not None:
+            output['qubit'].append(qubit_name)
+            for key, value in zip(FREQUENCY_KEYS[1:], row):
+                output[key].append(value)
+
     return output
 
+def extract_frequencies(state_file_path, wiring_file_path):
+    # Prefer the binary snapshot saved alongside the state when it is up to date
+    snapshot = load_snapshot(state_file_path, wiring_file_path)
+    if snapshot is not None:
+        with snapshot:
+            return snapshot.frequencies()
+    state, wiring = load_documents(state_file_path, wiring_file_path)
+    return frequencies_from_documents(state, wiring)
+
+def print_frequency_table(qubit_data, threshold=400):
+    """Print (qubit, xy_if, xy_lo, xy_total, rr_if, rr_lo, rr_total) rows as a table"""
+    print("\nQubit Frequencies (sorted by total frequency):")
+    print("-" * 90)
+    print(f"{'Qubit':<6} {'XY IF':>8} {'XY LO':>8} {'XY Total':>8} {'RR IF':>8} {'RR LO':>8} {'RR Total':>8}")
+    print("-" * 90)
+    
+    for qubit, xy_if, xy_lo, xy_total, rr_if, rr_lo, rr_total in qubit_data:
+        # Convert to appropriate units
+        xy_if_freq = xy_if / 1e6
+        xy_lo_freq = xy_lo / 1e9
+        xy_total_freq = xy_total / 1e9
+        rr_if_freq = rr_if / 1e6
+        rr_lo_freq = rr_lo / 1e9
+        rr_total_freq = rr_total / 1e9
+        
+        # Format frequencies with red if they're close to threshold
+        xy_if_freq_str = format_frequency(xy_if_freq, threshold)
+        rr_if_freq_str = format_frequency(rr_if_freq, threshold)
+        
+        # Print with fixed column widths
+        print(f"{qubit:<6} {xy_if_freq_str:>8} {xy_lo_freq:8.3f} {xy_total_freq:8.3f} {rr_if_freq_str:>8} {rr_lo_freq:8.3f} {rr_total_freq:8.3f}")
+
+def watch_frequencies(state_file_path, wiring_file_path, threshold=400, output_path=None, output_format=None):
+    """Redraw the frequency table in place every time the state or wiring file is written.
+
+    With an output in a columnar format, the file is rewritten on every update, or
+    appended to for NDJSON, so it holds every snapshot.
+    """
+    # Imported here as the watch and export modules build on this one
+    from .watch import FrequencyTable, watch_files, CLEAR_SCREEN
+    from .export import frequency_rows_to_columns, write_columns
+
+    table = FrequencyTable()
+
+    def redraw():
+        try:
+            state, wiring = load_documents(state_file_path, wiring_file_path)
+        except (json.JSONDecodeError, FileNotFoundError):
+            # Caught the file mid-write, the end of the write triggers another update
+            return
+        start = time.perf_counter()
+        affected = table.update(state, wiring)
+        elapsed = time.perf_counter() - start
+        rows = table.sorted_rows()
+        if output_path:
+            write_columns(frequency_rows_to_columns(rows), output_path, output_format)
+        print(CLEAR_SCREEN, end='')
+        print_frequency_table(rows, threshold)
+        print(f"\nRecomputed {len(affected)} qubits in {elapsed * 1e3:.1f} ms at {time.strftime('%H:%M:%S')}, "
+              f"watching {state_file_path} (Ctrl+C to stop)")
+
+    redraw()
+    try:
+        watch_files([state_file_path, wiring_file_path], redraw)
+    except KeyboardInterrupt:
+        pass
+
 def main():
     parser = argparse.ArgumentParser(description='Collect and display frequency information from a state file')
     parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
                       help='Path to the directory containing state.json (default: QUAM_STATE_PATH environment variable)')
     parser.add_argument('--wiring-path', type=str, help='Path to the wiring file (default: wiring.json in state directory)')
-    parser.add_argument('--output', type=str, help='Path to save the output (optional)')
+    parser.add_argument('--output', type=str,
+                      help='Path to save the output (optional), as JSON or by suffix as .csv, .feather, .parquet or .ndjson')
+    parser.add_argument('--output-format', choices=['csv', 'feather', 'parquet', 'ndjson'],
+                      help='Columnar format of the output, overriding its suffix (NDJSON is appended to)')
     parser.add_argument('--threshold', type=float, default=400, help='Threshold for highlighting frequencies (default: 400 MHz)')
+    parser.add_argument('--watch', action='store_true',
+                      help='Keep running and redraw the table whenever the state or wiring file changes')
     args = parser.parse_args()
 
+    if args.output_format and not args.output:
+        parser.error("--output-format requires --output")
     if not args.state_path:
         raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
 
@@ -133,15 +171,30 @@ def main():
     if not wiring_path.exists():
         raise FileNotFoundError(f"Wiring file not found: {wiring_path}")
 
-    # Extract frequencies
-    frequencies = extract_frequencies(state_path, wiring_path)
-    
-    # Save to file if requested
+    output_format = None
     if args.output:
-        output_path = Path(args.output)
-        with open(output_path, 'w') as f:
-            json.dump(frequencies, f, indent=2)
-        print(f"Frequencies saved to {output_path}")
+        # Imported here as the export module builds on this one
+        from .export import export_format, frequency_columns, write_columns
+        output_format = export_format(args.output, args.output_format)
+
+    if output_format:
+        # Typed columns straight from the snapshot (or the documents), no per-qubit rows
+        columns = frequency_columns(state_path, wiring_path)
+        frequencies = {key: columns[key].tolist() for key in FREQUENCY_KEYS}
+        # While watching, the watcher writes every snapshot including this one
+        if not args.watch:
+            write_columns(columns, args.output, output_format)
+            print(f"Frequencies saved to {args.output}")
+    else:
+        # Extract frequencies
+        frequencies = extract_frequencies(state_path, wiring_path)
+    
+        # Save to file if requested
+        if args.output:
+            output_path = Path(args.output)
+            with open(output_path, 'w') as f:
+                json.dump(frequencies, f, indent=2)
+            print(f"Frequencies saved to {output_path}")
     
     # Create a list of tuples for sorting
     qubit_data = list(zip(
@@ -157,27 +210,11 @@ def main():
     # Sort by total frequency
     qubit_data.sort(key=lambda x: x[3])  # x[3] is xy_total_freq
     
-    # Print results in a table format
-    print("\nQubit Frequencies (sorted by total frequency):")
-    print("-" * 90)
-    print(f"{'Qubit':<6} {'XY IF':>8} {'XY LO':>8} {'XY Total':>8} {'RR IF':>8} {'RR LO':>8} {'RR Total':>8}")
-    print("-" * 90)
-    
-    for qubit, xy_if, xy_lo, xy_total, rr_if, rr_lo, rr_total in qubit_data:
-        # Convert to appropriate units
-        xy_if_freq = xy_if / 1e6
-        xy_lo_freq = xy_lo / 1e9
-        xy_total_freq = xy_total / 1e9
-        rr_if_freq = rr_if / 1e6
-        rr_lo_freq = rr_lo / 1e9
-        rr_total_freq = rr_total / 1e9
-        
-        # Format frequencies with red if they're close to threshold
-        xy_if_freq_str = format_frequency(xy_if_freq, args.threshold)
-        rr_if_freq_str = format_frequency(rr_if_freq, args.threshold)
-        
-        # Print with fixed column widths
-        print(f"{qubit:<6} {xy_if_freq_str:>8} {xy_lo_freq:8.3f} {xy_total_freq:8.3f} {rr_if_freq_str:>8} {rr_lo_freq:8.3f} {rr_total_freq:8.3f}")
+    print_frequency_table(qubit_data, args.threshold)
+
+    if args.watch:
+        watch_frequencies(state_path, wiring_path, args.threshold,
+                          args.output if output_format else None, output_format)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
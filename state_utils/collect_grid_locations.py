@@ -3,9 +3,17 @@ import json
 import argparse
 import os
 from pathlib import Path
+from .snapshot import load_snapshot
+from .export import FORMATS, export_format, grid_columns, write_columns
 
 def collect_grid_locations(state_file_path):
     """Collect grid locations from a state file."""
+    # Prefer the binary snapshot saved alongside the state when it is up to date
+    snapshot = load_snapshot(state_file_path)
+    if snapshot is not None:
+        with snapshot:
+            return snapshot.grid_locations()
+
     with open(state_file_path, 'r') as f:
         state = json.load(f)
 
@@ -23,11 +31,16 @@ def main():
     parser = argparse.ArgumentParser(description='Collect grid locations from a state file')
     parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
                       help='Path to the directory containing state.json (default: QUAM_STATE_PATH environment variable)')
-    parser.add_argument('--output', type=str, help='Path to save the grid locations as JSON (optional)')
+    parser.add_argument('--output', type=str,
+                      help='Path to save the grid locations (optional), in --format or by suffix as .csv, .feather, .parquet or .ndjson')
+    parser.add_argument('--output-format', choices=FORMATS,
+                      help='Columnar format of the output with int32 grid_x and grid_y, overriding its suffix (NDJSON is appended to)')
     parser.add_argument('--format', choices=['python', 'json'], default='python',
                       help='Output format (default: python)')
     args = parser.parse_args()
 
+    if args.output_format and not args.output:
+        parser.error("--output-format requires --output")
     if not args.state_path:
         raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
 
@@ -42,7 +55,11 @@ def main():
     grid_locations = collect_grid_locations(state_path)
 
     # Save to file if requested
-    if args.output:
+    output_format = export_format(args.output, args.output_format) if args.output else None
+    if output_format:
+        write_columns(grid_columns(grid_locations), args.output, output_format)
+        print(f"Grid locations saved to {args.output}")
+    elif args.output:
         output_path = Path(args.output)
         if args.format == 'json':
             with open(output_path, 'w') as f:
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 import json
+import time
 import argparse
 import os
 from pathlib import Path
 from collections import defaultdict
-from .collect_frequencies import extract_frequencies
+from .collect_frequencies import frequencies_from_documents
+from .references import ReferenceIndex, load_documents
+from .snapshot import load_snapshot
+from .export import FORMATS, export_format, pair_columns, write_columns
+from .transaction import StateTransaction, read_state
 
 # ANSI color codes
 RED = '\033[91m'
@@ -26,63 +31,58 @@ def parse_grid_location(location_str):
     x, y = map(int, location_str.split(','))
     return (x, y)
 
-def find_nearest_neighbors(state):
-    """Find all nearest neighbor pairs of qubits"""
-    # Create dictionary to store grid locations
+def grid_index(state):
+    """Return the parsed grid location of every qubit that has one"""
     grid_locations = {}
     for qubit_name, qubit_data in state['qubits'].items():
         if 'grid_location' in qubit_data:
             grid_locations[qubit_name] = parse_grid_location(qubit_data['grid_location'])
-    
-    # Find nearest neighbors
+    return grid_locations
+
+def grid_neighbors(grid_locations):
+    """Return the nearest neighbors of every qubit, in qubit order"""
+    # Index qubits by location so each neighbor lookup is a dict access
+    by_location = defaultdict(list)
+    for qubit_name, location in grid_locations.items():
+        by_location[location].append(qubit_name)
+
+    neighbors = {}
+    for qubit_name, (x, y) in grid_locations.items():
+        neighbors[qubit_name] = [
+            other
+            for location in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1))
+            for other in by_location.get(location, ())
+        ]
+    return neighbors
+
+def find_nearest_neighbors(state):
+    """Find all nearest neighbor pairs of qubits"""
+    return nearest_neighbor_pairs(grid_index(state))
+
+def nearest_neighbor_pairs(grid_locations):
+    """Find all nearest neighbor pairs of qubits from their parsed grid locations"""
+    neighbors = grid_neighbors(grid_locations)
+
+    # Keep the order of a pairwise scan over the qubits: (q1, q2) with q1 before q2
+    order = {qubit_name: i for i, qubit_name in enumerate(grid_locations)}
     nearest_neighbors = []
-    qubit_names = list(grid_locations.keys())
-    
-    for i in range(len(qubit_names)):
-        for j in range(i + 1, len(qubit_names)):
-            q1 = qubit_names[i]
-            q2 = qubit_names[j]
-            x1, y1 = grid_locations[q1]
-            x2, y2 = grid_locations[q2]
-            
-            # Check if qubits are adjacent (differ by 1 in either x or y)
-            if (abs(x1 - x2) == 1 and y1 == y2) or (abs(y1 - y2) == 1 and x1 == x2):
+    for q1 in grid_locations:
+        for q2 in sorted(neighbors[q1], key=order.get):
+            if order[q2] > order[q1]:
                 nearest_neighbors.append((q1, q2))
-    
+
     return nearest_neighbors
 
-def collect_qubit_pairs(state_file_path, wiring_file_path, write_to_state=False):
-    """Collect and optionally write qubit pairs to state file."""
-    # Load the state file
-    with open(state_file_path, 'r') as f:
-        state = json.load(f)
-    
-    # Get qubit frequencies using the existing function
-    frequencies_data = extract_frequencies(state_file_path, wiring_file_path)
-    
-    # Create a dictionary of total frequencies
-    frequencies = {}
-    for qubit, xy_total in zip(frequencies_data['qubit'], frequencies_data['xy_total_frequency']):
-        frequencies[qubit] = xy_total
-    
-    # Find nearest neighbors
-    nearest_neighbors = find_nearest_neighbors(state)
-    
-    # Create qubit_pairs dictionary
+def make_qubit_pairs(nearest_neighbors, frequencies):
+    """Create the qubit_pairs entries, with the higher-frequency qubit as control"""
     qubit_pairs = {}
-    
-    if write_to_state:
-        print("\nCreating Qubit Pairs in State File (Control -> Target):")
-    else:
-        print("\nPrinting Qubit Pairs (Control -> Target):")
-    
     for q1, q2 in nearest_neighbors:
         # Determine control and target based on frequency
         if frequencies[q1] > frequencies[q2]:
             control, target = q1, q2
         else:
             control, target = q2, q1
-        
+
         # Create pair key and data
         pair_key = f"{q1}-{q2}"
         qubit_pairs[pair_key] = {
@@ -90,27 +90,116 @@ def collect_qubit_pairs(state_file_path, wiring_file_path, write_to_state=False)
             "qubit_control": f"#/qubits/{control}",
             "qubit_target": f"#/qubits/{target}"
         }
-        
+    return qubit_pairs
+
+def print_qubit_pairs(qubit_pairs, frequencies):
+    """Print every pair as control -> target with colored frequencies"""
+    for pair_key, pair in qubit_pairs.items():
+        control = pair["qubit_control"].rsplit('/', 1)[1]
+        target = pair["qubit_target"].rsplit('/', 1)[1]
         freq_control_ghz = frequencies[control]/1e9
         freq_target_ghz = frequencies[target]/1e9
         color_control = get_frequency_color(freq_control_ghz)
         color_target = get_frequency_color(freq_target_ghz)
         print(f"{pair_key}: {control} ({color_control}{freq_control_ghz:.3f}{RESET} GHz) -> {target} ({color_target}{freq_target_ghz:.3f}{RESET} GHz)")
+
+def collect_qubit_pairs(state_file_path, wiring_file_path, write_to_state=False, with_frequencies=False):
+    """Collect and optionally write qubit pairs to state file.
+
+    With `with_frequencies`, returns the XY total frequency of every qubit as well.
+    """
+    # Read-only runs use the binary snapshot when it is up to date
+    snapshot = None if write_to_state else load_snapshot(state_file_path, wiring_file_path)
+    if snapshot is not None:
+        with snapshot:
+            frequencies_data = snapshot.frequencies()
+            grid_locations = {
+                qubit_name: parse_grid_location(location)
+                for qubit_name, location in snapshot.grid_locations().items()
+            }
+    else:
+        # Load the state and wiring files once and share the reference index
+        if write_to_state:
+            # Read the state under the lock and remember the revision the pairs are computed from
+            state, revision = read_state(state_file_path)
+            with open(wiring_file_path, 'r') as f:
+                wiring = json.load(f)
+        else:
+            state, wiring = load_documents(state_file_path, wiring_file_path)
+        index = ReferenceIndex(state, wiring)
+
+        # Get qubit frequencies using the existing function
+        frequencies_data = frequencies_from_documents(state, wiring, index)
+        grid_locations = grid_index(state)
+    
+    # Create a dictionary of total frequencies
+    frequencies = {}
+    for qubit, xy_total in zip(frequencies_data['qubit'], frequencies_data['xy_total_frequency']):
+        frequencies[qubit] = xy_total
+    
+    # Find nearest neighbors
+    nearest_neighbors = nearest_neighbor_pairs(grid_locations)
+    
+    # Create qubit_pairs dictionary
+    qubit_pairs = make_qubit_pairs(nearest_neighbors, frequencies)
     
     if write_to_state:
-        # Add qubit_pairs to state
-        state['qubit_pairs'] = qubit_pairs
-        
-        # Save updated state
-        with open(state_file_path, 'w') as f:
-            json.dump(state, f, indent=4)
+        print("\nCreating Qubit Pairs in State File (Control -> Target):")
+    else:
+        print("\nPrinting Qubit Pairs (Control -> Target):")
+    
+    print_qubit_pairs(qubit_pairs, frequencies)
+    
+    if write_to_state:
+        # Add qubit_pairs to state, failing rather than overwriting changes made since it was read
+        with StateTransaction(state_file_path, expected_revision=revision) as latest_state:
+            latest_state['qubit_pairs'] = qubit_pairs
         
         print(f"\nSuccessfully created {len(qubit_pairs)} qubit pairs in state file")
     else:
         print(f"\nFound {len(qubit_pairs)} qubit pairs (not written to state file)")
     
+    if with_frequencies:
+        return qubit_pairs, frequencies
     return qubit_pairs
 
+def watch_qubit_pairs(state_file_path, wiring_file_path, output_path=None, output_format=None):
+    """Redraw the qubit pairs in place every time the state or wiring file is written.
+
+    With an output in a columnar format, the file is rewritten on every update, or
+    appended to for NDJSON, so it holds every snapshot.
+    """
+    # Imported here as the watch module builds on the collectors
+    from .watch import FrequencyTable, PairTable, watch_files, CLEAR_SCREEN
+
+    frequency_table = FrequencyTable()
+    pair_table = PairTable()
+
+    def redraw():
+        try:
+            state, wiring = load_documents(state_file_path, wiring_file_path)
+        except (json.JSONDecodeError, FileNotFoundError):
+            # Caught the file mid-write, the end of the write triggers another update
+            return
+        start = time.perf_counter()
+        affected = frequency_table.update(state, wiring)
+        pair_table.update(state, frequency_table.xy_frequencies, affected)
+        elapsed = time.perf_counter() - start
+        qubit_pairs = pair_table.qubit_pairs()
+        if output_path:
+            write_columns(pair_columns(qubit_pairs, frequency_table.xy_frequencies), output_path, output_format)
+        print(CLEAR_SCREEN, end='')
+        print("\nPrinting Qubit Pairs (Control -> Target):")
+        print_qubit_pairs(qubit_pairs, frequency_table.xy_frequencies)
+        print(f"\nFound {len(qubit_pairs)} qubit pairs, recomputed {len(affected)} qubits in {elapsed * 1e3:.1f} ms "
+              f"at {time.strftime('%H:%M:%S')}, watching {state_file_path} (Ctrl+C to stop)")
+
+    redraw()
+    try:
+        watch_files([state_file_path, wiring_file_path], redraw)
+    except KeyboardInterrupt:
+        pass
+
 def main():
     parser = argparse.ArgumentParser(description='Collect and analyze qubit pairs from state and wiring files')
     parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
@@ -118,9 +207,20 @@ def main():
     parser.add_argument('--wiring-path', type=str, help='Path to the wiring file (default: wiring.json in state directory)')
     parser.add_argument('--write-to-state', action='store_true',
                       help='Write the qubit pairs back to the state file')
-    parser.add_argument('--output', type=str, help='Path to save qubit pairs as JSON (optional)')
+    parser.add_argument('--output', type=str,
+                      help='Path to save qubit pairs (optional), as JSON or by suffix as .csv, .feather, .parquet or .ndjson')
+    parser.add_argument('--output-format', choices=FORMATS,
+                      help='Columnar format of the output, overriding its suffix (NDJSON is appended to)')
+    parser.add_argument('--watch', action='store_true',
+                      help='Keep running and redraw the pairs whenever the state or wiring file changes')
     args = parser.parse_args()
 
+    if args.output_format and not args.output:
+        parser.error("--output-format requires --output")
+    if args.watch and args.write_to_state:
+        # Writing the pairs would trigger the watcher on its own output
+        parser.error("--watch cannot be combined with --write-to-state")
+
     if not args.state_path:
         raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
 
@@ -140,14 +240,21 @@ def main():
         raise FileNotFoundError(f"Wiring file not found: {wiring_path}")
 
     # Collect qubit pairs
-    qubit_pairs = collect_qubit_pairs(state_path, wiring_path, args.write_to_state)
+    output_format = export_format(args.output, args.output_format) if args.output else None
+    qubit_pairs, frequencies = collect_qubit_pairs(state_path, wiring_path, args.write_to_state, with_frequencies=True)
 
-    # Save to separate file if requested
-    if args.output:
+    # Save to separate file if requested, while watching the watcher writes every snapshot
+    if output_format and not args.watch:
+        write_columns(pair_columns(qubit_pairs, frequencies), args.output, output_format)
+        print(f"\nQubit pairs saved to {args.output}")
+    elif args.output and not output_format:
         output_path = Path(args.output)
         with open(output_path, 'w') as f:
             json.dump(qubit_pairs, f, indent=4)
         print(f"\nQubit pairs saved to {output_path}")
 
+    if args.watch:
+        watch_qubit_pairs(state_path, wiring_path, args.output if output_format else None, output_format)
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
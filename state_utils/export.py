@@ -0,0 +1,151 @@
+"""
+Columnar export of the collector outputs: CSV, Arrow IPC (Feather), Parquet and NDJSON
+"""
+
+import csv
+import json
+import time
+import numpy as np
+from pathlib import Path
+from .collect_frequencies import FREQUENCY_KEYS, frequencies_from_documents
+from .references import load_documents
+from .snapshot import load_snapshot
+
+FORMATS = ('csv', 'feather', 'parquet', 'ndjson')
+
+# Output suffixes that select a columnar format; other suffixes keep each tool's own output
+SUFFIX_FORMATS = {
+    '.csv': 'csv',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+    '.parquet': 'parquet',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+}
+
+def export_format(output_path, requested=None):
+    """Return the columnar format of an output, the requested one or the one of its
+    suffix, or None for the tool's own output"""
+    return requested or SUFFIX_FORMATS.get(Path(output_path).suffix.lower())
+
+def hz_column(values):
+    """Frequencies in Hz as float64, whatever the values, so every export of a column has
+    the same type and missing values are NaN"""
+    return np.asarray(values, dtype=np.float64)
+
+def _names(names):
+    return np.array(names, dtype=object)
+
+def frequency_columns(state_file_path, wiring_file_path):
+    """Return the frequency table as {column: array}, taken straight from the snapshot
+    columns when it is up to date"""
+    snapshot = load_snapshot(state_file_path, wiring_file_path)
+    if snapshot is not None:
+        with snapshot:
+            has_row = ~np.isnan(snapshot.column('xy_total_frequency'))
+            columns = {'qubit': _names(snapshot.qubits)[has_row]}
+            for key in FREQUENCY_KEYS[1:]:
+                # Boolean indexing copies out of the mapping, so the snapshot can be closed
+                columns[key] = hz_column(snapshot.column(key)[has_row])
+            return columns
+    state, wiring = load_documents(state_file_path, wiring_file_path)
+    return frequencies_to_columns(frequencies_from_documents(state, wiring))
+
+def frequencies_to_columns(frequencies):
+    """Convert the output of extract_frequencies to {column: array}"""
+    columns = {'qubit': _names(frequencies['qubit'])}
+    for key in FREQUENCY_KEYS[1:]:
+        columns[key] = hz_column(frequencies[key])
+    return columns
+
+def frequency_rows_to_columns(rows):
+    """Convert (qubit, xy_if, xy_lo, xy_total, rr_if, rr_lo, rr_total) rows to {column: array}"""
+    values = list(zip(*rows)) or [()] * len(FREQUENCY_KEYS)
+    return frequencies_to_columns(dict(zip(FREQUENCY_KEYS, values)))
+
+def parse_grid_locations(qubits, locations):
+    """Parse the "x,y" grid locations of the qubits into an int32 array of shape (n, 2).
+
+    Raises ValueError naming the qubit of the first location that is not two integers.
+    """
+    xy = np.empty((len(locations), 2), dtype=np.int32)
+    for i, (qubit_name, location) in enumerate(zip(qubits, locations)):
+        try:
+            x, y = location.split(',')
+            xy[i] = int(x), int(y)
+        except (AttributeError, ValueError, OverflowError):
+            raise ValueError(f"Invalid grid location of {qubit_name}: {location!r}, expected \"x,y\"") from None
+    return xy
+
+def grid_columns(grid_locations):
+    """Return {qubit: "x,y"} grid locations as qubit, grid_x and grid_y (int32) columns"""
+    xy = parse_grid_locations(list(grid_locations), list(grid_locations.values()))
+    return {'qubit': _names(list(grid_locations)), 'grid_x': xy[:, 0], 'grid_y': xy[:, 1]}
+
+def pair_columns(qubit_pairs, frequencies):
+    """Return qubit pairs as pair, qubit_control, qubit_target and their XY frequency columns"""
+    controls = [pair["qubit_control"].rsplit('/', 1)[1] for pair in qubit_pairs.values()]
+    targets = [pair["qubit_target"].rsplit('/', 1)[1] for pair in qubit_pairs.values()]
+    return {
+        'pair': _names(list(qubit_pairs)),
+        'qubit_control': _names(controls),
+        'qubit_target': _names(targets),
+        'control_xy_frequency': hz_column(np.fromiter((frequencies[q] for q in controls), np.float64, len(controls))),
+        'target_xy_frequency': hz_column(np.fromiter((frequencies[q] for q in targets), np.float64, len(targets))),
+    }
+
+def _require_pyarrow(output_format):
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(f"Writing {output_format} files requires pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+def to_arrow(columns):
+    """Build an Arrow table from the columns, numeric arrays are used without copying"""
+    pa = _require_pyarrow('Arrow')
+    return pa.table({name: pa.array(values) for name, values in columns.items()})
+
+def write_csv(columns, path):
+    try:
+        import pyarrow.csv
+    except ImportError:
+        # Without pyarrow, the rows are formatted by the csv module
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(zip(*(values.tolist() for values in columns.values())))
+        return
+    pyarrow.csv.write_csv(to_arrow(columns), str(path))
+
+def write_ndjson(columns, f, **fields):
+    """Write one JSON object per row, starting with the given fields (e.g. a timestamp)"""
+    names = list(columns)
+    for row in zip(*(values.tolist() for values in columns.values())):
+        record = dict(fields)
+        record.update(zip(names, row))
+        f.write(json.dumps(record) + '\n')
+    f.flush()
+
+def append_ndjson(columns, path, snapshot_time=None):
+    """Append the rows of one snapshot to an NDJSON file, each tagged with its time, so
+    successive runs or watch updates stream into one file"""
+    with open(path, 'a') as f:
+        write_ndjson(columns, f, time=time.time() if snapshot_time is None else snapshot_time)
+
+def write_columns(columns, path, output_format):
+    """Write the columns in a columnar format, NDJSON is appended to"""
+    if output_format == 'csv':
+        write_csv(columns, path)
+    elif output_format == 'feather':
+        _require_pyarrow(output_format)
+        import pyarrow.feather
+        pyarrow.feather.write_feather(to_arrow(columns), str(path))
+    elif output_format == 'parquet':
+        _require_pyarrow(output_format)
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(to_arrow(columns), str(path))
+    elif output_format == 'ndjson':
+        append_ndjson(columns, path)
+    else:
+        raise ValueError(f"Unknown export format {output_format!r}, expected one of {', '.join(FORMATS)}")
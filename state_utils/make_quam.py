@@ -1,8 +1,85 @@
 #!/usr/bin/env python3
+import sys
+import json
+import time
+import hashlib
 import argparse
+import tempfile
+import threading
 from pathlib import Path
-from quam_libs.components import QuAM
-from quam_libs.quam_builder.machine import build_quam
+from importlib import metadata
+from concurrent.futures import ProcessPoolExecutor
+from .snapshot import refresh_snapshot
+from .transaction import StateLock, atomic_write_json, replace_files
+
+# Inputs of the last build of a state directory, to skip rebuilding unchanged ones
+BUILD_RECORD = ".quam_build.json"
+
+# Held while build_staged redirects the saves of quam_libs' builder
+_builder_lock = threading.Lock()
+
+def _package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+def _canonical_hash(document):
+    canonical = json.dumps(document, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def octave_settings_for(octave_ip=None, octave_port=None):
+    """Return the octave settings passed to build_quam"""
+    if octave_ip:
+        return {"octave1": {"ip": octave_ip}}
+    elif octave_port:
+        return {"octave1": {"port": octave_port}}
+    return {}
+
+def build_inputs(state_path, octave_settings):
+    """Fingerprint the inputs of a build: the wiring content, octave settings and quam_libs version"""
+    with open(state_path / "wiring.json", 'r') as f:
+        wiring = json.load(f)
+    return {
+        # Hash the parsed content, so rewriting the file with other formatting is not a change
+        'wiring': _canonical_hash(wiring),
+        'octave_settings': _canonical_hash(octave_settings),
+        'quam_libs': _package_version('quam-libs'),
+    }
+
+def changed_inputs(state_path, inputs):
+    """Return the names of the inputs that changed since the last build, all of them if
+    there is no record of one or its state.json is gone"""
+    try:
+        with open(state_path / BUILD_RECORD, 'r') as f:
+            record = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return list(inputs)
+    if not (state_path / "state.json").exists():
+        return list(inputs)
+    return [name for name, value in inputs.items() if record.get('inputs', {}).get(name) != value]
+
+def build_staged(machine, state_path, staging, octave_settings):
+    """Run build_quam for the final state path, with the files it saves written to `staging`.
+
+    build_quam derives settings from the path it is given (e.g. the octave calibration
+    database), so it must see the final one; only its save_machine call is redirected.
+    """
+    from quam_libs.quam_builder import machine as builder
+
+    save_machine = builder.save_machine
+
+    def save_to_staging(machine, quam_state_path):
+        same = Path(quam_state_path).resolve() == Path(state_path).resolve()
+        save_machine(machine, staging if same else quam_state_path)
+
+    # The builder module is shared by the threads of the process
+    with _builder_lock:
+        builder.save_machine = save_to_staging
+        try:
+            return builder.build_quam(machine, quam_state_path=state_path, octaves_settings=octave_settings)
+        finally:
+            builder.save_machine = save_machine
 
 def create_quam(
     state_path: Path,
@@ -10,33 +87,104 @@ def create_quam(
     octave_port: int = None,
     overwrite: bool = False
 ):
-    """Create a QuAM configuration from a state directory."""
+    """Create a QuAM configuration from a state directory.
+
+    The build is skipped, returning None, when the wiring content, octave settings and
+    quam_libs version are those of the last build and its state.json is still there.
+    `overwrite` rebuilds regardless.
+    """
     # Check if state directory exists
     if not state_path.exists():
         raise FileNotFoundError(f"State directory not found: {state_path}")
-
-    # Load machine
-    machine = QuAM.load(state_path)
+    if not (state_path / "wiring.json").exists():
+        raise FileNotFoundError(f"Wiring file not found: {state_path / 'wiring.json'}")
 
     # Configure octave settings
-    octave_settings = {}
-    if octave_ip:
-        octave_settings = {"octave1": {"ip": octave_ip}}
-    elif octave_port:
-        octave_settings = {"octave1": {"port": octave_port}}
+    octave_settings = octave_settings_for(octave_ip, octave_port)
+
+    # Build under the write lock so no other writer interleaves with the rebuild
+    with StateLock(state_path, exclusive=True) as lock:
+        inputs = build_inputs(state_path, octave_settings)
+        if not overwrite and not changed_inputs(state_path, inputs):
+            return None
+
+        # Imported here so skipped builds do not pay for importing quam_libs
+        from quam_libs.components import QuAM
+
+        # Load machine
+        machine = QuAM.load(state_path)
 
-    # Make the QuAM object and save it
-    quam = build_quam(machine, quam_state_path=str(state_path), octaves_settings=octave_settings)
+        # Make the QuAM object, save it to a staging directory and move the files into place
+        with tempfile.TemporaryDirectory(dir=state_path) as staging:
+            quam = build_staged(machine, state_path, staging, octave_settings)
+            replace_files(staging, state_path)
+        lock.commit()
+        if (state_path / "state.json").exists():
+            refresh_snapshot(state_path / "state.json")
+
+        # Record the wiring as build_quam saved it, which is what the next run compares against
+        inputs = build_inputs(state_path, octave_settings)
+        atomic_write_json(state_path / BUILD_RECORD, {'inputs': inputs, 'built_at': time.time()}, indent=2)
     return quam
 
+def _build_directory(state_path, octave_ip, octave_port, overwrite):
+    """Build one directory of a batch in a worker process and return (status, detail, seconds)"""
+    start = time.perf_counter()
+    try:
+        if overwrite:
+            reason = "overwrite"
+        elif not (state_path / BUILD_RECORD).exists():
+            reason = "no previous build"
+        else:
+            # Name the changed inputs before the build records the new ones
+            changed = changed_inputs(state_path, build_inputs(state_path, octave_settings_for(octave_ip, octave_port)))
+            reason = f"changed: {', '.join(changed)}"
+        quam = create_quam(state_path, octave_ip, octave_port, overwrite)
+    except Exception as e:
+        return 'failed', f"{type(e).__name__}: {e}", time.perf_counter() - start
+    if quam is None:
+        return 'skipped', "inputs unchanged", time.perf_counter() - start
+    return 'built', reason, time.perf_counter() - start
+
+def build_batch(state_paths, octave_ip=None, octave_port=None, overwrite=False, workers=None):
+    """Build several state directories in parallel worker processes and return
+    {state_path: (status, detail, seconds)}"""
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {
+            state_path: executor.submit(_build_directory, state_path, octave_ip, octave_port, overwrite)
+            for state_path in state_paths
+        }
+        return {state_path: future.result() for state_path, future in futures.items()}
+
 def main():
     parser = argparse.ArgumentParser(description='Create a QuAM configuration from a state directory')
-    parser.add_argument('--state-path', type=str, required=True, help='Path to the state directory')
+    parser.add_argument('--state-path', type=str, help='Path to the state directory')
+    parser.add_argument('--batch', type=str, nargs='+', metavar='STATE_PATH',
+                      help='Build several state directories in parallel worker processes')
+    parser.add_argument('--workers', type=int, help='Worker processes in batch mode (default: one per CPU)')
     parser.add_argument('--octave-ip', type=str, help='IP address of the Octave (optional)')
     parser.add_argument('--octave-port', type=int, help='Port of the Octave (optional)')
-    parser.add_argument('--overwrite', action='store_true', help='Overwrite existing files')
+    parser.add_argument('--overwrite', action='store_true',
+                      help='Rebuild and overwrite the state files even if the inputs are unchanged')
     args = parser.parse_args()
 
+    if not args.state_path and not args.batch:
+        parser.error("either --state-path or --batch is required")
+
+    if args.batch:
+        start = time.perf_counter()
+        results = build_batch([Path(path) for path in args.batch], args.octave_ip, args.octave_port,
+                              args.overwrite, args.workers)
+        print(f"{'State directory':<50} {'Status':<8} {'Time':>8}  Detail")
+        for state_path, (status, detail, seconds) in results.items():
+            print(f"{str(state_path)[-50:]:<50} {status:<8} {seconds:>7.2f}s  {detail}")
+        counts = {status: sum(result[0] == status for result in results.values()) for status in ('built', 'skipped', 'failed')}
+        print(f"\n{counts['built']} built, {counts['skipped']} skipped, {counts['failed']} failed "
+              f"in {time.perf_counter() - start:.2f} s")
+        if counts['failed']:
+            sys.exit(1)
+        return
+
     # Convert path to Path object
     state_path = Path(args.state_path)
 
@@ -47,10 +195,14 @@ def main():
             octave_port=args.octave_port,
             overwrite=args.overwrite
         )
-        print(f"QuAM configuration created successfully in {state_path}")
+        if quam is None:
+            print(f"QuAM configuration in {state_path} is up to date (wiring, octave settings and quam_libs "
+                  f"unchanged), use --overwrite to rebuild")
+        else:
+            print(f"QuAM configuration created successfully in {state_path}")
     except Exception as e:
         print(f"Error creating QuAM configuration: {e}")
         raise
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
@@ -1,131 +1,299 @@
 #!/usr/bin/env python3
 import json
 import os
+import shutil
+import hashlib
 import argparse
+import multiprocessing
 from pathlib import Path
+from dataclasses import asdict, fields
+from importlib import metadata
 from qualang_tools.wirer.wirer.channel_specs import *
 from qualang_tools.wirer import Instruments, Connectivity, allocate_wiring, visualize
+from qualang_tools.wirer.connectivity.element import (
+    Element, Reference, ElementReference, QubitReference, QubitPairReference
+)
+from qualang_tools.wirer.connectivity.wiring_spec import WiringLineType
+from qualang_tools.wirer.instruments import instrument_channel
+from qualang_tools.wirer.instruments.instrument_channels import InstrumentChannels
 from quam_libs.quam_builder.machine import build_quam_wiring
+from .wiring_topology import DEFAULT_TOPOLOGY, load_topology, plan_wiring
+from .make_quam import BUILD_RECORD
+from .snapshot import refresh_snapshot
+from .transaction import StateLock, atomic_write_json
+
+# Files written by build_quam_wiring that are kept in the allocation cache
+CACHED_FILES = ("wiring.json", "state.json")
+# What the schematic is drawn from (the connectivity elements and the channels left unused),
+# kept in the cache entry as plain JSON so a cache hit can draw it without allocating again
+SCHEMATIC_FILE = "schematic.json"
+# Element ids a stored schematic can name
+ELEMENT_ID_TYPES = {cls.__name__: cls for cls in (Reference, ElementReference, QubitReference, QubitPairReference)}
+DEFAULT_CACHE_DIR = Path(os.environ.get("STATE_UTILS_CACHE_DIR", Path.home() / ".cache" / "state_utils")) / "wiring"
+
+def make_instruments(controllers):
+    """Define the available instrument setup from the controllers of a port plan."""
+    instruments = Instruments()
+    for con, slots in controllers.items():
+        if slots['mw_fem']:
+            instruments.add_mw_fem(controller=int(con), slots=slots['mw_fem'])
+        if slots['lf_fem']:
+            instruments.add_lf_fem(controller=int(con), slots=slots['lf_fem'])
+    return instruments
+
+def build_connectivity(plan):
+    """Turn a port plan from `plan_wiring` into connectivity constraints."""
+    connectivity = Connectivity()
+
+    # Single feed-line for reading the resonators of each group
+    for feedline in plan['feedlines']:
+        con, slot, in_port, out_port = feedline['resonator']
+        connectivity.add_resonator_line(
+            qubits=feedline['qubits'],
+            constraints=mw_fem_spec(con=con, slot=slot, in_port=in_port, out_port=out_port)
+        )
+
+    # Individual flux and drive lines
+    for entry in plan['qubits']:
+        con, slot, port = entry['flux']
+        connectivity.add_qubit_flux_lines(qubits=entry['qubit'], constraints=lf_fem_spec(con=con, out_slot=slot, out_port=port))
+        con, slot, port = entry['drive']
+        connectivity.add_qubit_drive_lines(qubits=entry['qubit'], constraints=mw_fem_spec(con=con, slot=slot, out_port=port))
+
+    return connectivity
+
+def allocate_plan(plan, connectivity):
+    """Allocate the connectivity one controller at a time and return the channels left unused.
+
+    `allocate_wiring` copies the pulsers of every instrument for each line it allocates,
+    which grows quadratically with the chip size. Every line of the plan is pinned to a
+    controller, so allocating against that controller's FEMs alone gives the same wiring.
+    """
+    specs = connectivity.specs
+    available_channels = InstrumentChannels()
+    for con, slots in plan['instruments'].items():
+        instruments = make_instruments({con: slots})
+        connectivity.specs = [spec for spec in specs if spec.constraints.channel_templates[0].con == int(con)]
+        allocate_wiring(connectivity, instruments)
+        for channel_type, channels in instruments.available_channels.items():
+            available_channels.stack.setdefault(channel_type, []).extend(channels)
+    connectivity.specs = []
+    return available_channels
+
+def _package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+def wiring_cache_key(plan, host_ip, cluster_name, port):
+    """Canonical hash of the connectivity constraints, instruments and network settings."""
+    payload = {
+        'plan': plan,
+        'network': {'host_ip': host_ip, 'cluster_name': cluster_name, 'port': port},
+        'versions': {name: _package_version(name) for name in ('qualang-tools', 'quam-libs')},
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _channel_type(name):
+    """Return the instrument channel class of a stored name, only subclasses of InstrumentChannel"""
+    cls = getattr(instrument_channel, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, instrument_channel.InstrumentChannel)):
+        raise ValueError(f"Unknown instrument channel type {name!r}")
+    return cls
+
+def schematic_to_json(elements, available_channels):
+    """Describe the schematic as JSON: every channel once, referenced by its position, so
+    channels shared by several elements stay shared"""
+    channels = []
+    positions = {}
+
+    def position(channel):
+        if id(channel) not in positions:
+            positions[id(channel)] = len(channels)
+            channels.append(dict({f.name: getattr(channel, f.name) for f in fields(channel) if f.init},
+                                 type=type(channel).__name__))
+        return positions[id(channel)]
+
+    described = [
+        {
+            'id': dict(asdict(element_id), type=type(element_id).__name__),
+            'lines': {line.name: [position(channel) for channel in line_channels]
+                      for line, line_channels in element.channels.items()},
+        }
+        for element_id, element in elements.items()
+    ]
+    unused = [position(channel) for line_channels in available_channels.stack.values() for channel in line_channels]
+    return {'channels': channels, 'elements': described, 'available_channels': unused}
+
+def schematic_from_json(schematic):
+    """Rebuild the (elements, available_channels) described by schematic_to_json"""
+    channels = []
+    for entry in schematic['channels']:
+        entry = dict(entry)
+        channels.append(_channel_type(entry.pop('type'))(**entry))
+    elements = {}
+    for entry in schematic['elements']:
+        id_fields = dict(entry['id'])
+        element_id = ELEMENT_ID_TYPES[id_fields.pop('type')](**id_fields)
+        element = elements[element_id] = Element(element_id)
+        element.channels = {WiringLineType[line]: [channels[i] for i in positions]
+                            for line, positions in entry['lines'].items()}
+    available_channels = InstrumentChannels()
+    for i in schematic['available_channels']:
+        available_channels.stack.setdefault(type(channels[i]), []).append(channels[i])
+    return elements, available_channels
+
+def save_schematic(directory, elements, available_channels):
+    """Store what the schematic is drawn from next to the cached wiring"""
+    path = Path(directory) / SCHEMATIC_FILE
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(schematic_to_json(elements, available_channels), f)
+    os.replace(tmp_path, path)
+
+def load_schematic(directory):
+    """Return the (elements, available_channels) stored with a cached wiring, or None"""
+    try:
+        with open(Path(directory) / SCHEMATIC_FILE, 'r') as f:
+            return schematic_from_json(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError, IndexError):
+        # Entries cached before the schematic was stored, or by another qualang_tools version
+        return None
+
+def render_wiring(elements, available_channels, image_path):
+    """Draw the wiring schematic into an image file without a display.
+
+    Runs in its own process (see create_wiring), as matplotlib is only safe to use from
+    the main thread of a process.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    try:
+        visualize(elements, available_channels=available_channels, use_matplotlib=True)
+    except TypeError:
+        # Older qualang_tools only draw with matplotlib
+        visualize(elements, available_channels=available_channels)
+
+    image_path = Path(image_path)
+    figures = plt.get_fignums()
+    for i, number in enumerate(figures):
+        path = image_path if len(figures) == 1 else image_path.with_name(f"{image_path.stem}_{i + 1}{image_path.suffix}")
+        plt.figure(number).savefig(path, bbox_inches="tight")
+    plt.close("all")
 
 def create_wiring(
     output_path: Path,
+    topology: dict = None,
     host_ip: str = "10.1.1.11",
     port: int = None,
     cluster_name: str = "Cluster_1",
     quantum_computer_backend: str = "qc_qwtune",
-    overwrite: bool = False
+    overwrite: bool = False,
+    headless: bool = False,
+    visualization_path: Path = None,
+    cache_dir: Path = DEFAULT_CACHE_DIR
 ):
-    """Create wiring configuration for LFFEM and MWFEM setup."""
-    # Delete existing state.json and wiring.json files if they exist and overwrite is True
-    state_file = output_path / "state.json"
-    wiring_file = output_path / "wiring.json"
-    
-    if overwrite:
-        if state_file.exists():
-            state_file.unlink()
-        if wiring_file.exists():
-            wiring_file.unlink()
-    elif state_file.exists() or wiring_file.exists():
-        raise FileExistsError("State or wiring files already exist. Use --overwrite to replace them.")
+    """Create wiring configuration for LFFEM and MWFEM setup.
 
-    # Define the available instrument setup
-    instruments = Instruments()
-    instruments.add_mw_fem(controller=1, slots=[1,2,3,4])
-    instruments.add_lf_fem(controller=1, slots=[5,6,7,8])
-
-    # Define which qubit indices are present in the system
-    qubitsA = ["A1", "A2", "A3", "A4", "A5", "A6"]
-    qubitsB = ["B1", "B2", "B3", "B4", "B5"]
-    qubitsC = ["C1", "C2", "C3", "C4", "C5"]
-    qubitsD = ["D1", "D2", "D3", "D4", "D5"]
-    qubits = qubitsA + qubitsB + qubitsC + qubitsD
-
-    # Must be list of tuples, each tuple is a pair of qubits that are coupled
-    qubit_pairs = []  # no couplers
-
-    # Allocate the wiring to the connectivity object based on the available instruments
-    connectivity = Connectivity()
+    The qubits, feed-lines and FEM slots come from a topology spec (see
+    `wiring_topology`); the built-in 21-qubit chip is used when none is given.
 
-    # Define any custom/hardcoded channel addresses
-    q_drive_chs = [
-        mw_fem_spec(con=1, slot=4, out_port=2),  # A1
-        mw_fem_spec(con=1, slot=4, out_port=3),  # A2
-        mw_fem_spec(con=1, slot=4, out_port=4),  # A3
-        mw_fem_spec(con=1, slot=4, out_port=5),  # A4
-        mw_fem_spec(con=1, slot=4, out_port=6),  # A5
-        mw_fem_spec(con=1, slot=4, out_port=7),  # A6
-        mw_fem_spec(con=1, slot=1, out_port=2),  # B1
-        mw_fem_spec(con=1, slot=1, out_port=3),  # B2
-        mw_fem_spec(con=1, slot=1, out_port=4),  # B3
-        mw_fem_spec(con=1, slot=1, out_port=5),  # B4
-        mw_fem_spec(con=1, slot=1, out_port=6),  # B5
-        mw_fem_spec(con=1, slot=2, out_port=2),  # C1
-        mw_fem_spec(con=1, slot=2, out_port=3),  # C2
-        mw_fem_spec(con=1, slot=2, out_port=4),  # C3
-        mw_fem_spec(con=1, slot=2, out_port=5),  # C4
-        mw_fem_spec(con=1, slot=2, out_port=6),  # C5
-        mw_fem_spec(con=1, slot=3, out_port=2),  # D1
-        mw_fem_spec(con=1, slot=3, out_port=3),  # D2
-        mw_fem_spec(con=1, slot=3, out_port=4),  # D3
-        mw_fem_spec(con=1, slot=3, out_port=5),  # D4
-        mw_fem_spec(con=1, slot=3, out_port=6),  # D5
-    ]
+    Allocations are cached in `cache_dir` (pass None to disable) under a hash of the
+    constraints and instruments, so identical requests reuse the stored wiring.json and
+    the channels the schematic is drawn from. In headless mode the schematic is not shown;
+    it is rendered to `visualization_path`, if one is given, by a background process.
+    """
+    # Allocate ports from the topology spec, failing early if the instruments run out of ports
+    plan = plan_wiring(topology or DEFAULT_TOPOLOGY)
 
-    q_flux_chs = [
-        lf_fem_spec(con=1, out_slot=8, out_port=1),  # A1
-        lf_fem_spec(con=1, out_slot=8, out_port=2),  # A2
-        lf_fem_spec(con=1, out_slot=8, out_port=3),  # A3
-        lf_fem_spec(con=1, out_slot=8, out_port=4),  # A4
-        lf_fem_spec(con=1, out_slot=8, out_port=5),  # A5
-        lf_fem_spec(con=1, out_slot=8, out_port=6),  # A6
-        lf_fem_spec(con=1, out_slot=5, out_port=1),  # B1
-        lf_fem_spec(con=1, out_slot=5, out_port=2),  # B2
-        lf_fem_spec(con=1, out_slot=5, out_port=3),  # B3
-        lf_fem_spec(con=1, out_slot=5, out_port=4),  # B4
-        lf_fem_spec(con=1, out_slot=5, out_port=5),  # B5
-        lf_fem_spec(con=1, out_slot=7, out_port=1),  # C1
-        lf_fem_spec(con=1, out_slot=7, out_port=2),  # C2
-        lf_fem_spec(con=1, out_slot=7, out_port=3),  # C3
-        lf_fem_spec(con=1, out_slot=7, out_port=4),  # C4
-        lf_fem_spec(con=1, out_slot=7, out_port=5),  # C5
-        lf_fem_spec(con=1, out_slot=6, out_port=1),  # D1
-        lf_fem_spec(con=1, out_slot=6, out_port=2),  # D2
-        lf_fem_spec(con=1, out_slot=6, out_port=3),  # D3
-        lf_fem_spec(con=1, out_slot=6, out_port=4),  # D4
-        lf_fem_spec(con=1, out_slot=6, out_port=5),  # D5
-    ]
+    # Hold the write lock of the output directory while the files are generated and patched
+    output_path.mkdir(parents=True, exist_ok=True)
+    with StateLock(output_path, exclusive=True) as lock:
+        # Delete existing state.json and wiring.json files if they exist and overwrite is True
+        state_file = output_path / "state.json"
+        wiring_file = output_path / "wiring.json"
+    
+        if overwrite:
+            if state_file.exists():
+                state_file.unlink()
+            if wiring_file.exists():
+                wiring_file.unlink()
+        elif state_file.exists() or wiring_file.exists():
+            raise FileExistsError("State or wiring files already exist. Use --overwrite to replace them.")
 
-    # Single feed-line for reading the resonators & individual qubit drive lines
-    qA_res_ch = mw_fem_spec(con=1, slot=4, in_port=1, out_port=1)
-    qB_res_ch = mw_fem_spec(con=1, slot=1, in_port=1, out_port=1)
-    qC_res_ch = mw_fem_spec(con=1, slot=2, in_port=1, out_port=1)
-    qD_res_ch = mw_fem_spec(con=1, slot=3, in_port=1, out_port=1)
+        cache_entry = None
+        if cache_dir is not None:
+            cache_entry = Path(cache_dir) / wiring_cache_key(plan, host_ip, cluster_name, port)
 
-    connectivity.add_resonator_line(qubits=qubitsA, constraints=qA_res_ch)
-    connectivity.add_resonator_line(qubits=qubitsB, constraints=qB_res_ch)
-    connectivity.add_resonator_line(qubits=qubitsC, constraints=qC_res_ch)
-    connectivity.add_resonator_line(qubits=qubitsD, constraints=qD_res_ch)
+        schematic = None
+        if cache_entry is not None and (cache_entry / "wiring.json").exists():
+            # Identical constraints and instruments were allocated before, reuse the result
+            for name in CACHED_FILES:
+                if (cache_entry / name).exists():
+                    shutil.copyfile(cache_entry / name, output_path / name)
+            print(f"Reusing cached wiring allocation {cache_entry.name[:12]}")
+            if not headless or visualization_path is not None:
+                schematic = load_schematic(cache_entry)
+                if schematic is None:
+                    # Allocate once more and store the result, later hits draw from the cache
+                    connectivity = build_connectivity(plan)
+                    schematic = (connectivity.elements, allocate_plan(plan, connectivity))
+                    save_schematic(cache_entry, *schematic)
+        else:
+            connectivity = build_connectivity(plan)
+            available_channels = allocate_plan(plan, connectivity)
+            schematic = (connectivity.elements, available_channels)
 
-    for i in range(len(qubits)):
-        connectivity.add_qubit_flux_lines(qubits=qubits[i], constraints=q_flux_chs[i])
-        connectivity.add_qubit_drive_lines(qubits=qubits[i], constraints=q_drive_chs[i])
+            # Build the wiring and network into a QuAM machine and save it as "wiring.json"
+            build_quam_wiring(connectivity, host_ip, cluster_name, str(output_path), port)
 
-    allocate_wiring(connectivity, instruments)
+            if cache_entry is not None:
+                # Fill the entry under a temporary name so concurrent runs never see partial files
+                staging = cache_entry.with_name(f"{cache_entry.name}.{os.getpid()}.tmp")
+                staging.mkdir(parents=True, exist_ok=True)
+                for name in CACHED_FILES:
+                    if (output_path / name).exists():
+                        shutil.copyfile(output_path / name, staging / name)
+                save_schematic(staging, *schematic)
+                try:
+                    staging.rename(cache_entry)
+                except OSError:
+                    # Another run stored the same allocation first
+                    shutil.rmtree(staging, ignore_errors=True)
 
-    # Build the wiring and network into a QuAM machine and save it as "wiring.json"
-    build_quam_wiring(connectivity, host_ip, cluster_name, str(output_path), port)
+        # Add quantum_computer_backend and cloud to the wiring.network
+        wiring_path = output_path / "wiring.json"
+        with open(wiring_path, "r") as f:
+            wiring = json.load(f)
+        wiring["network"]["quantum_computer_backend"] = quantum_computer_backend
+        wiring["network"]["cloud"] = True
+        atomic_write_json(wiring_path, wiring)
+        # state.json is back to the skeleton of build_quam_wiring, so make_quam must rebuild it
+        if (output_path / BUILD_RECORD).exists():
+            (output_path / BUILD_RECORD).unlink()
+        lock.commit()
+        if state_file.exists():
+            refresh_snapshot(state_file, wiring_path, wiring=wiring)
 
-    # Add quantum_computer_backend and cloud to the wiring.network
-    wiring_path = output_path / "wiring.json"
-    with open(wiring_path, "r") as f:
-        wiring = json.load(f)
-    wiring["network"]["quantum_computer_backend"] = quantum_computer_backend
-    wiring["network"]["cloud"] = True
-    with open(wiring_path, "w") as f:
-        json.dump(wiring, f, indent=4)
+    if headless and visualization_path is None:
+        return
 
-    # View wiring schematic
-    visualize(connectivity.elements, available_channels=instruments.available_channels)
+    elements, available_channels = schematic
+    if headless:
+        # Render the schematic to a file in a background process with the Agg backend; the
+        # interpreter waits for it on exit
+        multiprocessing.get_context("spawn").Process(
+            target=render_wiring,
+            args=(elements, available_channels, visualization_path),
+            name="wiring-render",
+        ).start()
+    else:
+        # View wiring schematic
+        visualize(elements, available_channels=available_channels)
 
 def main():
     parser = argparse.ArgumentParser(description='Create wiring configuration for LFFEM and MWFEM setup')
@@ -134,7 +302,14 @@ def main():
     parser.add_argument('--port', type=int, help='QOP Port')
     parser.add_argument('--cluster-name', type=str, default="Cluster_1", help='Name of the cluster')
     parser.add_argument('--quantum-computer-backend', type=str, default="qc_qwtune", help='Quantum computer backend name')
+    parser.add_argument('--topology', type=str, help='Path to the topology JSON file (default: built-in 21-qubit chip)')
     parser.add_argument('--overwrite', action='store_true', help='Overwrite existing files')
+    parser.add_argument('--headless', action='store_true', help='Do not show the wiring schematic')
+    parser.add_argument('--visualization-path', type=str,
+                      help='Render the wiring schematic to this image file in the background (implies --headless)')
+    parser.add_argument('--cache-dir', type=str, default=str(DEFAULT_CACHE_DIR),
+                      help=f'Directory of cached wiring allocations (default: {DEFAULT_CACHE_DIR}, or STATE_UTILS_CACHE_DIR/wiring)')
+    parser.add_argument('--no-cache', action='store_true', help='Always allocate the wiring, bypassing the cache')
     args = parser.parse_args()
 
     # Convert path to Path object
@@ -144,11 +319,15 @@ def main():
     try:
         create_wiring(
             output_path=output_path,
+            topology=load_topology(args.topology) if args.topology else None,
             host_ip=args.host_ip,
             port=args.port,
             cluster_name=args.cluster_name,
             quantum_computer_backend=args.quantum_computer_backend,
-            overwrite=args.overwrite
+            overwrite=args.overwrite,
+            headless=args.headless or args.visualization_path is not None,
+            visualization_path=Path(args.visualization_path) if args.visualization_path else None,
+            cache_dir=None if args.no_cache else Path(args.cache_dir)
         )
         print(f"Wiring configuration created successfully in {output_path}")
     except Exception as e:
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Routes of the state API, relative to the server URL:
+#   POST /v1/backends/{backend}/state/{datatype}          body {"data": ...} -> {"id": ...}
+#   GET  /v1/backends/{backend}/state/{datatype}/latest   -> {"id": ..., "data": ..., "created": ...}
+#   GET  /v1/stats                                        -> request counts per backend
+API_PREFIX = "/v1/backends/"
+
+class MockCloud:
+    """In-memory stand-in for the cloud state store: the datasets saved per backend and
+    datatype, and the request counts"""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.datasets = {}
+        self.requests = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    def count(self, backend):
+        with self._lock:
+            self.requests[backend] = self.requests.get(backend, 0) + 1
+
+    def request_counts(self):
+        """Return a copy of the request counts per backend"""
+        with self._lock:
+            return dict(self.requests)
+
+    def save(self, backend, datatype, data):
+        with self._lock:
+            dataset = {'id': self._next_id, 'data': data, 'created': time.time()}
+            self._next_id += 1
+            self.datasets.setdefault(backend, {}).setdefault(datatype, []).append(dataset)
+            return dataset['id']
+
+    def latest(self, backend, datatype):
+        with self._lock:
+            datasets = self.datasets.get(backend, {}).get(datatype)
+            return datasets[-1] if datasets else None
+
+def _make_handler(cloud):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            # Keep benchmarks quiet
+            pass
+
+        def _reply(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _route(self):
+            """Return (backend, datatype, rest) of an API path, or None"""
+            path = urlparse(self.path).path
+            if not path.startswith(API_PREFIX):
+                return None
+            parts = path[len(API_PREFIX):].split('/')
+            if len(parts) < 3 or parts[1] != 'state':
+                return None
+            return parts[0], parts[2], parts[3:]
+
+        def _handle(self, method):
+            if method == 'GET' and urlparse(self.path).path == "/v1/stats":
+                self._reply(200, {'requests': cloud.request_counts()})
+                return
+            route = self._route()
+            if route is None:
+                self._reply(404, {'error': f"Unknown path {self.path}"})
+                return
+            backend, datatype, rest = route
+            cloud.count(backend)
+            if cloud.latency:
+                time.sleep(cloud.latency)
+            if cloud.should_fail():
+                self._reply(503, {'error': "Injected failure"})
+                return
+
+            if method == 'POST' and not rest:
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length))
+                self._reply(201, {'id': cloud.save(backend, datatype, body['data'])})
+            elif method == 'GET' and rest == ['latest']:
+                dataset = cloud.latest(backend, datatype)
+                if dataset is None:
+                    self._reply(404, {'error': f"No {datatype} dataset for {backend}"})
+                else:
+                    self._reply(200, dataset)
+            else:
+                self._reply(404, {'error': f"Unknown path {self.path}"})
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+    return Handler
+
+def make_server(host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, seed=None):
+    """Create the mock cloud HTTP server, port 0 picks a free port (see server.server_address).
+
+    The store is available as `server.cloud`. Call `serve_forever()`, possibly in a thread.
+    """
+    cloud = MockCloud(latency, failure_rate, seed)
+    server = ThreadingHTTPServer((host, port), _make_handler(cloud))
+    server.daemon_threads = True
+    server.cloud = cloud
+    return server
+
+def start_server(**kwargs):
+    """Serve the mock cloud from a background thread and return (server, url)"""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, name="mock-cloud", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the cloud state API, for offline uploads and benchmarks')
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='Host to bind (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='Port to bind (default: 8765)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Delay added to every request in seconds (default: 0)')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                      help='Fraction of requests answered with 503, to test error handling (default: 0)')
+    parser.add_argument('--seed', type=int, help='Random seed of the injected failures')
+    args = parser.parse_args()
+
+    if not 0 <= args.failure_rate <= 1:
+        raise ValueError("--failure-rate must be between 0 and 1")
+
+    server = make_server(args.host, args.port, args.latency, args.failure_rate, args.seed)
+    print(f"Mock cloud serving on http://{args.host}:{server.server_address[1]} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
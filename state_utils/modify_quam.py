@@ -2,20 +2,27 @@
 import json
 import os
 import argparse
+import tempfile
 import numpy as np
 from pathlib import Path
 from qualang_tools.units import unit
 from quam_libs.components import QuAM
 from quam_libs.components.transmon import Transmon
 from quam_libs.quam_builder.machine import save_machine
+from .snapshot import refresh_snapshot
+from .state_diff import MerkleTree, diff_trees, group_by_qubit, format_changes
+from .transaction import StateLock, replace_files
+
+# Edges of the MW fem bands 1, 2 and 3 (Hz); the last edge is inclusive
+BAND_EDGES = (50e6, 4.5e9, 6.5e9, 10.5e9)
 
 def get_band(freq):
     """Determine the band for a given frequency."""
-    if 50e6 <= freq < 4.5e9:
+    if BAND_EDGES[0] <= freq < BAND_EDGES[1]:
         return 1
-    elif 4.5e9 <= freq < 6.5e9:
+    elif BAND_EDGES[1] <= freq < BAND_EDGES[2]:
         return 2
-    elif 6.5e9 <= freq <= 10.5e9:
+    elif BAND_EDGES[2] <= freq <= BAND_EDGES[3]:
         return 3
     else:
         raise ValueError(f"The specified frequency {freq} HZ is outside of the MW fem bandwidth [50 MHz, 10.5 GHz]")
@@ -72,16 +79,29 @@ def main():
     parser.add_argument('--config-path', type=str, help='Path to the configuration JSON file')
     parser.add_argument('--output-path', type=str, help='Path to save the modified state (default: same as input)')
     parser.add_argument('--qua-config-path', type=str, help='Path to save the QUA configuration (default: qua_config.json)')
+    parser.add_argument('--frequency-plan', type=str,
+                      help='Path to a frequency plan from solve_lo_if to apply with modify_quam (optional)')
+    parser.add_argument('--rr-max-power-dbm', type=float, help='Resonator full-scale power, required with --frequency-plan')
+    parser.add_argument('--xy-max-power-dbm', type=float, help='XY full-scale power, required with --frequency-plan')
+    parser.add_argument('--show-diff', action='store_true', help='Print the changes made to state.json, grouped by qubit')
     args = parser.parse_args()
 
+    if args.frequency_plan and (args.rr_max_power_dbm is None or args.xy_max_power_dbm is None):
+        parser.error("--frequency-plan requires --rr-max-power-dbm and --xy-max-power-dbm")
+
     # Convert paths to Path objects
     state_path = Path(args.state_path)
     if not state_path.exists():
         raise FileNotFoundError(f"State directory not found: {state_path}")
 
-    # Load machine
+    # Load machine under the read lock and remember its revision
     global machine
-    machine = QuAM.load(state_path)
+    with StateLock(state_path) as lock:
+        # Keep the hashes of the original state to report the changes, the saved state is diffed against them
+        if args.show_diff:
+            original_tree = MerkleTree(load_config(state_path / "state.json"))
+        machine = QuAM.load(state_path)
+        revision = lock.revision
     global u
     u = unit(coerce_to_integer=True)
 
@@ -113,6 +133,15 @@ def main():
     for name, qubit in machine.qubits.items():
         qubit.grid_location = grid[name]
 
+    # Apply the LOs and IFs chosen by solve_lo_if
+    if args.frequency_plan:
+        plan = load_config(args.frequency_plan)
+        modify_quam(
+            plan['qubits'],
+            rr_LO=plan['rr_LO'], xy_LO=plan['xy_LO'], rr_if=plan['rr_if'], xy_if=plan['xy_if'],
+            rr_max_power_dBm=args.rr_max_power_dbm, xy_max_power_dBm=args.xy_max_power_dbm
+        )
+
     # Add threading settings
     for name, qubit in machine.qubits.items():
         qubit.xy.thread = name
@@ -123,8 +152,18 @@ def main():
         qubit_pair.coupler.decouple_offset = 0.0
 
     # Save modified state
-    output_path = args.output_path or state_path
-    save_machine(machine, output_path)
+    output_path = Path(args.output_path or state_path)
+    with StateLock(output_path, exclusive=True) as lock:
+        # Fail rather than overwrite changes made to the state since it was loaded
+        if output_path.resolve() == state_path.resolve():
+            lock.check(revision)
+        # Save to a staging directory and move the files into place, so readers never see partial files
+        with tempfile.TemporaryDirectory(dir=output_path) as staging:
+            save_machine(machine, staging)
+            replace_files(staging, output_path)
+        lock.commit()
+        if (output_path / "state.json").exists():
+            refresh_snapshot(output_path / "state.json")
 
     # Save QUA configuration
     qua_config_path = args.qua_config_path or "qua_config.json"
@@ -132,6 +171,10 @@ def main():
         json.dump(machine.generate_config(), f, indent=4)
 
     print(f"Modified state saved to {output_path}")
+    if args.show_diff:
+        changes = diff_trees(original_tree, MerkleTree(load_config(output_path / "state.json")))
+        print(format_changes(group_by_qubit(changes, load_config(output_path / "wiring.json"))))
+        print(f"{len(changes)} changes to state.json")
     print(f"QUA configuration saved to {qua_config_path}")
 
 if __name__ == '__main__':
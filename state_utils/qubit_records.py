@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+import sys
+import argparse
+import warnings
+import numpy as np
+from pathlib import Path
+from .collect_frequencies import FREQUENCY_KEYS, qubit_frequency_row
+from .export import parse_grid_locations
+from .references import ReferenceIndex, load_documents
+from .snapshot import load_snapshot
+
+# Numeric fields kept per qubit, float64 with NaN for qubits without a frequency row
+FREQUENCY_FIELDS = FREQUENCY_KEYS[1:]
+
+# Grid coordinate of qubits without a grid location
+GRID_MISSING = np.iinfo(np.int32).min
+
+def _parse_grid(qubits, locations):
+    """Parse the "x,y" grid locations of the qubits (None if missing) into an int32 array
+    of shape (n, 2), ValueError naming the qubit of an invalid one"""
+    grid = np.full((len(locations), 2), GRID_MISSING, dtype=np.int32)
+    present = [i for i, location in enumerate(locations) if location is not None]
+    if present:
+        grid[present] = parse_grid_locations([qubits[i] for i in present], [locations[i] for i in present])
+    return grid
+
+class QubitRecord:
+    """Read-only view of one qubit of a QubitTable.
+
+    The frequency fields (see FREQUENCY_FIELDS) are attributes returning a float, or
+    None if the qubit has no frequency row.
+    """
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        object.__setattr__(self, '_table', table)
+        object.__setattr__(self, '_index', index)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("QubitRecord is read-only")
+
+    @property
+    def name(self):
+        return self._table.qubits[self._index]
+
+    @property
+    def grid(self):
+        """(x, y) grid coordinates, or None"""
+        x, y = self._table.grid[self._index].tolist()
+        return None if x == GRID_MISSING else (x, y)
+
+    @property
+    def grid_location(self):
+        """Grid location as in the state ("x,y"), or None"""
+        grid = self.grid
+        return None if grid is None else f"{grid[0]},{grid[1]}"
+
+    def as_dict(self):
+        record = {'qubit': self.name, 'grid_location': self.grid_location}
+        record.update((field, getattr(self, field)) for field in FREQUENCY_FIELDS)
+        return record
+
+    def __repr__(self):
+        return f"QubitRecord({self.name!r}, xy_total_frequency={self.xy_total_frequency})"
+
+def _field_property(field):
+    def get(self):
+        value = self._table.columns[field][self._index].item()
+        return None if value != value else value
+    return property(get)
+
+for _field in FREQUENCY_FIELDS:
+    setattr(QubitRecord, _field, _field_property(_field))
+
+class QubitTable:
+    """The qubits of one state as columns: a tuple of interned names, a float64 array per
+    frequency field and an int32 (n, 2) grid array, all read-only.
+
+    The methods returning dicts produce the formats of the collectors (extract_frequencies,
+    collect_grid_locations, grid_index), so tables can be passed to existing code.
+    """
+    __slots__ = ('label', 'qubits', 'columns', 'grid', '_positions')
+
+    def __init__(self, qubits, columns, grid, label=None):
+        self.label = label
+        self.qubits = tuple(sys.intern(str(name)) for name in qubits)
+        self.columns = {}
+        for field in FREQUENCY_FIELDS:
+            values = np.array(columns[field], dtype=np.float64)
+            values.flags.writeable = False
+            self.columns[field] = values
+        self.grid = np.array(grid, dtype=np.int32).reshape(len(self.qubits), 2)
+        self.grid.flags.writeable = False
+        self._positions = None
+
+    def __len__(self):
+        return len(self.qubits)
+
+    def __iter__(self):
+        return (QubitRecord(self, i) for i in range(len(self.qubits)))
+
+    def __contains__(self, qubit_name):
+        return qubit_name in self._position_index()
+
+    def __getitem__(self, qubit_name):
+        return QubitRecord(self, self.position(qubit_name))
+
+    def _position_index(self):
+        if self._positions is None:
+            self._positions = {name: i for i, name in enumerate(self.qubits)}
+        return self._positions
+
+    def position(self, qubit_name):
+        return self._position_index()[qubit_name]
+
+    def column(self, field):
+        """Return the read-only array of a frequency field, in qubit order"""
+        return self.columns[field]
+
+    @property
+    def nbytes(self):
+        """Bytes held by the arrays, the names are shared"""
+        return sum(values.nbytes for values in self.columns.values()) + self.grid.nbytes
+
+    def _has_row(self):
+        return ~np.isnan(self.columns['xy_total_frequency'])
+
+    def frequencies(self):
+        """Return the frequencies in the format of collect_frequencies.extract_frequencies"""
+        has_row = self._has_row()
+        output = {'qubit': [q for q, keep in zip(self.qubits, has_row.tolist()) if keep]}
+        for field in FREQUENCY_FIELDS:
+            output[field] = self.columns[field][has_row].tolist()
+        return output
+
+    def rows(self):
+        """Return (qubit, xy_if, xy_lo, xy_total, rr_if, rr_lo, rr_total) tuples, as printed
+        by collect_frequencies.print_frequency_table"""
+        frequencies = self.frequencies()
+        return list(zip(*(frequencies[key] for key in FREQUENCY_KEYS)))
+
+    def xy_frequencies(self):
+        """Return {qubit: XY total frequency}, as used by collect_qubit_pairs.make_qubit_pairs"""
+        frequencies = self.frequencies()
+        return dict(zip(frequencies['qubit'], frequencies['xy_total_frequency']))
+
+    def grid_index(self):
+        """Return {qubit: (x, y)}, the format of collect_qubit_pairs.grid_index"""
+        has_grid = self.grid[:, 0] != GRID_MISSING
+        return {q: tuple(xy) for q, xy, keep in zip(self.qubits, self.grid.tolist(), has_grid.tolist()) if keep}
+
+    def grid_locations(self):
+        """Return {qubit: "x,y"}, the format of collect_grid_locations"""
+        return {q: f"{x},{y}" for q, (x, y) in self.grid_index().items()}
+
+def table_from_snapshot(snapshot, label=None):
+    """Build a table from an open state snapshot, copying its columns out of the mapping"""
+    columns = {field: snapshot.column(field) for field in FREQUENCY_FIELDS}
+    return QubitTable(snapshot.qubits, columns, _parse_grid(snapshot.qubits, snapshot.header['grid_locations']), label)
+
+def table_from_documents(state, wiring, label=None, index=None):
+    """Build a table from loaded state and wiring documents"""
+    if index is None:
+        index = ReferenceIndex(state, wiring)
+    wiring_qubits = wiring['wiring']['qubits']
+    qubits = state.get('qubits', {})
+    columns = {field: np.full(len(qubits), np.nan) for field in FREQUENCY_FIELDS}
+    locations = []
+    for i, (qubit_name, qubit_data) in enumerate(qubits.items()):
+        row = qubit_frequency_row(qubit_name, qubit_data, wiring_qubits, index)
+        if row is not None:
+            for field, value in zip(FREQUENCY_FIELDS, row):
+                columns[field][i] = value
+        locations.append(qubit_data.get('grid_location'))
+    return QubitTable(list(qubits), columns, _parse_grid(list(qubits), locations), label)
+
+def load_table(state_file_path, wiring_file_path=None, label=None):
+    """Load one state into a table, from its snapshot when it is up to date"""
+    state_file_path = Path(state_file_path)
+    wiring_file_path = Path(wiring_file_path) if wiring_file_path else state_file_path.with_name('wiring.json')
+    snapshot = load_snapshot(state_file_path, wiring_file_path)
+    if snapshot is not None:
+        with snapshot:
+            return table_from_snapshot(snapshot, label)
+    state, wiring = load_documents(state_file_path, wiring_file_path)
+    return table_from_documents(state, wiring, label)
+
+class SnapshotSeries:
+    """A sequence of QubitTables, e.g. historical states for drift analysis.
+
+    Tables with the same qubits share one name tuple, so a snapshot costs its arrays
+    (64 bytes per qubit) plus a few small objects.
+    """
+
+    def __init__(self, tables=()):
+        self.tables = []
+        self._names = {}
+        for table in tables:
+            self.add(table)
+
+    def add(self, table):
+        table.qubits = self._names.setdefault(table.qubits, table.qubits)
+        self.tables.append(table)
+        return table
+
+    def load(self, state_file_path, wiring_file_path=None, label=None):
+        """Load a state and append its table"""
+        return self.add(load_table(state_file_path, wiring_file_path, label))
+
+    def __len__(self):
+        return len(self.tables)
+
+    def __iter__(self):
+        return iter(self.tables)
+
+    def __getitem__(self, i):
+        return self.tables[i]
+
+    @property
+    def qubits(self):
+        """All qubits of the series, in order of first appearance"""
+        seen = {}
+        for names in self._names:
+            for name in names:
+                seen.setdefault(name, None)
+        return list(seen)
+
+    @property
+    def nbytes(self):
+        return sum(table.nbytes for table in self.tables)
+
+    def matrix(self, field):
+        """Return a (snapshots, qubits) float64 array of a field over the series, aligned on
+        `qubits`, with NaN where a snapshot lacks a qubit or its row"""
+        qubits = self.qubits
+        columns = {name: i for i, name in enumerate(qubits)}
+        # The position of each name tuple's qubits in the union, computed once per tuple
+        positions = {names: np.array([columns[name] for name in names], dtype=np.intp) for names in self._names}
+        matrix = np.full((len(self.tables), len(qubits)), np.nan)
+        for i, table in enumerate(self.tables):
+            matrix[i, positions[table.qubits]] = table.columns[field]
+        return matrix
+
+def load_series(state_paths):
+    """Load the state.json of each state directory (or state file) into a SnapshotSeries"""
+    series = SnapshotSeries()
+    for path in state_paths:
+        path = Path(path)
+        state_file = path / "state.json" if path.is_dir() else path
+        series.load(state_file, label=str(path))
+    return series
+
+def main():
+    parser = argparse.ArgumentParser(description='Load many states into compact qubit tables and report the drift of a frequency')
+    parser.add_argument('state_paths', type=str, nargs='+', help='State directories or state.json files, oldest first')
+    parser.add_argument('--field', choices=FREQUENCY_FIELDS, default='xy_total_frequency',
+                      help='Frequency to report the drift of (default: xy_total_frequency)')
+    parser.add_argument('--top', type=int, default=10, help='Qubits with the largest drift to list (default: 10)')
+    args = parser.parse_args()
+
+    for path in args.state_paths:
+        path = Path(path)
+        if not (path / "state.json" if path.is_dir() else path).exists():
+            raise FileNotFoundError(f"State file not found: {path}")
+
+    series = load_series(args.state_paths)
+    matrix = series.matrix(args.field)
+    qubits = series.qubits
+    print(f"Loaded {len(series)} snapshots of {len(qubits)} qubits into {series.nbytes / 1024:.1f} KiB of arrays")
+
+    with warnings.catch_warnings():
+        # Qubits without a row in any snapshot give all-NaN columns
+        warnings.simplefilter('ignore', RuntimeWarning)
+        drift = np.nanmax(matrix, axis=0) - np.nanmin(matrix, axis=0)
+    order = [i for i in np.argsort(-np.nan_to_num(drift, nan=-1.0)) if not np.isnan(drift[i])][:args.top]
+    print(f"\nLargest drift of {args.field}:")
+    print(f"{'Qubit':<10} {'Drift (MHz)':>12} {'First (GHz)':>12} {'Last (GHz)':>12}")
+    for i in order:
+        column = matrix[:, i][~np.isnan(matrix[:, i])]
+        print(f"{qubits[i]:<10} {drift[i] / 1e6:>12.3f} {column[0] / 1e9:>12.4f} {column[-1] / 1e9:>12.4f}")
+
+if __name__ == '__main__':
+    main()
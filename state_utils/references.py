@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import json
+import argparse
+import os
+from pathlib import Path
+
+REFERENCE_PREFIX = '#/'
+
+_MISSING = object()
+
+def escape_key(key):
+    """Escape a key for use in a reference (JSON pointer rules)"""
+    key = str(key)
+    if '~' in key or '/' in key:
+        key = key.replace('~', '~0').replace('/', '~1')
+    return key
+
+class ReferenceIndex:
+    """Index of the state and wiring documents by "#/..." reference.
+
+    The documents are walked once; every dict and list is stored under its reference so
+    that resolving a reference is a single dict lookup, whatever the shape of the ports.
+    Leaf values are resolved through their parent and memoized on first use. All string
+    values that are references themselves are recorded so dangling ones can be reported.
+    """
+
+    def __init__(self, *documents):
+        # QuAM splits one root object over state.json and wiring.json
+        root = {}
+        for document in documents:
+            root.update(document)
+        self.root = root
+        self.nodes = {'#': root}
+        self.references = []
+        self._walk(root)
+
+    def _walk(self, root):
+        nodes = self.nodes
+        references = self.references
+        stack = [('#', root)]
+        while stack:
+            location, node = stack.pop()
+            items = node.items() if isinstance(node, dict) else enumerate(node)
+            for key, value in items:
+                child = f"{location}/{escape_key(key)}"
+                if isinstance(value, (dict, list)):
+                    nodes[child] = value
+                    stack.append((child, value))
+                elif isinstance(value, str) and value.startswith(REFERENCE_PREFIX):
+                    references.append((child, value))
+
+    def resolve(self, reference, default=_MISSING):
+        """Return the node a reference points to"""
+        node = self._lookup(reference)
+        if node is _MISSING:
+            if default is _MISSING:
+                raise KeyError(f"Dangling reference: {reference}")
+            return default
+        return node
+
+    def get(self, reference, default=None):
+        return self.resolve(reference, default)
+
+    def _lookup(self, reference):
+        node = self.nodes.get(reference, _MISSING)
+        if node is _MISSING:
+            node = self._resolve_leaf(reference)
+        return node
+
+    def _resolve_leaf(self, reference):
+        parent_ref, _, key = reference.rpartition('/')
+        parent = self.nodes.get(parent_ref, _MISSING)
+        if parent is _MISSING or not parent_ref:
+            return _MISSING
+        key = key.replace('~1', '/').replace('~0', '~')
+        if isinstance(parent, dict):
+            value = parent.get(key, _MISSING)
+        elif key.isdigit() and int(key) < len(parent):
+            value = parent[int(key)]
+        else:
+            value = _MISSING
+        if value is not _MISSING:
+            self.nodes[reference] = value
+        return value
+
+    def __contains__(self, reference):
+        return self._lookup(reference) is not _MISSING
+
+    def dangling_references(self):
+        """Return (location, reference) for every reference that does not resolve"""
+        return [(location, reference) for location, reference in self.references if reference not in self]
+
+def qubit_of(location):
+    """Return the qubit a "#/qubits/..." or "#/wiring/qubits/..." location belongs to, if any"""
+    parts = location.split('/')
+    if len(parts) > 2 and parts[1] == 'qubits':
+        return parts[2]
+    if len(parts) > 3 and parts[1] == 'wiring' and parts[2] == 'qubits':
+        return parts[3]
+    return None
+
+def resolve_pointer(root, reference, default=None):
+    """Resolve a single reference by walking the document, without building an index"""
+    node = root
+    for key in reference[len(REFERENCE_PREFIX):].split('/'):
+        key = key.replace('~1', '/').replace('~0', '~')
+        if isinstance(node, dict) and key in node:
+            node = node[key]
+        elif isinstance(node, list) and key.isdigit() and int(key) < len(node):
+            node = node[int(key)]
+        else:
+            return default
+    return node
+
+def load_documents(state_file_path, wiring_file_path):
+    """Load the state and wiring files."""
+    with open(state_file_path, 'r') as f:
+        state = json.load(f)
+    with open(wiring_file_path, 'r') as f:
+        wiring = json.load(f)
+    return state, wiring
+
+def main():
+    parser = argparse.ArgumentParser(description='Report references in the state and wiring files that do not resolve')
+    parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
+                      help='Path to the directory containing state.json (default: QUAM_STATE_PATH environment variable)')
+    parser.add_argument('--wiring-path', type=str, help='Path to the wiring file (default: wiring.json in state directory)')
+    args = parser.parse_args()
+
+    if not args.state_path:
+        raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
+
+    state_dir = Path(args.state_path)
+    state_path = state_dir / "state.json"
+    wiring_path = Path(args.wiring_path) if args.wiring_path else state_dir / "wiring.json"
+
+    if not state_path.exists():
+        raise FileNotFoundError(f"State file not found: {state_path}")
+    if not wiring_path.exists():
+        raise FileNotFoundError(f"Wiring file not found: {wiring_path}")
+
+    index = ReferenceIndex(*load_documents(state_path, wiring_path))
+    dangling = index.dangling_references()
+
+    print(f"\nChecked {len(index.references)} references, {len(dangling)} dangling")
+    for location, reference in dangling:
+        print(f"{location}: {reference}")
+
+if __name__ == '__main__':
+    main()
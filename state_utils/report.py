@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+import sys
+import json
+import argparse
+import os
+import importlib
+from pathlib import Path
+from .references import ReferenceIndex, load_documents
+from .collect_frequencies import FREQUENCY_KEYS, qubit_frequency_row
+from .collect_qubit_pairs import parse_grid_location, nearest_neighbor_pairs, make_qubit_pairs
+
+class ReportContext:
+    """What analyzers share during a run: the documents, their reference index and the
+    results of the analyzers that finished before them"""
+
+    def __init__(self, state, wiring, index):
+        self.state = state
+        self.wiring = wiring
+        self.index = index
+        self.wiring_qubits = wiring.get('wiring', {}).get('qubits', {})
+        self.results = {}
+
+class Analyzer:
+    """Base class of report analyzers.
+
+    Every run of the pipeline calls `start` once, `visit` for every qubit during its
+    single pass over the state, then `finish` once, in registration order. Per-run state
+    belongs in `start`, so an analyzer can be run again, e.g. on every update of a watched
+    state. Analyzers listed in `requires` must be registered before this one; their
+    results are in `context.results`.
+    """
+
+    name = None
+    requires = ()
+
+    def start(self, context):
+        pass
+
+    def visit(self, qubit_name, qubit_data, wiring_qubit, context):
+        pass
+
+    def finish(self, context):
+        """Return the result of the run, None by default"""
+        return None
+
+    def records(self, result):
+        """Flat records of a result, one NDJSON line or table row each"""
+        if isinstance(result, dict):
+            for key, value in result.items():
+                yield value if isinstance(value, dict) else {'key': key, 'value': value}
+        elif isinstance(result, list):
+            for value in result:
+                yield value if isinstance(value, dict) else {'value': value}
+        else:
+            yield {'value': result}
+
+class FrequencyAnalyzer(Analyzer):
+    """XY and RR frequencies of every qubit, in the format of `extract_frequencies`"""
+
+    name = 'frequencies'
+
+    def start(self, context):
+        self.output = {key: [] for key in FREQUENCY_KEYS}
+
+    def visit(self, qubit_name, qubit_data, wiring_qubit, context):
+        row = qubit_frequency_row(qubit_name, qubit_data, context.wiring_qubits, context.index)
+        if row is not None:
+            self.output['qubit'].append(qubit_name)
+            for key, value in zip(FREQUENCY_KEYS[1:], row):
+                self.output[key].append(value)
+
+    def finish(self, context):
+        return self.output
+
+    def records(self, result):
+        for row in zip(*(result[key] for key in FREQUENCY_KEYS)):
+            yield dict(zip(FREQUENCY_KEYS, row))
+
+class GridLocationAnalyzer(Analyzer):
+    """Grid location of every qubit that has one, as `collect_grid_locations` returns them"""
+
+    name = 'grid_locations'
+
+    def start(self, context):
+        self.grid_locations = {}
+
+    def visit(self, qubit_name, qubit_data, wiring_qubit, context):
+        if 'grid_location' in qubit_data:
+            self.grid_locations[qubit_name] = qubit_data['grid_location']
+
+    def finish(self, context):
+        return self.grid_locations
+
+    def records(self, result):
+        for qubit_name, location in result.items():
+            yield {'qubit': qubit_name, 'grid_location': location}
+
+class QubitPairAnalyzer(Analyzer):
+    """Nearest-neighbor qubit pairs with the higher-frequency qubit as control"""
+
+    name = 'qubit_pairs'
+    requires = ('frequencies', 'grid_locations')
+
+    def finish(self, context):
+        frequencies = context.results['frequencies']
+        xy_frequencies = dict(zip(frequencies['qubit'], frequencies['xy_total_frequency']))
+        grid_locations = {
+            qubit_name: parse_grid_location(location)
+            for qubit_name, location in context.results['grid_locations'].items()
+        }
+        return make_qubit_pairs(nearest_neighbor_pairs(grid_locations), xy_frequencies)
+
+    def records(self, result):
+        for pair in result.values():
+            yield {
+                'id': pair['id'],
+                'control': pair['qubit_control'].rsplit('/', 1)[1],
+                'target': pair['qubit_target'].rsplit('/', 1)[1],
+            }
+
+BUILTIN_ANALYZERS = (FrequencyAnalyzer, GridLocationAnalyzer, QubitPairAnalyzer)
+
+def load_analyzer(spec):
+    """Instantiate an analyzer class given as "module:Class" """
+    module_name, _, class_name = spec.partition(':')
+    if not module_name or not class_name:
+        raise ValueError(f"Analyzer must be given as module:Class, got {spec!r}")
+    analyzer = getattr(importlib.import_module(module_name), class_name)()
+    if not getattr(analyzer, 'name', None):
+        raise ValueError(f"Analyzer {spec} has no name")
+    return analyzer
+
+class ReportPipeline:
+    """Runs a set of analyzers over the qubits of a state in a single pass"""
+
+    def __init__(self, analyzers=None):
+        self.analyzers = []
+        for analyzer in analyzers if analyzers is not None else [cls() for cls in BUILTIN_ANALYZERS]:
+            self.add(analyzer)
+
+    def add(self, analyzer):
+        names = [registered.name for registered in self.analyzers]
+        if analyzer.name in names:
+            raise ValueError(f"Analyzer {analyzer.name} is already registered")
+        missing = [name for name in analyzer.requires if name not in names]
+        if missing:
+            raise ValueError(f"Analyzer {analyzer.name} requires {', '.join(missing)} to be registered first")
+        self.analyzers.append(analyzer)
+
+    def run(self, state, wiring, index=None):
+        """Feed every qubit to the analyzers and return {analyzer name: result}"""
+        context = ReportContext(state, wiring, index if index is not None else ReferenceIndex(state, wiring))
+        for analyzer in self.analyzers:
+            analyzer.start(context)
+        for qubit_name, qubit_data in state['qubits'].items():
+            wiring_qubit = context.wiring_qubits.get(qubit_name)
+            for analyzer in self.analyzers:
+                analyzer.visit(qubit_name, qubit_data, wiring_qubit, context)
+        for analyzer in self.analyzers:
+            context.results[analyzer.name] = analyzer.finish(context)
+        return context.results
+
+def _format_cell(value):
+    # Frequencies are in Hz, group the digits rather than switching to exponents
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and abs(value) >= 1e3:
+        return f"{value:,.0f}"
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
+
+def write_report(report, analyzers, output_format, f):
+    """Write a report as JSON, NDJSON (one record per line, tagged by analyzer) or tables"""
+    if output_format == 'json':
+        json.dump(report, f, indent=2)
+        f.write('\n')
+        return
+
+    for analyzer in analyzers:
+        records = analyzer.records(report[analyzer.name])
+        if output_format == 'ndjson':
+            for record in records:
+                f.write(json.dumps({'analyzer': analyzer.name, **record}) + '\n')
+            continue
+
+        records = list(records)
+        columns = list(dict.fromkeys(key for record in records for key in record))
+        rows = [[_format_cell(record.get(column, '')) for column in columns] for record in records]
+        widths = [max([len(column)] + [len(row[i]) for row in rows]) for i, column in enumerate(columns)]
+        f.write(f"\n{analyzer.name} ({len(records)} records):\n")
+        f.write(' '.join(column.ljust(width) for column, width in zip(columns, widths)) + '\n')
+        f.write('-' * (sum(widths) + len(widths) - 1) + '\n')
+        for row in rows:
+            f.write(' '.join(cell.ljust(width) for cell, width in zip(row, widths)) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect frequencies, grid locations, qubit pairs and custom analyses in one pass')
+    parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
+                      help='Path to the directory containing state.json (default: QUAM_STATE_PATH environment variable)')
+    parser.add_argument('--wiring-path', type=str, help='Path to the wiring file (default: wiring.json in state directory)')
+    parser.add_argument('--format', choices=['table', 'json', 'ndjson'], default='table', help='Output format (default: table)')
+    parser.add_argument('--analyzer', action='append', default=[], metavar='MODULE:CLASS',
+                      help='Additional analyzer to run, can be given several times')
+    parser.add_argument('--only', nargs='+', metavar='NAME',
+                      help='Only run these built-in analyzers and those they require (default: frequencies, grid_locations, qubit_pairs)')
+    parser.add_argument('--output', type=str, help='Path to save the report (default: print to console)')
+    args = parser.parse_args()
+
+    if not args.state_path:
+        raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
+
+    state_dir = Path(args.state_path)
+    state_path = state_dir / "state.json"
+    wiring_path = Path(args.wiring_path) if args.wiring_path else state_dir / "wiring.json"
+
+    if not state_path.exists():
+        raise FileNotFoundError(f"State file not found: {state_path}")
+    if not wiring_path.exists():
+        raise FileNotFoundError(f"Wiring file not found: {wiring_path}")
+
+    builtins = {cls.name: cls for cls in BUILTIN_ANALYZERS}
+    if args.only:
+        unknown = set(args.only) - builtins.keys()
+        if unknown:
+            raise ValueError(f"Unknown analyzers: {', '.join(sorted(unknown))}")
+        # Run what the selected analyzers require too, e.g. qubit_pairs needs frequencies
+        selected = set()
+        pending = list(args.only)
+        while pending:
+            name = pending.pop()
+            if name not in selected:
+                selected.add(name)
+                pending.extend(builtins[name].requires)
+        # Keep the built-in order so dependencies are registered first
+        builtins = {name: cls for name, cls in builtins.items() if name in selected}
+    pipeline = ReportPipeline([cls() for cls in builtins.values()])
+    for spec in args.analyzer:
+        pipeline.add(load_analyzer(spec))
+
+    state, wiring = load_documents(state_path, wiring_path)
+    report = pipeline.run(state, wiring)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            write_report(report, pipeline.analyzers, args.format, f)
+        print(f"Report saved to {args.output}")
+    else:
+        write_report(report, pipeline.analyzers, args.format, sys.stdout)
+
+if __name__ == '__main__':
+    main()
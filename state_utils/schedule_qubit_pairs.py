@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+import json
+import heapq
+import argparse
+import os
+from bisect import bisect_left, insort
+from pathlib import Path
+from collections import defaultdict
+from .collect_frequencies import frequencies_from_documents
+from .collect_qubit_pairs import grid_index, grid_neighbors, find_nearest_neighbors, make_qubit_pairs
+from .references import load_documents
+
+# Minimum XY detuning between qubits of different pairs in the same batch (Hz)
+DEFAULT_MIN_DETUNING = 50e6
+
+def pair_qubits(qubit_pairs):
+    """Return (pair_key, control, target) for every entry of a qubit_pairs dict"""
+    return [
+        (pair_key, pair["qubit_control"].rsplit('/', 1)[1], pair["qubit_target"].rsplit('/', 1)[1])
+        for pair_key, pair in qubit_pairs.items()
+    ]
+
+def build_conflict_graph(pairs, neighbors):
+    """Return the set of conflicting pair indices for every pair.
+
+    Two pairs conflict when they share a qubit or when a qubit of one is a grid
+    neighbor of a qubit of the other (spectator).
+    """
+    pairs_of_qubit = defaultdict(list)
+    for i, (_, control, target) in enumerate(pairs):
+        pairs_of_qubit[control].append(i)
+        pairs_of_qubit[target].append(i)
+
+    conflicts = []
+    for i, (_, control, target) in enumerate(pairs):
+        conflict = set()
+        for qubit in (control, target):
+            for other in [qubit] + neighbors.get(qubit, []):
+                conflict.update(pairs_of_qubit.get(other, ()))
+        conflict.discard(i)
+        conflicts.append(conflict)
+    return conflicts
+
+def _crowded(batch_freqs, pair_freqs, min_detuning):
+    """Check whether any frequency of a pair is within min_detuning of a batch's frequencies"""
+    for freq in pair_freqs:
+        k = bisect_left(batch_freqs, freq - min_detuning)
+        if k < len(batch_freqs) and batch_freqs[k] <= freq + min_detuning:
+            return True
+    return False
+
+def color_pairs(pairs, conflicts, frequencies, min_detuning=DEFAULT_MIN_DETUNING):
+    """Assign a batch to every pair with DSatur greedy coloring.
+
+    Pairs are picked by how many batches their conflicting pairs already rule out, and
+    each goes into the first batch that has no conflicting pair and no qubit within
+    `min_detuning` of its own qubits. The frequency check is a bisection in the sorted
+    frequencies of the batch, so crowding never has to be expanded into graph edges.
+    """
+    colors = [None] * len(conflicts)
+    saturation = [set() for _ in conflicts]
+    batch_freqs = []
+    heap = [(0, -len(conflict), i) for i, conflict in enumerate(conflicts)]
+    heapq.heapify(heap)
+
+    while heap:
+        neg_saturation, _, i = heapq.heappop(heap)
+        # Skip stale heap entries
+        if colors[i] is not None or -neg_saturation != len(saturation[i]):
+            continue
+        pair_freqs = [frequencies[q] for q in pairs[i][1:] if q in frequencies]
+        color = 0
+        while color < len(batch_freqs) and (
+            color in saturation[i] or _crowded(batch_freqs[color], pair_freqs, min_detuning)
+        ):
+            color += 1
+        if color == len(batch_freqs):
+            batch_freqs.append([])
+        colors[i] = color
+        for freq in pair_freqs:
+            insort(batch_freqs[color], freq)
+        for j in conflicts[i]:
+            if colors[j] is None and color not in saturation[j]:
+                saturation[j].add(color)
+                heapq.heappush(heap, (-len(saturation[j]), -len(conflicts[j]), j))
+
+    return colors
+
+def schedule_pairs(qubit_pairs, grid_locations, frequencies, min_detuning=DEFAULT_MIN_DETUNING):
+    """Partition qubit pairs into batches that can be calibrated simultaneously.
+
+    Returns the batch plan, largest batches first.
+    """
+    pairs = pair_qubits(qubit_pairs)
+    conflicts = build_conflict_graph(pairs, grid_neighbors(grid_locations))
+    colors = color_pairs(pairs, conflicts, frequencies, min_detuning)
+
+    batches = defaultdict(list)
+    for (pair_key, control, target), color in zip(pairs, colors):
+        batches[color].append({"id": pair_key, "control": control, "target": target})
+
+    ordered = sorted(batches.values(), key=len, reverse=True)
+    return {
+        "min_detuning": min_detuning,
+        "num_pairs": len(pairs),
+        "batches": [{"index": i, "pairs": batch} for i, batch in enumerate(ordered)],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch qubit pairs for parallel calibration')
+    parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
+                      help='Path to the directory containing state.json (default: QUAM_STATE_PATH environment variable)')
+    parser.add_argument('--wiring-path', type=str, help='Path to the wiring file (default: wiring.json in state directory)')
+    parser.add_argument('--min-detuning', type=float, default=DEFAULT_MIN_DETUNING / 1e6,
+                      help='Minimum XY detuning between qubits of a batch in MHz (default: 50 MHz)')
+    parser.add_argument('--output', type=str, help='Path to save the batch plan as JSON (optional)')
+    args = parser.parse_args()
+
+    if not args.state_path:
+        raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
+
+    state_dir = Path(args.state_path)
+    state_path = state_dir / "state.json"
+    wiring_path = Path(args.wiring_path) if args.wiring_path else state_dir / "wiring.json"
+
+    if not state_path.exists():
+        raise FileNotFoundError(f"State file not found: {state_path}")
+    if not wiring_path.exists():
+        raise FileNotFoundError(f"Wiring file not found: {wiring_path}")
+
+    state, wiring = load_documents(state_path, wiring_path)
+    frequencies_data = frequencies_from_documents(state, wiring)
+    frequencies = dict(zip(frequencies_data['qubit'], frequencies_data['xy_total_frequency']))
+
+    qubit_pairs = make_qubit_pairs(find_nearest_neighbors(state), frequencies)
+    plan = schedule_pairs(qubit_pairs, grid_index(state), frequencies, args.min_detuning * 1e6)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(plan, f, indent=4)
+        print(f"Batch plan saved to {args.output}")
+
+    print(f"\n{plan['num_pairs']} qubit pairs in {len(plan['batches'])} batches:")
+    for batch in plan['batches']:
+        print(f"Batch {batch['index']}: " + ", ".join(f"{p['control']}->{p['target']}" for p in batch['pairs']))
+
+if __name__ == '__main__':
+    main()
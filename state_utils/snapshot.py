@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import argparse
+import warnings
+import numpy as np
+from pathlib import Path
+from .references import ReferenceIndex
+
+# File layout: magic, header length (little-endian uint64), JSON header, then the
+# columns as contiguous little-endian arrays, each starting on an 8-byte boundary
+MAGIC = b'QSNAP002'
+PREAMBLE = struct.Struct('<8sQ')
+ALIGNMENT = 8
+
+SNAPSHOT_SUFFIX = '.snapshot'
+
+# Frequency columns, as returned by collect_frequencies.qubit_frequency_row (NaN: no row)
+FREQUENCY_COLUMNS = (
+    'xy_intermediate_frequency',
+    'xy_lo_frequency',
+    'xy_total_frequency',
+    'rr_intermediate_frequency',
+    'rr_lo_frequency',
+    'rr_total_frequency',
+)
+
+# Readout pulse and IF columns shown by the state editor (NaN: one of them is missing)
+EDITOR_COLUMNS = ('readout_amplitude', 'readout_length', 'resonator_if', 'xy_if')
+
+# Bit i is set when the value of the i-th frequency or editor column is an int in the
+# JSON, so readers return the same types as the JSON path
+INTEGRAL_COLUMN = 'integral'
+
+# Granularity assumed for file timestamps: whole seconds on coarse filesystems (FAT,
+# some network shares), otherwise the kernel clock tick. A file modified within that
+# much of the time it was recorded can change again without changing its mtime.
+COARSE_MTIME_NS = 2_000_000_000
+FINE_MTIME_NS = 20_000_000
+
+def snapshot_path(state_file_path):
+    """Return the sidecar snapshot path of a state file, state.snapshot next to state.json"""
+    return Path(state_file_path).with_suffix(SNAPSHOT_SUFFIX)
+
+def _file_hash(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _stat_key(stat):
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'ctime_ns': stat.st_ctime_ns, 'ino': stat.st_ino}
+
+def _source_info(path):
+    # Recorded before hashing: a later write lands after this time
+    stat = os.stat(path)
+    recorded_ns = time.time_ns()
+    return dict(_stat_key(stat), sha256=_file_hash(path), recorded_ns=recorded_ns)
+
+def _mtime_granularity(mtime_ns):
+    return COARSE_MTIME_NS if mtime_ns % 1_000_000_000 == 0 else FINE_MTIME_NS
+
+def _is_fresh(source, path, verify_hash):
+    """Check a recorded source against the file: the size must match, then either the
+    stat matches or the content hash does (e.g. after a copy that changed the mtime).
+
+    The stat alone is not trusted when the file was recorded within the timestamp
+    granularity of its mtime, as a write in the same tick keeps size and mtime.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if stat.st_size != source['size']:
+        return False
+    racy = source['recorded_ns'] < source['mtime_ns'] + _mtime_granularity(source['mtime_ns'])
+    if _stat_key(stat) == {key: source[key] for key in ('size', 'mtime_ns', 'ctime_ns', 'ino')} \
+            and not racy and not verify_hash:
+        return True
+    return _file_hash(path) == source['sha256']
+
+def _editor_fields(qubit_data):
+    try:
+        readout = qubit_data["resonator"]["operations"]["readout"]
+        return (readout["amplitude"], readout["length"],
+                qubit_data["resonator"]["intermediate_frequency"], qubit_data["xy"]["intermediate_frequency"])
+    except (KeyError, TypeError):
+        return None
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _set(columns, integral, i, names, values, first_bit):
+    for bit, (name, value) in enumerate(zip(names, values), first_bit):
+        columns[name][i] = value
+        if isinstance(value, int) and not isinstance(value, bool):
+            if columns[name][i] != value:
+                raise ValueError(f"{value} in {name} cannot be stored exactly in a snapshot")
+            integral[i] |= 1 << bit
+
+def _typed(values, flags, bit):
+    """Convert the values flagged as ints in the JSON back to int"""
+    flags = ((flags >> bit) & 1).astype(bool)
+    if not flags.any():
+        return values
+    return [int(value) if flag else value for value, flag in zip(values, flags.tolist())]
+
+def build_columns(state, wiring, index=None):
+    """Return the per-qubit columns of a snapshot as float64 arrays, in qubit order, with
+    the integral flags column, and the qubits whose editor fields are not plain numbers
+    (e.g. references)"""
+    # Imported here as the collectors read snapshots
+    from .collect_frequencies import qubit_frequency_row
+
+    if index is None:
+        index = ReferenceIndex(state, wiring)
+    qubits = state.get('qubits', {})
+    wiring_qubits = wiring.get('wiring', {}).get('qubits', {})
+
+    columns = {name: np.full(len(qubits), np.nan) for name in FREQUENCY_COLUMNS + EDITOR_COLUMNS}
+    integral = columns[INTEGRAL_COLUMN] = np.zeros(len(qubits), dtype=np.uint16)
+    opaque_qubits = []
+    for i, (qubit_name, qubit_data) in enumerate(qubits.items()):
+        row = qubit_frequency_row(qubit_name, qubit_data, wiring_qubits, index)
+        if row is not None:
+            _set(columns, integral, i, FREQUENCY_COLUMNS, row, 0)
+        fields = _editor_fields(qubit_data)
+        if fields is None:
+            continue
+        if not all(map(_is_number, fields)):
+            opaque_qubits.append(qubit_name)
+            continue
+        _set(columns, integral, i, EDITOR_COLUMNS, fields, len(FREQUENCY_COLUMNS))
+    return columns, opaque_qubits
+
+def write_snapshot(state_file_path, wiring_file_path=None, state=None, wiring=None):
+    """Write the binary snapshot of a state file that was just saved.
+
+    The documents are loaded from disk unless given. Returns the snapshot path, or None
+    when there is no wiring file to resolve the ports with. Raises ValueError if the
+    files change while the snapshot is written.
+    """
+    state_file_path = Path(state_file_path)
+    wiring_file_path = Path(wiring_file_path) if wiring_file_path else state_file_path.with_name('wiring.json')
+    if not wiring_file_path.exists():
+        return None
+    # Recorded before the documents are read, so a concurrent write cannot pass for what was read
+    sources = {'state': _source_info(state_file_path), 'wiring': _source_info(wiring_file_path)}
+    # Only the documents not given are read, e.g. just the wiring after a state was saved
+    if state is None:
+        with open(state_file_path, 'r') as f:
+            state = json.load(f)
+    if wiring is None:
+        with open(wiring_file_path, 'r') as f:
+            wiring = json.load(f)
+
+    qubits = state.get('qubits', {})
+    columns, opaque_qubits = build_columns(state, wiring)
+
+    for name, file_path in (('state', state_file_path), ('wiring', wiring_file_path)):
+        if _stat_key(os.stat(file_path)).items() - sources[name].items():
+            raise ValueError(f"{file_path} changed while its snapshot was written")
+
+    # Lay out the columns after the header, each aligned for zero-copy access
+    layout = {}
+    offset = 0
+    for name, values in columns.items():
+        dtype = values.dtype.newbyteorder('<')
+        layout[name] = {'dtype': dtype.str, 'offset': offset, 'count': len(values)}
+        offset += -(-values.nbytes // ALIGNMENT) * ALIGNMENT
+    header = {
+        'sources': sources,
+        'qubits': list(qubits),
+        'grid_locations': [qubit_data.get('grid_location') for qubit_data in qubits.values()],
+        'active_qubit_names': state.get('active_qubit_names', []),
+        'opaque_qubits': opaque_qubits,
+        'columns': layout,
+    }
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    data_start = -(-(PREAMBLE.size + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+    header_bytes = header_bytes.ljust(data_start - PREAMBLE.size)
+
+    path = snapshot_path(state_file_path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(PREAMBLE.pack(MAGIC, len(header_bytes)))
+            f.write(header_bytes)
+            for name, values in columns.items():
+                data = values.astype(layout[name]['dtype']).tobytes()
+                f.write(data.ljust(-(-len(data) // ALIGNMENT) * ALIGNMENT, b'\0'))
+        # Readers never see a half-written snapshot
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return path
+
+def refresh_snapshot(state_file_path, wiring_file_path=None, state=None, wiring=None):
+    """Write the snapshot of a state file that was just committed, or remove it if that fails.
+
+    The snapshot is only a cache, so a failure to write it must not fail the save that
+    came before: readers use the JSON files until the next write. Returns the snapshot
+    path, or None.
+    """
+    try:
+        return write_snapshot(state_file_path, wiring_file_path, state=state, wiring=wiring)
+    except Exception as e:
+        try:
+            snapshot_path(state_file_path).unlink(missing_ok=True)
+        except OSError:
+            # A snapshot left behind is stale, so its freshness check rejects it
+            pass
+        warnings.warn(f"Could not write the snapshot of {state_file_path}: {e}")
+        return None
+
+class Snapshot:
+    """Read-only view of a snapshot file, mapped into memory.
+
+    `column` returns NumPy arrays backed directly by the mapping, so reading the
+    frequencies of all qubits copies nothing until they are converted.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = PREAMBLE.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"Not a state snapshot: {path}")
+        self.path = Path(path)
+        self.data_start = PREAMBLE.size + header_length
+        self.header = json.loads(self._mmap[PREAMBLE.size:self.data_start])
+        self.qubits = self.header['qubits']
+        self._positions = None
+
+    def column(self, name):
+        spec = self.header['columns'][name]
+        return np.frombuffer(self._mmap, dtype=spec['dtype'], count=spec['count'],
+                             offset=self.data_start + spec['offset'])
+
+    def position(self, qubit_name):
+        if self._positions is None:
+            self._positions = {qubit_name: i for i, qubit_name in enumerate(self.qubits)}
+        return self._positions[qubit_name]
+
+    def values(self, name, rows=slice(None)):
+        """Return a frequency or editor column as a list, with ints where the JSON has
+        ints. `rows` selects rows as a NumPy index does"""
+        flags = self.column(INTEGRAL_COLUMN)[rows]
+        return _typed(self.column(name)[rows].tolist(), flags, (FREQUENCY_COLUMNS + EDITOR_COLUMNS).index(name))
+
+    def qubit(self, qubit_name):
+        """Return the snapshot columns of one qubit"""
+        i = self.position(qubit_name)
+        return {name: self.values(name, slice(i, i + 1))[0] for name in FREQUENCY_COLUMNS + EDITOR_COLUMNS}
+
+    def frequencies(self):
+        """Return the frequencies in the format of collect_frequencies.extract_frequencies"""
+        has_row = ~np.isnan(self.column('xy_total_frequency'))
+        output = {'qubit': [q for q, keep in zip(self.qubits, has_row.tolist()) if keep]}
+        for name in FREQUENCY_COLUMNS:
+            output[name] = self.values(name, has_row)
+        return output
+
+    def grid_locations(self):
+        """Return the grid locations in the format of collect_grid_locations"""
+        return {q: location for q, location in zip(self.qubits, self.header['grid_locations']) if location is not None}
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Arrays returned by column() still use the mapping, it is released with them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def load_snapshot(state_file_path, wiring_file_path=None, verify_hash=False):
+    """Open the snapshot of a state file if it is fresh, otherwise return None.
+
+    A snapshot is fresh when both the state and the wiring file still match the size,
+    mtime, ctime and inode (or content hash) recorded when it was written.
+    """
+    state_file_path = Path(state_file_path)
+    wiring_file_path = Path(wiring_file_path) if wiring_file_path else state_file_path.with_name('wiring.json')
+    path = snapshot_path(state_file_path)
+    if not path.exists():
+        return None
+    try:
+        snapshot = Snapshot(path)
+    except (ValueError, struct.error, OSError):
+        return None
+    sources = snapshot.header['sources']
+    if not (_is_fresh(sources['state'], state_file_path, verify_hash)
+            and _is_fresh(sources['wiring'], wiring_file_path, verify_hash)):
+        snapshot.close()
+        return None
+    return snapshot
+
+def main():
+    parser = argparse.ArgumentParser(description='Write or check the binary snapshot of a state file')
+    parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
+                      help='Path to the directory containing state.json (default: QUAM_STATE_PATH environment variable)')
+    parser.add_argument('--wiring-path', type=str, help='Path to the wiring file (default: wiring.json in state directory)')
+    parser.add_argument('--check', action='store_true', help='Only report whether the snapshot is fresh')
+    args = parser.parse_args()
+
+    if not args.state_path:
+        raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
+
+    state_dir = Path(args.state_path)
+    state_path = state_dir / "state.json"
+    wiring_path = Path(args.wiring_path) if args.wiring_path else state_dir / "wiring.json"
+
+    if not state_path.exists():
+        raise FileNotFoundError(f"State file not found: {state_path}")
+    if not wiring_path.exists():
+        raise FileNotFoundError(f"Wiring file not found: {wiring_path}")
+
+    if args.check:
+        snapshot = load_snapshot(state_path, wiring_path, verify_hash=True)
+        if snapshot is None:
+            print(f"No fresh snapshot for {state_path}")
+        else:
+            print(f"Snapshot {snapshot.path} is fresh ({len(snapshot.qubits)} qubits)")
+            snapshot.close()
+        return
+
+    path = write_snapshot(state_path, wiring_path)
+    print(f"Snapshot saved to {path}")
+
+if __name__ == '__main__':
+    main()
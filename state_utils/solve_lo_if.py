@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import json
+import argparse
+import os
+import numpy as np
+from pathlib import Path
+from collections import defaultdict
+from .collect_frequencies import frequencies_from_documents
+from .modify_quam import BAND_EDGES
+from .references import load_documents
+
+# Defaults of the search (Hz)
+DEFAULT_IF_LIMIT = 350e6
+DEFAULT_LO_STEP = 10e6
+DEFAULT_SPUR_MARGIN = 150e6
+
+# Lines of a qubit in the wiring, also the keys of their target frequencies
+LINES = ('xy', 'rr')
+
+def get_bands(freqs):
+    """Vectorized get_band: the band of every frequency, or 0 outside of the MW fem bandwidth"""
+    freqs = np.asarray(freqs, dtype=float)
+    bands = np.searchsorted(np.asarray(BAND_EDGES[1:3]), freqs, side='right') + 1
+    inside = (freqs >= BAND_EDGES[0]) & (freqs <= BAND_EDGES[3])
+    return np.where(inside, bands, 0)
+
+def port_groups(wiring, qubits):
+    """Group the qubits by the MW output their XY and RR lines share.
+
+    Returns {(line, reference): [qubit, ...]}.
+    """
+    wiring_qubits = wiring['wiring']['qubits']
+    groups = defaultdict(list)
+    for qubit in qubits:
+        for line in LINES:
+            groups[(line, wiring_qubits[qubit][line]['opx_output'])].append(qubit)
+    return groups
+
+def _solve_same_size(targets, if_limit, lo_step, spur_margin):
+    """Choose the LO of P ports that each serve n qubits.
+
+    `targets` is a (P, n) array. Candidate LOs on a `lo_step` grid covering every LO
+    that keeps all IFs of the port within `if_limit` are scored at once as a
+    (P, K, n) array. The score is the distance from each target to the nearest spur,
+    the LO leakage at LO and the images at 2*LO - f, capped at `spur_margin`; ties go
+    to the smallest largest |IF|. Returns the LOs (P,), or NaN for infeasible ports.
+    """
+    num_candidates = int(np.floor(2 * if_limit / lo_step)) + 1
+    start = np.ceil((targets.max(axis=1) - if_limit) / lo_step) * lo_step
+    los = start[:, None] + lo_step * np.arange(num_candidates)[None, :]
+
+    ifs = targets[:, None, :] - los[:, :, None]
+    abs_ifs = np.abs(ifs)
+
+    # |IF| within the limit, and the LO in the same band as all the targets of the port
+    lo_bands = get_bands(los)
+    feasible = (abs_ifs <= if_limit).all(axis=2) & (lo_bands > 0)
+    feasible &= (lo_bands[:, :, None] == get_bands(targets)[:, None, :]).all(axis=2)
+
+    # Distance of target j to the image of target i is |IF_i + IF_j|
+    leakage = abs_ifs.min(axis=2)
+    images = np.abs(ifs[:, :, :, None] + ifs[:, :, None, :]).min(axis=(2, 3))
+    spacing = np.minimum(np.minimum(leakage, images), spur_margin)
+
+    score = np.where(feasible, spacing - 1e-6 * abs_ifs.max(axis=2), -np.inf)
+    best = score.argmax(axis=1)
+    chosen = los[np.arange(len(los)), best]
+    return np.where(feasible.any(axis=1), chosen, np.nan)
+
+def solve_lo_if(targets, wiring, if_limit=DEFAULT_IF_LIMIT, lo_step=DEFAULT_LO_STEP,
+                spur_margin=DEFAULT_SPUR_MARGIN):
+    """Choose the LO of every MW output and the IF of every qubit for target frequencies.
+
+    `targets` maps qubit names to {"xy": Hz, "rr": Hz}. Qubits sharing an output (the
+    resonators of a feed-line) get a common LO. The result has the argument lists of
+    `modify_quam.modify_quam` plus the chosen LO of each port.
+    """
+    qubits = list(targets)
+    groups = port_groups(wiring, qubits)
+
+    # Stack ports with the same number of qubits so each size is solved in one go
+    by_size = defaultdict(list)
+    for key, group in groups.items():
+        by_size[len(group)].append(key)
+
+    port_lo = {}
+    for keys in by_size.values():
+        freqs = np.array([[targets[q][key[0]] for q in groups[key]] for key in keys], dtype=float)
+        los = _solve_same_size(freqs, if_limit, lo_step, spur_margin)
+        for key, lo in zip(keys, los):
+            if np.isnan(lo):
+                raise ValueError(f"No LO for {key[1]} keeps the IFs of {', '.join(groups[key])} "
+                                 f"within ±{if_limit / 1e6:.0f} MHz in a single band")
+            port_lo[key] = float(lo)
+
+    plan = {'qubits': qubits, 'xy_LO': [], 'xy_if': [], 'rr_LO': [], 'rr_if': []}
+    wiring_qubits = wiring['wiring']['qubits']
+    for qubit in qubits:
+        for line in LINES:
+            lo = port_lo[(line, wiring_qubits[qubit][line]['opx_output'])]
+            plan[f'{line}_LO'].append(lo)
+            plan[f'{line}_if'].append(targets[qubit][line] - lo)
+    plan['ports'] = {key[1]: lo for key, lo in port_lo.items()}
+    return plan
+
+def main():
+    parser = argparse.ArgumentParser(description='Choose LO and IF frequencies for target qubit and resonator frequencies')
+    parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
+                      help='Path to the directory containing state.json (default: QUAM_STATE_PATH environment variable)')
+    parser.add_argument('--wiring-path', type=str, help='Path to the wiring file (default: wiring.json in state directory)')
+    parser.add_argument('--targets', type=str,
+                      help='JSON file mapping qubits to {"xy": Hz, "rr": Hz} (default: the current total frequencies)')
+    parser.add_argument('--if-limit', type=float, default=DEFAULT_IF_LIMIT / 1e6,
+                      help='Limit on the absolute IF in MHz (default: 350 MHz)')
+    parser.add_argument('--lo-step', type=float, default=DEFAULT_LO_STEP / 1e6, help='LO grid step in MHz (default: 10 MHz)')
+    parser.add_argument('--spur-margin', type=float, default=DEFAULT_SPUR_MARGIN / 1e6,
+                      help='Spur spacing beyond which smaller IFs are preferred, in MHz (default: 150 MHz)')
+    parser.add_argument('--output', type=str, help='Path to save the frequency plan as JSON (optional)')
+    args = parser.parse_args()
+
+    if not args.state_path:
+        raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
+
+    state_dir = Path(args.state_path)
+    state_path = state_dir / "state.json"
+    wiring_path = Path(args.wiring_path) if args.wiring_path else state_dir / "wiring.json"
+
+    if not state_path.exists():
+        raise FileNotFoundError(f"State file not found: {state_path}")
+    if not wiring_path.exists():
+        raise FileNotFoundError(f"Wiring file not found: {wiring_path}")
+
+    state, wiring = load_documents(state_path, wiring_path)
+    if args.targets:
+        with open(args.targets, 'r') as f:
+            targets = json.load(f)
+    else:
+        frequencies = frequencies_from_documents(state, wiring)
+        targets = {
+            qubit: {'xy': xy, 'rr': rr}
+            for qubit, xy, rr in zip(frequencies['qubit'], frequencies['xy_total_frequency'], frequencies['rr_total_frequency'])
+        }
+
+    plan = solve_lo_if(targets, wiring, args.if_limit * 1e6, args.lo_step * 1e6, args.spur_margin * 1e6)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(plan, f, indent=4)
+        print(f"Frequency plan saved to {args.output}")
+
+    print(f"\n{'Qubit':<6} {'XY IF':>8} {'XY LO':>8} {'RR IF':>8} {'RR LO':>8}")
+    print("-" * 42)
+    for i, qubit in enumerate(plan['qubits']):
+        print(f"{qubit:<6} {plan['xy_if'][i] / 1e6:8.3f} {plan['xy_LO'][i] / 1e9:8.3f} "
+              f"{plan['rr_if'][i] / 1e6:8.3f} {plan['rr_LO'][i] / 1e9:8.3f}")
+
+if __name__ == '__main__':
+    main()
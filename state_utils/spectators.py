@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+from .collect_qubit_pairs import make_qubit_pairs, nearest_neighbor_pairs
+from .export import FORMATS, export_format, hz_column, write_columns
+from .qubit_records import load_table
+
+# Columns of the detuning table, one row per (pair, spectator), grouped by pair
+SPECTATOR_COLUMNS = (
+    'pair',
+    'qubit_control',
+    'qubit_target',
+    'spectator',
+    'control_hops',
+    'target_hops',
+    'control_detuning',
+    'target_detuning',
+)
+
+def _ranges(starts, counts):
+    """Concatenate arange(start, start + count) for every start and count, without a loop"""
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
+
+def grid_adjacency(grid_locations):
+    """Return (qubits, indptr, indices), the nearest-neighbor graph of {qubit: (x, y)} in CSR
+    form: the neighbors of qubits[i] are qubits[indices[indptr[i]:indptr[i + 1]]]"""
+    qubits = list(grid_locations)
+    n = len(qubits)
+    if n == 0:
+        return qubits, np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64)
+    xy = np.array(list(grid_locations.values()), dtype=np.int64).reshape(n, 2)
+    xy -= xy.min(axis=0)
+    # One integer key per location, with a margin so the y +- 1 offsets never wrap into
+    # the next column
+    height = int(xy[:, 1].max()) + 3
+    keys = (xy[:, 0] + 1) * height + xy[:, 1] + 1
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    sources = []
+    targets = []
+    for dx, dy in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+        wanted = keys + dx * height + dy
+        # A range rather than a single match, as several qubits may share a location
+        left = np.searchsorted(sorted_keys, wanted, 'left')
+        counts = np.searchsorted(sorted_keys, wanted, 'right') - left
+        sources.append(np.repeat(np.arange(n), counts))
+        targets.append(order[_ranges(left, counts)])
+    sources = np.concatenate(sources)
+    targets = np.concatenate(targets)
+    edges = np.lexsort((targets, sources))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=n))))
+    return qubits, indptr, targets[edges]
+
+def hop_dtype(hops):
+    """Smallest signed integer type holding hop distances up to `hops` and the -1 of
+    SpectatorMap, int8 unless `hops` is above 127"""
+    return next(dtype for dtype in (np.int8, np.int16, np.int32, np.int64) if hops <= np.iinfo(dtype).max)
+
+def k_hop_neighborhoods(indptr, indices, hops):
+    """Return (indptr, indices, distances): the nodes within `hops` steps of every node
+    (itself excluded) with their hop distance, in CSR form.
+
+    All nodes are expanded together one hop at a time, so the cost is the total size of the
+    neighborhoods, linear in the number of nodes for a grid.
+    """
+    n = len(indptr) - 1
+    degree = np.diff(indptr)
+    sources = np.arange(n)
+    frontier = np.arange(n)
+    # (source, node) pairs of the last two hops, as sorted source * n + node keys. The graph
+    # is undirected, so the neighbors of nodes at hop h are at hop h - 1, h or h + 1 and
+    # only the last two hops need to be excluded, not everything seen so far.
+    previous = np.empty(0, dtype=np.int64)
+    current = sources * n + frontier
+    found = []
+    for hop in range(1, hops + 1):
+        counts = degree[frontier]
+        keys = np.unique(np.repeat(sources, counts) * n + indices[_ranges(indptr[frontier], counts)])
+        keys = keys[~np.isin(keys, previous, assume_unique=True) & ~np.isin(keys, current, assume_unique=True)]
+        if not len(keys):
+            break
+        previous, current = current, keys
+        sources, frontier = keys // n, keys % n
+        found.append((keys, np.full(len(keys), hop, dtype=hop_dtype(hops))))
+
+    if not found:
+        return np.zeros(n + 1, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=hop_dtype(hops))
+    keys = np.concatenate([keys for keys, _ in found])
+    distances = np.concatenate([distances for _, distances in found])
+    order = np.argsort(keys, kind='stable')
+    keys, distances = keys[order], distances[order]
+    hop_indptr = np.concatenate(([0], np.cumsum(np.bincount(keys // n, minlength=n))))
+    return hop_indptr, keys % n, distances
+
+class GridNeighborhoods:
+    """The grid qubits and the qubits within `hops` steps of each, in CSR form (see
+    k_hop_neighborhoods). Only depends on the grid, so it can be kept while the
+    frequencies, and with them the control and target of the pairs, change.
+    """
+
+    def __init__(self, grid_locations, hops=2):
+        self.hops = hops
+        self.qubits, indptr, indices = grid_adjacency(grid_locations)
+        self.positions = {name: i for i, name in enumerate(self.qubits)}
+        self.indptr, self.indices, self.distances = k_hop_neighborhoods(indptr, indices, hops)
+
+class SpectatorMap:
+    """The spectators of every qubit pair: the qubits within `hops` grid steps of its control
+    or target. The pairs name their control and target by XY frequency, so the map is
+    rebuilt when the pairs change, from the GridNeighborhoods of the grid when given, and
+    `detunings` is recomputed for every new set of frequencies.
+
+    Rows are grouped by pair (the rows of pair p are pair_indptr[p]:pair_indptr[p + 1]) with
+    the spectators in qubit order. A hop count of -1 means the spectator is further than
+    `hops` from that qubit of the pair.
+    """
+
+    def __init__(self, grid_locations, qubit_pairs, hops=2, neighborhoods=None):
+        if neighborhoods is None:
+            neighborhoods = GridNeighborhoods(grid_locations, hops)
+        self.hops = hops = neighborhoods.hops
+        self.qubits = neighborhoods.qubits
+        self.positions = neighborhoods.positions
+        self.pairs = list(qubit_pairs)
+        self.control = np.array([self.positions[pair["qubit_control"].rsplit('/', 1)[1]]
+                                 for pair in qubit_pairs.values()], dtype=np.int64)
+        self.target = np.array([self.positions[pair["qubit_target"].rsplit('/', 1)[1]]
+                                for pair in qubit_pairs.values()], dtype=np.int64)
+        hop_indptr, hop_indices, hop_distances = neighborhoods.indptr, neighborhoods.indices, neighborhoods.distances
+
+        # The neighborhoods of the control and of the target of each pair as
+        # pair * n + spectator keys, merged by np.unique
+        n = len(self.qubits)
+        sides = []
+        for nodes in (self.control, self.target):
+            counts = np.diff(hop_indptr)[nodes]
+            entries = _ranges(hop_indptr[nodes], counts)
+            sides.append((np.repeat(np.arange(len(self.pairs)), counts) * n + hop_indices[entries],
+                          hop_distances[entries]))
+        keys, inverse = np.unique(np.concatenate([sides[0][0], sides[1][0]]), return_inverse=True)
+        hop_counts = []
+        for i, (side_keys, distances) in enumerate(sides):
+            hops_from = np.full(len(keys), -1, dtype=hop_dtype(hops))
+            start = 0 if i == 0 else len(sides[0][0])
+            hops_from[inverse[start:start + len(side_keys)]] = distances
+            hop_counts.append(hops_from)
+
+        pair_index, spectator = keys // n, keys % n
+        # The target is within reach of the control and vice versa, neither is a spectator
+        keep = (spectator != self.control[pair_index]) & (spectator != self.target[pair_index])
+        self.pair_index = pair_index[keep]
+        self.spectator = spectator[keep]
+        self.control_hops = hop_counts[0][keep]
+        self.target_hops = hop_counts[1][keep]
+        self.pair_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.pair_index, minlength=len(self.pairs)))))
+
+    def __len__(self):
+        return len(self.spectator)
+
+    def frequency_array(self, frequencies):
+        """Align the output of extract_frequencies on the grid qubits, NaN where missing"""
+        xy = np.full(len(self.qubits), np.nan)
+        for qubit, frequency in zip(frequencies['qubit'], frequencies['xy_total_frequency']):
+            position = self.positions.get(qubit)
+            if position is not None:
+                xy[position] = frequency
+        return xy
+
+    def detunings(self, frequencies):
+        """Return the detuning table as {column: array} (see SPECTATOR_COLUMNS), the
+        detunings being the XY frequency of the control or target minus the spectator's"""
+        xy = self.frequency_array(frequencies)
+        names = np.array(self.qubits, dtype=object)
+        control = self.control[self.pair_index]
+        target = self.target[self.pair_index]
+        return {
+            'pair': np.array(self.pairs, dtype=object)[self.pair_index],
+            'qubit_control': names[control],
+            'qubit_target': names[target],
+            'spectator': names[self.spectator],
+            'control_hops': self.control_hops,
+            'target_hops': self.target_hops,
+            'control_detuning': hz_column(xy[control] - xy[self.spectator]),
+            'target_detuning': hz_column(xy[target] - xy[self.spectator]),
+        }
+
+    def rows_of(self, pair_key):
+        """Return the slice of the detuning table holding the rows of a pair"""
+        p = self.pairs.index(pair_key)
+        return slice(self.pair_indptr[p], self.pair_indptr[p + 1])
+
+def columns_by_pair(columns, spectator_map):
+    """Group the detuning table by pair: {pair: [{spectator, hops, detunings}, ...]}"""
+    fields = [name for name in SPECTATOR_COLUMNS if name not in ('pair', 'qubit_control', 'qubit_target')]
+    values = [columns[name].tolist() for name in fields]
+    bounds = spectator_map.pair_indptr.tolist()
+    return {
+        pair: [dict(zip(fields, row)) for row in zip(*(column[bounds[p]:bounds[p + 1]] for column in values))]
+        for p, pair in enumerate(spectator_map.pairs)
+    }
+
+def closest_spectators(columns, spectator_map):
+    """Return (spectator, detuning) arrays of the smallest |detuning| to the control and to
+    the target of every pair, spectator None for pairs without spectators"""
+    closest = []
+    for column in ('control_detuning', 'target_detuning'):
+        detuning = np.abs(columns[column].astype(np.float64))
+        # NaN (a qubit without frequency) never counts as the closest
+        detuning[np.isnan(detuning)] = np.inf
+        # Rows by pair then |detuning|, the first row of each pair is its closest spectator
+        order = np.lexsort((detuning, spectator_map.pair_index))
+        pairs, first = np.unique(spectator_map.pair_index[order], return_index=True)
+        rows = order[first]
+        spectators = np.full(len(spectator_map.pairs), None, dtype=object)
+        values = np.full(len(spectator_map.pairs), np.nan)
+        spectators[pairs] = columns['spectator'][rows]
+        values[pairs] = columns[column][rows]
+        closest.append((spectators, values))
+    return closest
+
+def load_spectators(state_file_path, wiring_file_path, hops=2):
+    """Return (spectator_map, frequencies) of a state, with the pairs collect_qubit_pairs emits"""
+    table = load_table(state_file_path, wiring_file_path)
+    grid_locations = table.grid_index()
+    qubit_pairs = make_qubit_pairs(nearest_neighbor_pairs(grid_locations), table.xy_frequencies())
+    return SpectatorMap(grid_locations, qubit_pairs, hops), table.frequencies()
+
+def print_spectators(columns, spectator_map, pair=None):
+    """Print the closest spectator of every pair, or all spectators of one pair"""
+    if pair is not None:
+        rows = spectator_map.rows_of(pair)
+        print(f"\nSpectators of {pair} within {spectator_map.hops} hops:")
+        print(f"{'Spectator':<10} {'Hops (C/T)':>10} {'Control det. (MHz)':>19} {'Target det. (MHz)':>18}")
+        for spectator, control_hops, target_hops, control_detuning, target_detuning in zip(
+                *(columns[name][rows].tolist() for name in SPECTATOR_COLUMNS[3:])):
+            print(f"{spectator:<10} {control_hops:>4}/{target_hops:<5} {control_detuning / 1e6:>19.3f} "
+                  f"{target_detuning / 1e6:>18.3f}")
+        return
+
+    (control_spectators, control_detunings), (target_spectators, target_detunings) = \
+        closest_spectators(columns, spectator_map)
+    counts = np.diff(spectator_map.pair_indptr)
+    print(f"\nClosest spectators within {spectator_map.hops} hops (detuning in MHz):")
+    print(f"{'Pair':<12} {'Spectators':>10}  {'Control':<18} {'Target':<18}")
+    for p, pair in enumerate(spectator_map.pairs):
+        control = f"{control_spectators[p]} {control_detunings[p] / 1e6:+.1f}" if control_spectators[p] else "-"
+        target = f"{target_spectators[p]} {target_detunings[p] / 1e6:+.1f}" if target_spectators[p] else "-"
+        print(f"{pair:<12} {counts[p]:>10}  {control:<18} {target:<18}")
+
+def save_spectators(columns, spectator_map, output_path, output_format):
+    """Write the detuning table in a columnar format, or as JSON grouped by pair"""
+    if output_format:
+        write_columns(columns, output_path, output_format)
+    else:
+        with open(output_path, 'w') as f:
+            json.dump(columns_by_pair(columns, spectator_map), f, indent=4)
+
+def check_pair(spectator_map, pair):
+    """Raise ValueError if `pair` (None for all pairs) is not a pair of the map"""
+    if pair is not None and pair not in spectator_map.pairs:
+        raise ValueError(f"Unknown pair {pair!r}, pairs are named as in collect_qubit_pairs (e.g. q1-q2)")
+
+def watch_spectators(state_file_path, wiring_file_path, hops, output_path=None, output_format=None, pair=None):
+    """Recompute the detunings every time the state or wiring file is written. The k-hop
+    neighborhoods are rebuilt only when the grid changes, the spectator map when the pairs
+    or their control and target change"""
+    # Imported here as the watch module builds on the collectors
+    from .watch import watch_files, CLEAR_SCREEN
+
+    current = {}
+
+    def redraw():
+        try:
+            table = load_table(state_file_path, wiring_file_path)
+        except (json.JSONDecodeError, FileNotFoundError):
+            # Caught the file mid-write, the end of the write triggers another update
+            return
+        start = time.perf_counter()
+        grid_locations = table.grid_index()
+        if current.get('grid') != grid_locations:
+            current['grid'] = grid_locations
+            current['neighbors'] = nearest_neighbor_pairs(grid_locations)
+            current['neighborhoods'] = GridNeighborhoods(grid_locations, hops)
+            current['pairs'] = None
+        # The control of a pair is its qubit of higher frequency, which a frequency update can change
+        qubit_pairs = make_qubit_pairs(current['neighbors'], table.xy_frequencies())
+        if current['pairs'] != qubit_pairs:
+            current['pairs'] = qubit_pairs
+            current['map'] = SpectatorMap(grid_locations, qubit_pairs, neighborhoods=current['neighborhoods'])
+        try:
+            check_pair(current['map'], pair)
+        except ValueError as e:
+            if not current.get('drawn'):
+                # Unknown from the start, fail before watching
+                raise
+            # The grid changed under a running watch, wait for the pair to come back
+            print(CLEAR_SCREEN, end='')
+            print(f"{e}, watching {state_file_path} (Ctrl+C to stop)")
+            return
+        columns = current['map'].detunings(table.frequencies())
+        elapsed = time.perf_counter() - start
+        if output_path:
+            save_spectators(columns, current['map'], output_path, output_format)
+        print(CLEAR_SCREEN, end='')
+        print_spectators(columns, current['map'], pair)
+        current['drawn'] = True
+        print(f"\n{len(current['map'])} pair spectators computed in {elapsed * 1e3:.1f} ms at "
+              f"{time.strftime('%H:%M:%S')}, watching {state_file_path} (Ctrl+C to stop)")
+
+    redraw()
+    try:
+        watch_files([state_file_path, wiring_file_path], redraw)
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute the detunings between every qubit pair and its spectators within k grid hops')
+    parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
+                      help='Path to the directory containing state.json (default: QUAM_STATE_PATH environment variable)')
+    parser.add_argument('--wiring-path', type=str, help='Path to the wiring file (default: wiring.json in state directory)')
+    parser.add_argument('--hops', type=int, default=2, help='Grid hops from the control or target to a spectator (default: 2)')
+    parser.add_argument('--pair', type=str, help='Print all spectators of this pair (e.g. q1-q2) instead of the closest ones')
+    parser.add_argument('--output', type=str,
+                      help='Path to save the detuning table (optional), as JSON grouped by pair or by suffix as .csv, .feather, .parquet or .ndjson')
+    parser.add_argument('--output-format', choices=FORMATS,
+                      help='Columnar format of the output, overriding its suffix (NDJSON is appended to)')
+    parser.add_argument('--watch', action='store_true',
+                      help='Keep running and recompute the detunings whenever the state or wiring file changes')
+    args = parser.parse_args()
+
+    if args.output_format and not args.output:
+        parser.error("--output-format requires --output")
+    if not args.state_path:
+        raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
+    if args.hops < 1:
+        raise ValueError("--hops must be at least 1")
+
+    state_dir = Path(args.state_path)
+    state_path = state_dir / "state.json"
+    wiring_path = Path(args.wiring_path) if args.wiring_path else state_dir / "wiring.json"
+
+    if not state_path.exists():
+        raise FileNotFoundError(f"State file not found: {state_path}")
+    if not wiring_path.exists():
+        raise FileNotFoundError(f"Wiring file not found: {wiring_path}")
+
+    output_format = export_format(args.output, args.output_format) if args.output else None
+    if args.watch:
+        watch_spectators(state_path, wiring_path, args.hops, args.output, output_format, args.pair)
+        return
+
+    start = time.perf_counter()
+    spectator_map, frequencies = load_spectators(state_path, wiring_path, args.hops)
+    check_pair(spectator_map, args.pair)
+    columns = spectator_map.detunings(frequencies)
+    elapsed = time.perf_counter() - start
+
+    print_spectators(columns, spectator_map, args.pair)
+    print(f"\n{len(spectator_map)} spectators of {len(spectator_map.pairs)} pairs in {elapsed * 1e3:.1f} ms")
+
+    if args.output:
+        save_spectators(columns, spectator_map, args.output, output_format)
+        print(f"\nSpectator detunings saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
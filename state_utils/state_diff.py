@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+import sys
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from collections import defaultdict
+from .references import REFERENCE_PREFIX, escape_key, qubit_of
+
+ADD = 'add'
+REMOVE = 'remove'
+REPLACE = 'replace'
+
+class MerkleTree:
+    """Content hash of every dict and list of a document.
+
+    Hashes are computed bottom-up in one walk and kept by node identity, so the document
+    must not be modified in place while the tree is used; `update` applies changes and
+    rehashes only their paths. Leaves are folded into the hash of their parent rather
+    than hashed on their own.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.hashes = {}
+        self.root = self._hash(document)
+
+    def _hash(self, node):
+        hasher = hashlib.blake2b(digest_size=16)
+        if isinstance(node, dict):
+            hasher.update(b'd')
+            for key in sorted(node):
+                hasher.update(f"\x00{key}\x01".encode())
+                hasher.update(self._child(node[key]))
+        else:
+            hasher.update(b'l')
+            for value in node:
+                hasher.update(b'\x00')
+                hasher.update(self._child(value))
+        digest = hasher.digest()
+        self.hashes[id(node)] = digest
+        return digest
+
+    def _child(self, value):
+        if isinstance(value, (dict, list)):
+            digest = self.hashes.get(id(value))
+            return digest if digest is not None else self._hash(value)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f"{type(value).__name__}:{value!r}".encode()
+        # Numbers compare by value, as with ==, so 1 and 1.0 from a JSON round trip match
+        if isinstance(value, int) and abs(value) <= 2 ** 53:
+            value = float(value)
+        return f"num:{value!r}".encode()
+
+    def digest(self, node):
+        """Return the hash of a container of the document, or a leaf's tagged repr"""
+        return self._child(node)
+
+    def _forget(self, node):
+        """Drop the hashes of a branch leaving the document, as its ids may be reused"""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (dict, list)):
+                self.hashes.pop(id(node), None)
+                stack.extend(node.values() if isinstance(node, dict) else node)
+
+    def update(self, changes):
+        """Apply changes to the document (see apply_changes) and return the new document.
+
+        Branches the changes do not touch keep their hashes, so a tree kept for the last
+        saved document is brought up to date by hashing the paths of the changes only.
+        """
+        for change in changes:
+            keys = _pointer_keys(change['path'])
+            if not keys:
+                self.document = change.get('new')
+                self.hashes = {}
+                self.root = self._hash(self.document)
+                continue
+            path = _containers(self.document, keys)
+            for node in path:
+                self.hashes.pop(id(node), None)
+            # The value the change removes or replaces, an addition to a dict can replace one too
+            parent = path[-1]
+            if isinstance(parent, dict) and keys[-1] in parent:
+                self._forget(parent[keys[-1]])
+            elif isinstance(parent, list) and change['op'] != ADD:
+                self._forget(parent[int(keys[-1])])
+            self.document = apply_changes(self.document, [change])
+            # The containers on the path are new copies, hash them from the changed end up
+            for node in reversed(_containers(self.document, keys)):
+                self._hash(node)
+            self.root = self.hashes[id(self.document)]
+        return self.document
+
+def _change(op, path, old=None, new=None):
+    change = {'op': op, 'path': path}
+    if op != ADD:
+        change['old'] = old
+    if op != REMOVE:
+        change['new'] = new
+    return change
+
+def diff_trees(old_tree, new_tree):
+    """Return the changes turning the document of old_tree into that of new_tree.
+
+    Branches with equal hashes are skipped, so after hashing the work is proportional to
+    the number of changed branches rather than to the size of the documents. Changes
+    come in document order and can be applied one after the other.
+    """
+    changes = []
+
+    def diff(path, old, new):
+        if old_tree.digest(old) == new_tree.digest(new):
+            return
+        if isinstance(old, dict) and isinstance(new, dict):
+            for key in sorted(old.keys() | new.keys()):
+                child = f"{path}/{escape_key(key)}"
+                if key not in new:
+                    changes.append(_change(REMOVE, child, old=old[key]))
+                elif key not in old:
+                    changes.append(_change(ADD, child, new=new[key]))
+                else:
+                    diff(child, old[key], new[key])
+        elif isinstance(old, list) and isinstance(new, list):
+            common = min(len(old), len(new))
+            for i in range(common):
+                diff(f"{path}/{i}", old[i], new[i])
+            # Remove from the end so the indices stay valid when the changes are applied in order
+            for i in range(len(old) - 1, common - 1, -1):
+                changes.append(_change(REMOVE, f"{path}/{i}", old=old[i]))
+            for i in range(common, len(new)):
+                changes.append(_change(ADD, f"{path}/{i}", new=new[i]))
+        else:
+            changes.append(_change(REPLACE, path, old=old, new=new))
+
+    diff(REFERENCE_PREFIX.rstrip('/'), old_tree.document, new_tree.document)
+    return changes
+
+def diff_documents(old, new):
+    """Return the JSON-pointer ("#/...") changes turning one document into another.
+
+    Each change is {"op": "add" | "remove" | "replace", "path", "old", "new"}, with
+    "old" left out of additions and "new" left out of removals. To diff several
+    documents against the same one, keep its MerkleTree and call diff_trees.
+    """
+    return diff_trees(MerkleTree(old), MerkleTree(new))
+
+def _pointer_keys(path):
+    return [key.replace('~1', '/').replace('~0', '~') for key in path.split('/')[1:]]
+
+def _containers(document, keys):
+    """Return the containers from the root of a document down to the parent of a path"""
+    path = [document]
+    for key in keys[:-1]:
+        parent = path[-1]
+        path.append(parent[int(key) if isinstance(parent, list) else key])
+    return path
+
+def apply_changes(document, changes):
+    """Return the document with the changes applied, without modifying it.
+
+    Only the dicts and lists on the paths of the changes are copied; every other branch
+    is shared with the original document, so neither may be modified in place afterwards.
+    """
+    copied = set()
+
+    def own(node):
+        if id(node) in copied:
+            return node
+        node = node.copy()
+        copied.add(id(node))
+        return node
+
+    for change in changes:
+        keys = _pointer_keys(change['path'])
+        if not keys:
+            document = change.get('new')
+            continue
+        document = parent = own(document)
+        for key in keys[:-1]:
+            key = int(key) if isinstance(parent, list) else key
+            parent[key] = child = own(parent[key])
+            parent = child
+        key = int(keys[-1]) if isinstance(parent, list) else keys[-1]
+        if change['op'] == REMOVE:
+            del parent[key]
+        elif change['op'] == ADD and isinstance(parent, list):
+            parent.insert(key, change['new'])
+        elif change['op'] == REPLACE and key not in (range(len(parent)) if isinstance(parent, list) else parent):
+            raise KeyError(f"Cannot replace missing {change['path']}")
+        else:
+            parent[key] = change['new']
+    return document
+
+def invert_changes(changes):
+    """Return the changes that undo the given ones"""
+    inverted = []
+    for change in reversed(changes):
+        if change['op'] == ADD:
+            inverted.append(_change(REMOVE, change['path'], old=change['new']))
+        elif change['op'] == REMOVE:
+            inverted.append(_change(ADD, change['path'], new=change['old']))
+        else:
+            inverted.append(_change(REPLACE, change['path'], old=change['new'], new=change['old']))
+    return inverted
+
+def _port_qubits(wiring):
+    """Map the output and input references of the wiring to the qubits using them"""
+    port_qubits = defaultdict(list)
+    for qubit_name, lines in wiring.get('wiring', {}).get('qubits', {}).items():
+        for line in lines.values():
+            for reference in line.values() if isinstance(line, dict) else ():
+                if isinstance(reference, str) and reference.startswith(REFERENCE_PREFIX):
+                    port_qubits[reference].append(qubit_name)
+    return port_qubits
+
+def group_by_qubit(changes, wiring=None):
+    """Group changes by the qubit they belong to, None for the rest.
+
+    With the wiring, changes to a port are also listed under every qubit wired to it.
+    """
+    port_qubits = _port_qubits(wiring) if wiring is not None else {}
+    groups = defaultdict(list)
+    for change in changes:
+        qubits = [qubit_of(change['path'])]
+        if qubits[0] is None and port_qubits:
+            # Match the port the change is in, or the ports below a changed branch
+            qubits = sorted({
+                qubit_name
+                for reference, names in port_qubits.items()
+                if change['path'] == reference or change['path'].startswith(reference + '/')
+                or reference.startswith(change['path'] + '/')
+                for qubit_name in names
+            }) or [None]
+        for qubit_name in qubits:
+            groups[qubit_name].append(change)
+    return dict(groups)
+
+def _format_value(value, limit=60):
+    text = json.dumps(value)
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+def format_changes(groups):
+    """Return the grouped changes as text, qubits first"""
+    lines = []
+    symbols = {ADD: '+', REMOVE: '-', REPLACE: '~'}
+    for qubit_name in sorted(groups, key=lambda name: (name is None, name or '')):
+        lines.append(f"{qubit_name or 'other'}:")
+        for change in groups[qubit_name]:
+            if change['op'] == REPLACE:
+                detail = f"{_format_value(change['old'])} -> {_format_value(change['new'])}"
+            else:
+                detail = _format_value(change['new'] if change['op'] == ADD else change['old'])
+            lines.append(f"  {symbols[change['op']]} {change['path']}: {detail}")
+    return '\n'.join(lines)
+
+def _load(path, file_name):
+    """Load a JSON file, or the named file of a state directory"""
+    path = Path(path)
+    if path.is_dir():
+        path = path / file_name
+    if not path.exists():
+        raise FileNotFoundError(f"File not found: {path}")
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the differences between two state files, grouped by qubit')
+    parser.add_argument('old', type=str, help='Old state.json or state directory')
+    parser.add_argument('new', type=str, help='New state.json or state directory')
+    parser.add_argument('--wiring', action='store_true',
+                      help='Also diff wiring.json, both arguments must then be state directories')
+    parser.add_argument('--format', choices=['text', 'json'], default='text', help='Output format (default: text)')
+    parser.add_argument('--output', type=str, help='Path to save the grouped changes as JSON (optional)')
+    args = parser.parse_args()
+
+    old = _load(args.old, 'state.json')
+    new = _load(args.new, 'state.json')
+    wiring = None
+    if args.wiring:
+        if not (Path(args.old).is_dir() and Path(args.new).is_dir()):
+            raise ValueError("--wiring needs state directories, not files")
+        old_wiring = _load(args.old, 'wiring.json')
+        wiring = _load(args.new, 'wiring.json')
+        # QuAM splits one root object over both files
+        old, new = {**old, **old_wiring}, {**new, **wiring}
+    else:
+        # Attribute port changes to qubits with the wiring next to the new state, if any
+        new_dir = Path(args.new) if Path(args.new).is_dir() else Path(args.new).parent
+        if (new_dir / 'wiring.json').exists():
+            wiring = _load(new_dir, 'wiring.json')
+
+    changes = diff_documents(old, new)
+    groups = group_by_qubit(changes, wiring)
+    report = {str(qubit_name) if qubit_name else 'other': group for qubit_name, group in groups.items()}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Changes saved to {args.output}")
+
+    if args.format == 'json':
+        print(json.dumps(report, indent=2))
+    else:
+        if changes:
+            print(format_changes(groups))
+        print(f"\n{len(changes)} changes affecting {sum(1 for name in groups if name)} qubits")
+
+    # Like diff, exit with 1 when the documents differ
+    if changes:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
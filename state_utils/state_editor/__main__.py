@@ -1,8 +1,34 @@
+import os
+import argparse
 import uvicorn
-from .app import app
+from . import app as editor
+from .registry import ChipRegistry, DEFAULT_MAX_OPEN, load_registry
 
 def main():
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    parser = argparse.ArgumentParser(description='Serve the state editor for one or more state directories')
+    parser.add_argument('--chip', action='append', default=[], metavar='NAME=PATH',
+                      help='Serve a state directory under /chips/NAME/ (repeatable)')
+    parser.add_argument('--registry', type=str, help='JSON file mapping chip names to state directories')
+    parser.add_argument('--root', type=str,
+                      help='Serve every subdirectory of this directory holding a state.json, by directory name')
+    parser.add_argument('--max-open', type=int, default=DEFAULT_MAX_OPEN,
+                      help=f'Chips kept in memory with their cache and history (default: {DEFAULT_MAX_OPEN})')
+    parser.add_argument('--host', type=str, default="0.0.0.0", help='Host to bind (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=8000, help='Port to bind (default: 8000)')
+    args = parser.parse_args()
+
+    directories = load_registry(args.registry) if args.registry else {}
+    for entry in args.chip:
+        name, sep, path = entry.partition('=')
+        if not sep:
+            parser.error(f"--chip expects NAME=PATH, got {entry!r}")
+        directories[name] = path
+    if not directories and not args.root:
+        # A single chip, as before: QUAM_STATE_PATH or ./quam_state
+        directories['default'] = os.environ.get('QUAM_STATE_PATH') or "quam_state"
+
+    editor.registry = ChipRegistry(directories, root=args.root, max_open=args.max_open)
+    uvicorn.run(editor.app, host=args.host, port=args.port)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,173 @@
+import re
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+STATIC_DIR = Path(__file__).parent / "static"
+
+# The page, served at / and /chips/{chip}/; the other static files get versioned names
+INDEX = "index.html"
+
+# Versioned assets never change under their name; the page itself is revalidated
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# API responses are compressed from this size, smaller ones gain nothing
+MINIMUM_SIZE = 500
+
+API_PATH = re.compile(r'^(/chips/[^/]+)?/api/')
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript')
+
+def _brotli():
+    # Optional: without the brotli package, responses are gzip compressed
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+def compress(body, encoding, static=False):
+    """Compress a body with 'br' or 'gzip', at the highest level for static assets"""
+    if encoding == 'br':
+        return _brotli().compress(body, quality=11 if static else 5)
+    # mtime=0 keeps the compressed bytes, and so the ETag, stable across restarts
+    return gzip.compress(body, compresslevel=9 if static else 6, mtime=0)
+
+def accepted_encoding(accept_encoding):
+    """Return the best encoding of an Accept-Encoding header we can produce, or None"""
+    accepted = set()
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        params = params.replace(' ', '')
+        try:
+            quality = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    if ('br' in accepted or '*' in accepted) and _brotli() is not None:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+# Entity tags of an If-None-Match list, weak or strong, or "*"
+ENTITY_TAG = re.compile(r'\*|(?:W/)?"[^"]*"')
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header matches an ETag, by the weak comparison of RFC 7232:
+    "*" matches any ETag, and W/"x" matches "x" """
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for tag in ENTITY_TAG.findall(if_none_match):
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == opaque:
+            return True
+    return False
+
+class Asset:
+    """A static file held in memory with its precompressed encodings and ETag"""
+
+    def __init__(self, name, body, content_type, cache_control):
+        self.name = name
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        self.encoded = {'gzip': compress(body, 'gzip', static=True)}
+        if _brotli() is not None:
+            self.encoded['br'] = compress(body, 'br', static=True)
+
+    def response(self, request):
+        """Return the asset as the request accepts it, or 304 if the client has it"""
+        encoding = accepted_encoding(request.headers.get('accept-encoding', ''))
+        body = self.encoded.get(encoding, self.body)
+        headers = {
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding',
+            # One ETag per encoding, as the bytes differ
+            'ETag': self.etag if body is self.body else f'{self.etag[:-1]}-{encoding}"',
+        }
+        if etag_matches(request.headers.get('if-none-match', ''), headers['ETag']):
+            return Response(status_code=304, headers=headers)
+        if body is not self.body:
+            headers['Content-Encoding'] = encoding
+        return Response(body, media_type=self.content_type, headers=headers)
+
+def versioned_name(name, body):
+    """editor.js -> editor.<hash>.js, so a changed file gets a new URL"""
+    stem, dot, suffix = name.rpartition('.')
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}.{suffix}"
+
+def load_assets(static_dir=STATIC_DIR):
+    """Load and precompress the static files once.
+
+    Return (page, assets): the page Asset, with its references to the other files rewritten
+    to their versioned names, and {versioned name: Asset}.
+    """
+    assets = {}
+    urls = {}
+    for path in sorted(static_dir.iterdir()):
+        if path.name == INDEX or not path.is_file():
+            continue
+        body = path.read_bytes()
+        content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        name = versioned_name(path.name, body)
+        assets[name] = Asset(name, body, content_type, IMMUTABLE)
+        urls[f"/static/{path.name}"] = f"/static/{name}"
+    html = (static_dir / INDEX).read_text()
+    for url, versioned_url in urls.items():
+        html = html.replace(f'"{url}"', f'"{versioned_url}"')
+    page = Asset(INDEX, html.encode(), 'text/html; charset=utf-8', REVALIDATE)
+    return page, assets
+
+class CompressionMiddleware:
+    """Compress API responses with brotli (when installed) or gzip, as the client accepts.
+
+    Responses are buffered until complete, which suits the JSON responses of the API.
+    """
+
+    def __init__(self, app, minimum_size=MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not API_PATH.match(scope['path']):
+            await self.app(scope, receive, send)
+            return
+        encoding = accepted_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            if message['type'] != 'http.response.body':
+                await send(message)
+                return
+            chunks.append(message.get('body', b''))
+            if message.get('more_body', False):
+                return
+            body = b''.join(chunks)
+            headers = MutableHeaders(raw=list(start['headers']))
+            content_type = headers.get('content-type', '')
+            if (len(body) >= self.minimum_size and 'content-encoding' not in headers
+                    and content_type.startswith(COMPRESSIBLE_TYPES)):
+                body = compress(body, encoding)
+                headers['Content-Encoding'] = encoding
+                headers['Content-Length'] = str(len(body))
+                headers.add_vary_header('Accept-Encoding')
+            await send(dict(start, headers=headers.raw))
+            await send({'type': 'http.response.body', 'body': body})
+
+        await self.app(scope, receive, send_compressed)
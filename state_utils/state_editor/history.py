@@ -0,0 +1,154 @@
+"""
+Version history of the state kept by the editor
+"""
+
+import json
+import time
+from collections import deque
+from ..state_diff import MerkleTree, diff_trees, apply_changes, invert_changes, group_by_qubit
+
+# Memory budget of the stored patches (bytes) and most revisions kept
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_MAX_REVISIONS = 1000
+
+class StateHistory:
+    """Undo/redo history of a state document, stored as patches.
+
+    Only the document at the cursor is held in full. Every revision is the patch that
+    leads to it from the previous one, with old and new values, so moving the cursor or
+    viewing another revision applies patches with path copying and shares everything
+    else with the current document. Documents handed to or returned by the history
+    must not be modified in place.
+
+    When the patches exceed `max_bytes` or `max_revisions`, the oldest are evicted and
+    their revisions can no longer be reached.
+    """
+
+    def __init__(self, document, max_bytes=DEFAULT_MAX_BYTES, max_revisions=DEFAULT_MAX_REVISIONS):
+        self.document = document
+        self.max_bytes = max_bytes
+        self.max_revisions = max_revisions
+        # Patches of revisions first_revision + 1 ... first_revision + len(entries)
+        self.entries = deque()
+        self.first_revision = 0
+        self.revision = 0
+        self.size = 0
+        # Hashes of the current document, built at the first diff and then updated with the patches
+        self.tree = None
+
+    @property
+    def last_revision(self):
+        return self.first_revision + len(self.entries)
+
+    def _entry(self, revision):
+        return self.entries[revision - self.first_revision - 1]
+
+    def record(self, document, source='editor', changes=None):
+        """Make a new document the current revision, dropping the revisions that were undone.
+
+        `changes` from the current document can be given when they are known, which saves
+        diffing the two documents. Returns the new revision, or None if nothing changed.
+        """
+        tree = None
+        if changes is None:
+            if self.tree is None:
+                self.tree = MerkleTree(self.document)
+            tree = MerkleTree(document)
+            changes = diff_trees(self.tree, tree)
+        if not changes:
+            return None
+        while self.last_revision > self.revision:
+            self.size -= self.entries.pop()['size']
+
+        entry = {
+            'revision': self.revision + 1,
+            'time': time.time(),
+            'source': source,
+            'changes': changes,
+            'qubits': sorted(name for name in group_by_qubit(changes) if name),
+            # Serialized size of the patch, the values themselves are shared with the documents
+            'size': len(json.dumps(changes)),
+        }
+        self.entries.append(entry)
+        self.size += entry['size']
+        self.document = document
+        self.revision += 1
+        if tree is not None:
+            self.tree = tree
+        elif self.tree is not None:
+            self.tree.update(changes)
+
+        while self.entries and (self.size > self.max_bytes or len(self.entries) > self.max_revisions):
+            self.size -= self.entries.popleft()['size']
+            self.first_revision += 1
+        return self.revision
+
+    def can_undo(self):
+        return self.revision > self.first_revision
+
+    def can_redo(self):
+        return self.revision < self.last_revision
+
+    def previous_document(self):
+        """Return the document of the previous revision, without moving the cursor"""
+        if not self.can_undo():
+            raise IndexError("Nothing to undo")
+        return apply_changes(self.document, invert_changes(self._entry(self.revision)['changes']))
+
+    def next_document(self):
+        """Return the document of the next revision, without moving the cursor"""
+        if not self.can_redo():
+            raise IndexError("Nothing to redo")
+        return apply_changes(self.document, self._entry(self.revision + 1)['changes'])
+
+    def move_to(self, revision, document):
+        """Move the cursor to a stored revision once its document was written"""
+        if not self.first_revision <= revision <= self.last_revision:
+            raise IndexError(f"Revision {revision} is not in the history "
+                             f"({self.first_revision} to {self.last_revision})")
+        if self.tree is not None:
+            if revision == self.revision - 1:
+                self.tree.update(invert_changes(self._entry(self.revision)['changes']))
+            elif revision == self.revision + 1:
+                self.tree.update(self._entry(revision)['changes'])
+            elif revision != self.revision:
+                self.tree = None
+        self.revision = revision
+        self.document = document
+
+    def undo(self):
+        """Move to the previous revision and return its document"""
+        self.move_to(self.revision - 1, self.previous_document())
+        return self.document
+
+    def redo(self):
+        """Move to the next revision and return its document"""
+        self.move_to(self.revision + 1, self.next_document())
+        return self.document
+
+    def document_at(self, revision):
+        """Return the document of any stored revision, without moving the cursor"""
+        if not self.first_revision <= revision <= self.last_revision:
+            raise IndexError(f"Revision {revision} is not in the history "
+                             f"({self.first_revision} to {self.last_revision})")
+        document = self.document
+        for r in range(self.revision, revision, -1):
+            document = apply_changes(document, invert_changes(self._entry(r)['changes']))
+        for r in range(self.revision + 1, revision + 1):
+            document = apply_changes(document, self._entry(r)['changes'])
+        return document
+
+    def summary(self):
+        """Return the stored revisions without their patches"""
+        return {
+            'revision': self.revision,
+            'first_revision': self.first_revision,
+            'last_revision': self.last_revision,
+            'size': self.size,
+            'max_bytes': self.max_bytes,
+            'revisions': [
+                dict({key: entry[key] for key in ('revision', 'time', 'source', 'qubits', 'size')},
+                     num_changes=len(entry['changes']))
+                for entry in self.entries
+            ],
+        }
@@ -0,0 +1,73 @@
+"""
+Qubit view of a state: the values the editor shows and edits
+"""
+
+from ..references import escape_key, resolve_pointer
+from ..state_diff import REPLACE
+
+# State paths of the editable fields, per qubit
+EDITABLE_FIELDS = {
+    'amplitude': "resonator/operations/readout/amplitude",
+    'length': "resonator/operations/readout/length",
+    'resonator_if': "resonator/intermediate_frequency",
+    'xy_if': "xy/intermediate_frequency",
+}
+
+_MISSING = object()
+
+def qubits_from_state(state_data):
+    """Build the /api/qubits response from a state document"""
+    qubits = {}
+    active_qubits = set(state_data.get("active_qubit_names", []))
+    for qubit_id, qubit_data in state_data["qubits"].items():
+        try:
+            qubits[qubit_id] = {
+                'amplitude': qubit_data["resonator"]["operations"]["readout"]["amplitude"],
+                'length': qubit_data["resonator"]["operations"]["readout"]["length"],
+                'resonator_if': qubit_data["resonator"]["intermediate_frequency"],
+                'xy_if': qubit_data["xy"]["intermediate_frequency"],
+                'active': qubit_id in active_qubits
+            }
+        except KeyError:
+            qubits[qubit_id] = {
+                'amplitude': 0.0,
+                'length': 0.0,
+                'resonator_if': 0.0,
+                'xy_if': 0.0,
+                'active': qubit_id in active_qubits
+            }
+    return qubits
+
+def qubits_from_snapshot(snapshot):
+    """Build the /api/qubits response from the columns of a state snapshot"""
+    active_qubits = set(snapshot.header['active_qubit_names'])
+    columns = [snapshot.values(name) for name in ('readout_amplitude', 'readout_length', 'resonator_if', 'xy_if')]
+    qubits = {}
+    for qubit_id, amplitude, length, resonator_if, xy_if in zip(snapshot.qubits, *columns):
+        if amplitude != amplitude:
+            # NaN: the qubit misses one of the fields, as in the KeyError case of qubits_from_state
+            amplitude, length, resonator_if, xy_if = 0.0, 0.0, 0.0, 0.0
+        qubits[qubit_id] = {
+            'amplitude': amplitude,
+            'length': length,
+            'resonator_if': resonator_if,
+            'xy_if': xy_if,
+            'active': qubit_id in active_qubits
+        }
+    return qubits
+
+def edit_changes(state, edits):
+    """Return the changes that apply {qubit: {field: value}} edits to a state.
+
+    Raises KeyError for qubits missing one of the fields.
+    """
+    changes = []
+    for qubit_id, values in edits.items():
+        for field, path in EDITABLE_FIELDS.items():
+            pointer = f"#/qubits/{escape_key(qubit_id)}/{path}"
+            old = resolve_pointer(state, pointer, _MISSING)
+            if old is _MISSING:
+                raise KeyError(f"Invalid qubit data for {qubit_id}: {pointer}")
+            if old != values[field]:
+                changes.append({'op': REPLACE, 'path': pointer, 'old': old, 'new': values[field]})
+    return changes
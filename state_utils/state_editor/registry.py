@@ -0,0 +1,222 @@
+"""
+State directories (chips) served by the editor
+"""
+
+import re
+import json
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from ..snapshot import load_snapshot
+from ..state_diff import apply_changes
+from ..transaction import LostUpdateError, StateTransaction, read_state, state_directory, state_fingerprint
+from .history import StateHistory
+from .qubits import edit_changes, qubits_from_snapshot, qubits_from_state
+
+# Chips kept open (cache and history) before the least recently used one is closed
+DEFAULT_MAX_OPEN = 8
+
+# Chip names usable in a URL path, which also keeps them inside the root directory
+CHIP_NAME = re.compile(r'^(?!\.)[A-Za-z0-9_.-]+$')
+
+class Chip:
+    """One state directory served by the editor.
+
+    The state and the qubit view built from it are cached in memory, and every access
+    compares the fingerprint of the files to notice writes by other programs. Access
+    goes through the chip's lock, so requests for one chip are serialized while different
+    chips are served in parallel.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.directory = state_directory(path)
+        self.state_file = self.directory / "state.json"
+        self.lock = threading.RLock()
+        # Cached state and the revision it was read or written at
+        self.state = None
+        self.revision = None
+        # Cached qubit view and the fingerprint of the files it was built from
+        self._qubits = None
+        # Undo history, started at the first edit, and the revision it is in sync with
+        self.history = None
+        self.history_revision = None
+        # Fingerprint of the files when the qubits were last served, for check-updates
+        self.served_fingerprint = None
+
+    def document(self):
+        """Return the state, from the cache while the files are unchanged"""
+        with self.lock:
+            if self.state is None or self.revision.fingerprint != state_fingerprint(self.directory):
+                self.state, self.revision = read_state(self.directory)
+            return self.state
+
+    def qubits(self):
+        """Return the editable values of every qubit"""
+        with self.lock:
+            fingerprint = state_fingerprint(self.directory)
+            self.served_fingerprint = fingerprint
+            if self._qubits is None or self._qubits[0] != fingerprint:
+                qubits = None
+                if self.state is None:
+                    # Cold cache: the binary snapshot avoids parsing state.json when it is up to date
+                    snapshot = load_snapshot(self.state_file)
+                    if snapshot is not None:
+                        with snapshot:
+                            # Values the snapshot cannot hold as numbers are served from the JSON
+                            if not snapshot.header['opaque_qubits']:
+                                qubits = qubits_from_snapshot(snapshot)
+                if qubits is None:
+                    qubits = qubits_from_state(self.document())
+                self._qubits = (fingerprint, qubits)
+            return self._qubits[1]
+
+    def modified(self):
+        """Whether the files changed since the qubits were last served"""
+        return state_fingerprint(self.directory) != self.served_fingerprint
+
+    def _sync_history(self, state, revision):
+        """Start the history, or record the state as an external revision if another program wrote it"""
+        if self.history is None:
+            self.history = StateHistory(state)
+        elif revision != self.history_revision:
+            self.history.record(state, source='external')
+        self.history_revision = revision
+
+    def _write(self, update, rebase=True):
+        """Replace the state by `update(state)` under the write lock and cache the result.
+
+        A state written by another program since the history was last in sync is recorded
+        as an external revision first. Without `rebase`, the write is then refused with
+        LostUpdateError, as `update` was meant for the state the history last wrote.
+        """
+        transaction = StateTransaction(self.directory)
+        with transaction as state:
+            external = self.history is not None and transaction.lock.revision != self.history_revision
+            self._sync_history(state, transaction.lock.revision)
+            if external and not rebase:
+                raise LostUpdateError(f"{self.directory} was changed by another program, reload it before "
+                                      f"undoing or redoing (it is now revision {self.history.revision} of the history)")
+            transaction.state = update(state)
+        self.state = transaction.state
+        self.revision = self.history_revision = transaction.revision
+
+    def save(self, edits):
+        """Write {qubit: {field: value}} edits and return the new history revision.
+
+        Raises KeyError for qubits missing one of the fields.
+        """
+        with self.lock:
+            changes = []
+
+            def update(state):
+                changes.extend(edit_changes(state, edits))
+                # Copy only the edited branches, the history shares the rest with the previous revision
+                return apply_changes(state, changes)
+
+            self._write(update)
+            self.history.record(self.state, changes=changes)
+            return self.history.revision
+
+    def _history_status(self):
+        return {"revision": self.history.revision, "can_undo": self.history.can_undo(), "can_redo": self.history.can_redo()}
+
+    def undo(self):
+        """Write the previous revision of the history, IndexError if there is none and
+        LostUpdateError if another program wrote the state since"""
+        with self.lock:
+            self._write(lambda state: self.history.previous_document(), rebase=False)
+            # Only moved once the write went through
+            self.history.move_to(self.history.revision - 1, self.state)
+            return self._history_status()
+
+    def redo(self):
+        """Write the next revision of the history, IndexError if there is none and
+        LostUpdateError if another program wrote the state since"""
+        with self.lock:
+            self._write(lambda state: self.history.next_document(), rebase=False)
+            self.history.move_to(self.history.revision + 1, self.state)
+            return self._history_status()
+
+    def history_summary(self):
+        with self.lock:
+            if self.history is None:
+                self._sync_history(self.document(), self.revision)
+            return self.history.summary()
+
+    def qubits_at(self, revision):
+        """Return the qubit values of a stored revision, IndexError if it is not stored"""
+        with self.lock:
+            if self.history is None:
+                self._sync_history(self.document(), self.revision)
+            return qubits_from_state(self.history.document_at(revision))
+
+class ChipRegistry:
+    """Chips served by the editor, by name.
+
+    Chips are configured by name or, with `root`, found as the subdirectories of `root`
+    that hold a state.json. A chip is opened on first use, and the least recently used
+    one is closed, dropping its cache and history, when more than `max_open`
+    are open.
+    """
+
+    def __init__(self, directories=None, root=None, max_open=DEFAULT_MAX_OPEN):
+        self.directories = OrderedDict()
+        for name, path in (directories or {}).items():
+            self.add(name, path)
+        self.root = Path(root) if root else None
+        self.max_open = max_open
+        self.open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, name, path):
+        if not CHIP_NAME.match(name):
+            raise ValueError(f"Invalid chip name {name!r}, use letters, digits, '_', '-' and '.'")
+        self.directories[name] = Path(path)
+
+    def names(self):
+        """Return the configured chips, then those found in the root directory"""
+        names = list(self.directories)
+        if self.root is not None and self.root.is_dir():
+            names += sorted(
+                path.parent.name for path in self.root.glob('*/state.json')
+                if CHIP_NAME.match(path.parent.name) and path.parent.name not in self.directories
+            )
+        return names
+
+    @property
+    def default(self):
+        """The chip served at the top-level routes: the first configured or found one"""
+        names = self.names()
+        return names[0] if names else None
+
+    def path(self, name):
+        if name in self.directories:
+            return self.directories[name]
+        if self.root is not None and CHIP_NAME.match(name) and (self.root / name / "state.json").is_file():
+            return self.root / name
+        raise KeyError(f"Unknown chip: {name}")
+
+    def get(self, name=None):
+        """Return an open chip by name, the default chip for None. KeyError if it is unknown"""
+        if name is None:
+            name = self.default
+            if name is None:
+                raise KeyError("No chips configured")
+        with self._lock:
+            chip = self.open.get(name)
+            if chip is None:
+                chip = self.open[name] = Chip(name, self.path(name))
+                while len(self.open) > self.max_open:
+                    self.open.popitem(last=False)
+            else:
+                self.open.move_to_end(name)
+            return chip
+
+def load_registry(path):
+    """Read a JSON registry {"chip name": "state directory"}, relative paths are taken from
+    the registry's directory"""
+    path = Path(path)
+    with open(path, 'r') as f:
+        directories = json.load(f)
+    return {name: path.parent / directory for name, directory in directories.items()}
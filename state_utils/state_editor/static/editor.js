@@ -0,0 +1,172 @@
+// The page is the same for every chip: the chip and its API come from the URL,
+// /chips/{chip}/ or / for the default chip
+const CHIP_MATCH = location.pathname.match(/^\/chips\/([^\/]+)\//);
+const API = CHIP_MATCH ? '/chips/' + CHIP_MATCH[1] + '/api' : '/api';
+let qubitData = {};
+let autoRefreshInterval = null;
+let isAutoRefreshEnabled = true;
+
+function startAutoRefresh() {
+    if (autoRefreshInterval) return;
+    autoRefreshInterval = setInterval(checkForUpdates, 2000);
+}
+
+function stopAutoRefresh() {
+    if (autoRefreshInterval) {
+        clearInterval(autoRefreshInterval);
+        autoRefreshInterval = null;
+    }
+}
+
+async function checkForUpdates() {
+    try {
+        const response = await fetch(API + '/check-updates');
+        const data = await response.json();
+        if (data.modified) {
+            await loadData();
+            showStatus('Data refreshed from external changes', 'success');
+        }
+    } catch (error) {
+        console.error('Error checking for updates:', error);
+    }
+}
+
+async function loadChips() {
+    const response = await fetch('/api/chips');
+    const result = await response.json();
+    const chip = CHIP_MATCH ? decodeURIComponent(CHIP_MATCH[1]) : result.default;
+    document.getElementById('chipName').textContent = chip;
+    const select = document.getElementById('chipSelect');
+    for (const name of result.chips) {
+        const option = new Option(name, name, false, name === chip);
+        select.add(option);
+    }
+}
+
+async function loadData() {
+    try {
+        const response = await fetch(API + '/qubits');
+        qubitData = await response.json();
+        updateTable();
+    } catch (error) {
+        showStatus('Error loading data: ' + error, 'error');
+    }
+}
+
+function updateTable() {
+    const tbody = document.getElementById('qubit-table');
+    tbody.innerHTML = '';
+
+    for (const [qubitId, data] of Object.entries(qubitData)) {
+        const row = document.createElement('tr');
+        row.innerHTML = `
+            <td>${qubitId}${data.active ? '<span class="active-indicator">✓</span>' : ''}</td>
+            <td><input type="number" step="any" value="${data.amplitude}" 
+                onchange="updateValue('${qubitId}', 'amplitude', this.value)"></td>
+            <td><input type="number" step="1" value="${data.length}" 
+                onchange="updateValue('${qubitId}', 'length', this.value)"></td>
+            <td><input type="number" step="any" value="${data.resonator_if}" 
+                onchange="updateValue('${qubitId}', 'resonator_if', this.value)"></td>
+            <td><input type="number" step="any" value="${data.xy_if}" 
+                onchange="updateValue('${qubitId}', 'xy_if', this.value)"></td>
+        `;
+        tbody.appendChild(row);
+    }
+}
+
+function updateValue(qubitId, field, value) {
+    if (field === 'length') {
+        qubitData[qubitId][field] = parseInt(value);
+    } else {
+        qubitData[qubitId][field] = parseFloat(value);
+    }
+}
+
+async function saveChanges() {
+    try {
+        const response = await fetch(API + '/save', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ qubits: qubitData })
+        });
+
+        const result = await response.json();
+        if (response.ok) {
+            showStatus('Changes saved successfully!', 'success');
+        } else {
+            showStatus('Error: ' + result.error, 'error');
+        }
+    } catch (error) {
+        showStatus('Error saving changes: ' + error, 'error');
+    }
+}
+
+async function moveHistory(direction) {
+    try {
+        const response = await fetch(API + '/' + direction, { method: 'POST' });
+        const result = await response.json();
+        if (response.ok) {
+            await loadData();
+            showStatus('Moved to revision ' + result.revision, 'success');
+        } else if (response.status === 409) {
+            // Written by another program: show its values before the user undoes anything
+            await loadData();
+            showStatus(result.detail, 'error');
+        } else {
+            showStatus('Error: ' + result.detail, 'error');
+        }
+    } catch (error) {
+        showStatus('Error moving in history: ' + error, 'error');
+    }
+}
+
+function showStatus(message, type) {
+    const statusDiv = document.getElementById('status-message');
+    statusDiv.textContent = message;
+    statusDiv.className = 'status-message ' + type;
+    statusDiv.style.display = 'block';
+    setTimeout(() => {
+        statusDiv.style.display = 'none';
+    }, 3000);
+}
+
+// Add auto-refresh toggle functionality
+document.getElementById('autoRefreshToggle').addEventListener('change', function(e) {
+    isAutoRefreshEnabled = e.target.checked;
+    if (isAutoRefreshEnabled) {
+        startAutoRefresh();
+    } else {
+        stopAutoRefresh();
+    }
+});
+
+// Add keyboard shortcut for saving
+document.addEventListener('keydown', function(e) {
+    if (e.ctrlKey && e.key === 's') {
+        e.preventDefault(); // Prevent browser's save dialog
+        saveChanges();
+    } else if (e.ctrlKey && e.key === 'z' && e.target.tagName !== 'INPUT') {
+        // Inside an input Ctrl+Z keeps undoing the typing
+        e.preventDefault();
+        moveHistory('undo');
+    } else if (e.ctrlKey && e.key === 'y' && e.target.tagName !== 'INPUT') {
+        e.preventDefault();
+        moveHistory('redo');
+    }
+});
+
+// Time from navigation to the first table with data, also available to the browser's
+// performance tools as the 'first-render' mark
+function reportFirstRender() {
+    const mark = performance.mark('first-render');
+    const elapsed = mark ? mark.startTime : performance.now();
+    document.getElementById('renderTime').textContent = 'First render in ' + elapsed.toFixed(0) + ' ms';
+    console.info('State editor first render: ' + elapsed.toFixed(1) + ' ms');
+}
+
+// Load data when page loads and start auto-refresh
+loadChips();
+loadData().then(reportFirstRender);
+startAutoRefresh();
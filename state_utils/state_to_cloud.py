@@ -1,18 +1,304 @@
 #!/usr/bin/env python3
+import sys
 import json
 import os
+import time
 import argparse
+import threading
+import multiprocessing
 from pathlib import Path
-from quam_libs.lib.iqcc_cloud_storage_utils import save_quam_state_to_cloud
-from iqcc_cloud_client import IQCC_Cloud
+from functools import partial
+from urllib import request, error
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .state_diff import MerkleTree, diff_trees, group_by_qubit, format_changes
+
+# Uploads running at the same time in batch mode
+DEFAULT_PARALLEL = 4
+
+# Uploads started per second for each backend in batch mode
+DEFAULT_RATE_LIMIT = 1.0
+
+# Held while an upload points QUAM_STATE_PATH at its folder
+_environ_lock = threading.Lock()
+
+class IQCCStateClient:
+    """Uploads through quam_libs and reads back through the IQCC cloud client"""
+
+    def __init__(self, quantum_computer_backend):
+        # Imported here so the mock cloud can be used without the IQCC packages
+        from iqcc_cloud_client import IQCC_Cloud
+        self.qc = IQCC_Cloud(quantum_computer_backend=quantum_computer_backend)
+
+    def upload(self, folder, wiring, state):
+        from quam_libs.lib.iqcc_cloud_storage_utils import save_quam_state_to_cloud
+        # save_quam_state_to_cloud reads the state folder from the environment, which the
+        # threads of the process share: set it for this upload only
+        with _environ_lock:
+            previous = os.environ.get("QUAM_STATE_PATH")
+            os.environ["QUAM_STATE_PATH"] = str(folder)
+            try:
+                save_quam_state_to_cloud()
+            finally:
+                if previous is None:
+                    del os.environ["QUAM_STATE_PATH"]
+                else:
+                    os.environ["QUAM_STATE_PATH"] = previous
+
+    def get_latest(self, datatype):
+        return self.qc.state.get_latest(datatype).data
+
+class HTTPStateClient:
+    """Client of the state API served by mock_cloud"""
+
+    def __init__(self, url, quantum_computer_backend, timeout=30.0):
+        self.url = f"{url.rstrip('/')}/v1/backends/{quantum_computer_backend}/state"
+        self.timeout = timeout
+
+    def _request(self, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = request.Request(f"{self.url}/{path}", data=data, headers={"Content-Type": "application/json"})
+        try:
+            with request.urlopen(req, timeout=self.timeout) as response:
+                return json.load(response)
+        except error.HTTPError as e:
+            raise RuntimeError(f"{req.get_method()} {req.full_url} failed with HTTP {e.code}") from None
+
+    def upload(self, folder, wiring, state):
+        self._request("wiring", {'data': wiring})
+        self._request("state", {'data': state})
+
+    def get_latest(self, datatype):
+        return self._request(f"{datatype}/latest")['data']
+
+def load_state_folder(folder, state_file='state.json', wiring_file='wiring.json'):
+    """Load the wiring and state files of a state folder"""
+    with open(Path(folder) / wiring_file, "r") as f:
+        wiring = json.load(f)
+    with open(Path(folder) / state_file, "r") as f:
+        state = json.load(f)
+    return wiring, state
+
+def _local_tree(path, trees):
+    """Return the MerkleTree of a local file, the one kept in `trees` while the file has
+    the same size and mtime"""
+    info = os.stat(path)
+    key = (info.st_size, info.st_mtime_ns)
+    cached = trees.get(str(path)) if trees is not None else None
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with open(path, "r") as f:
+        tree = MerkleTree(json.load(f))
+    if trees is not None:
+        trees[str(path)] = (key, tree)
+    return tree
+
+def upload_state(folder, make_client, state_file='state.json', wiring_file='wiring.json', trees=None):
+    """Upload a state folder, read it back and diff it against the local files.
+
+    `make_client(quantum_computer_backend)` creates the client, IQCCStateClient or a
+    partial of HTTPStateClient. `trees` is a dict kept by the caller between uploads, in
+    which the hashes of the uploaded files are kept: a file unchanged since its last
+    upload is not read or hashed again, only the document read back from the cloud is.
+    Returns the upload and verification times (s) and the state and wiring differences
+    (local -> cloud).
+    """
+    wiring_tree = _local_tree(Path(folder) / wiring_file, trees)
+    state_tree = _local_tree(Path(folder) / state_file, trees)
+    wiring, state = wiring_tree.document, state_tree.document
+    client = make_client(wiring["network"]["quantum_computer_backend"])
+
+    start = time.perf_counter()
+    client.upload(folder, wiring, state)
+    uploaded = time.perf_counter()
+    latest_wiring = client.get_latest("wiring")
+    latest_state = client.get_latest("state")
+    verified = time.perf_counter()
+
+    return {
+        'upload': uploaded - start,
+        'verify': verified - uploaded,
+        'state_changes': diff_trees(state_tree, MerkleTree(latest_state)),
+        'wiring_changes': diff_trees(wiring_tree, MerkleTree(latest_wiring)),
+    }
+
+class RateLimiter:
+    """Token bucket per backend: `rate` uploads per second with bursts of `burst`.
+
+    Callers reserve a token and sleep until it is due, so waiting callers are served in
+    the order they arrived. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, burst=1, rates=None):
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, backend):
+        """Wait for a token of the backend and return the time waited (s)"""
+        rate = self.rates.get(backend, self.rate)
+        if not rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(backend, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * rate) - 1
+            self._buckets[backend] = (tokens, now)
+        # A negative balance is the wait for the reserved token
+        wait = -tokens / rate if tokens < 0 else 0.0
+        time.sleep(wait)
+        return wait
+
+def _interleave_by_backend(jobs):
+    """Order (folder, backend) jobs round-robin over the backends, so a rate-limited
+    backend does not hold up the others"""
+    queues = {}
+    for job in jobs:
+        queues.setdefault(job[1], []).append(job)
+    ordered = []
+    while queues:
+        for backend in list(queues):
+            ordered.append(queues[backend].pop(0))
+            if not queues[backend]:
+                del queues[backend]
+    return ordered
+
+def upload_batch(folders, cloud_url=None, parallel=DEFAULT_PARALLEL, limiter=None,
+                 state_file='state.json', wiring_file='wiring.json', trees=None):
+    """Upload many state folders concurrently and return one result row per folder.
+
+    With `cloud_url` the uploads go to the HTTP state API (mock_cloud) from threads.
+    Otherwise they go through IQCCStateClient in worker processes, as the quam_libs
+    upload takes its folder from the process environment. Folders of the same backend
+    are uploaded one at a time, so each verification reads back its own upload. `trees`
+    is passed to upload_state in the threads, to keep the hashes of the files between
+    batches.
+    """
+    limiter = limiter or RateLimiter()
+    jobs = []
+    rows = {}
+    for folder in folders:
+        try:
+            wiring, _ = load_state_folder(folder, state_file, wiring_file)
+            jobs.append((folder, wiring["network"]["quantum_computer_backend"]))
+        except (OSError, ValueError, KeyError) as e:
+            rows[str(folder)] = {'folder': str(folder), 'backend': '?', 'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+
+    backend_locks = {backend: threading.Lock() for _, backend in jobs}
+    # Spawned rather than forked: the pool starts its workers lazily, from the upload
+    # threads, and a fork then would copy locks held by the other threads
+    processes = ProcessPoolExecutor(parallel, mp_context=multiprocessing.get_context('spawn')) if cloud_url is None else None
+    make_client = partial(HTTPStateClient, cloud_url) if cloud_url else IQCCStateClient
+
+    def run(job):
+        folder, backend = job
+        row = {'folder': str(folder), 'backend': backend}
+        start = time.perf_counter()
+        try:
+            with backend_locks[backend]:
+                row['wait'] = limiter.acquire(backend)
+                if processes is not None:
+                    result = processes.submit(upload_state, folder, make_client, state_file, wiring_file).result()
+                else:
+                    result = upload_state(folder, make_client, state_file, wiring_file, trees)
+        except Exception as e:
+            row.update(status='failed', error=f"{type(e).__name__}: {e}")
+        else:
+            row.update(upload=result['upload'], verify=result['verify'],
+                       state_changes=len(result['state_changes']), wiring_changes=len(result['wiring_changes']))
+            mismatched = row['state_changes'] or row['wiring_changes']
+            row['status'] = 'mismatch' if mismatched else 'ok'
+        row['total'] = time.perf_counter() - start
+        return row
+
+    try:
+        with ThreadPoolExecutor(parallel) as threads:
+            for row in threads.map(run, _interleave_by_backend(jobs)):
+                rows[row['folder']] = row
+    finally:
+        if processes is not None:
+            processes.shutdown()
+    return [rows[str(folder)] for folder in folders]
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float('nan')
+
+def print_batch_summary(rows, elapsed):
+    """Print the latency (ms) and status of every upload, then the totals"""
+    print(f"{'Folder':<40} {'Backend':<16} {'Status':<8} {'Wait':>8} {'Upload':>8} {'Verify':>8} {'Total':>8}")
+    for row in rows:
+        times = ' '.join(
+            f"{row[key] * 1e3:>8.0f}" if key in row else f"{'-':>8}"
+            for key in ('wait', 'upload', 'verify', 'total')
+        )
+        print(f"{row['folder'][-40:]:<40} {row['backend']:<16} {row['status']:<8} {times}")
+        if row['status'] == 'failed':
+            print(f"    {row['error']}")
+        elif row['status'] == 'mismatch':
+            print(f"    {row['state_changes']} state and {row['wiring_changes']} wiring differences")
+
+    totals = [row['total'] for row in rows if row['status'] != 'failed']
+    counts = {status: sum(row['status'] == status for row in rows) for status in ('ok', 'mismatch', 'failed')}
+    print(f"\n{counts['ok']} uploaded, {counts['mismatch']} mismatched, {counts['failed']} failed "
+          f"in {elapsed:.2f} s ({len(rows) / elapsed:.1f} folders/s)")
+    if totals:
+        print(f"Latency per folder: p50 {_percentile(totals, 0.5) * 1e3:.0f} ms, "
+              f"p95 {_percentile(totals, 0.95) * 1e3:.0f} ms, max {max(totals) * 1e3:.0f} ms")
+
+def _parse_rates(entries, parser):
+    rates = {}
+    for entry in entries:
+        backend, sep, rate = entry.partition('=')
+        try:
+            rates[backend] = float(rate)
+        except ValueError:
+            sep = ''
+        if not sep:
+            parser.error(f"--backend-rate expects BACKEND=RATE, got {entry!r}")
+    return rates
 
 def main():
     parser = argparse.ArgumentParser(description='Upload quantum state to cloud storage')
     parser.add_argument('--state-path', type=str, help='Path to the state directory (default: QUAM_STATE_PATH env var)')
     parser.add_argument('--wiring-file', type=str, default='wiring.json', help='Name of the wiring file (default: wiring.json)')
     parser.add_argument('--state-file', type=str, default='state.json', help='Name of the state file (default: state.json)')
+    parser.add_argument('--batch', type=str, nargs='+', metavar='STATE_PATH',
+                      help='Upload several state directories concurrently and print a summary table')
+    parser.add_argument('--parallel', type=int, default=DEFAULT_PARALLEL,
+                      help=f'Uploads running at the same time in batch mode (default: {DEFAULT_PARALLEL})')
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_RATE_LIMIT,
+                      help=f'Uploads started per second for each backend in batch mode, 0 for no limit (default: {DEFAULT_RATE_LIMIT})')
+    parser.add_argument('--backend-rate', action='append', default=[], metavar='BACKEND=RATE',
+                      help='Rate limit of one backend, overriding --rate-limit (repeatable)')
+    parser.add_argument('--cloud-url', type=str,
+                      help='Use the HTTP state API at this URL (a mock_cloud server) instead of the IQCC cloud')
+    parser.add_argument('--mock', action='store_true',
+                      help='Start a local mock cloud and upload to it, to benchmark offline')
+    parser.add_argument('--mock-latency', type=float, default=0.0,
+                      help='Delay added to every mock cloud request in seconds (default: 0)')
     args = parser.parse_args()
 
+    if args.parallel < 1:
+        parser.error("--parallel must be at least 1")
+
+    cloud_url = args.cloud_url
+    if args.mock:
+        from .mock_cloud import start_server
+        _, cloud_url = start_server(latency=args.mock_latency)
+        print(f"Uploading to the mock cloud at {cloud_url}")
+
+    if args.batch:
+        limiter = RateLimiter(args.rate_limit, rates=_parse_rates(args.backend_rate, parser))
+        start = time.perf_counter()
+        rows = upload_batch([Path(folder) for folder in args.batch], cloud_url, args.parallel, limiter,
+                            args.state_file, args.wiring_file)
+        print_batch_summary(rows, time.perf_counter() - start)
+        if any(row['status'] != 'ok' for row in rows):
+            sys.exit(1)
+        return
+
     # Determine state path
     quam_state_folder_path = args.state_path or os.environ.get("QUAM_STATE_PATH")
     if not quam_state_folder_path:
@@ -20,32 +306,22 @@ def main():
 
     # Convert to Path object for better path handling
     quam_state_folder_path = Path(quam_state_folder_path)
-    wiring_path = quam_state_folder_path / args.wiring_file
-    state_path = quam_state_folder_path / args.state_file
-
-    # Upload state to cloud
-    save_quam_state_to_cloud()
-
-    # Load local wiring and state
-    with open(wiring_path, "r") as f:
-        local_wiring = json.load(f)
-    
-    with open(state_path, "r") as f:
-        local_state = json.load(f)
-
-    # Initialize cloud client
-    quantum_computer_backend = local_wiring["network"]["quantum_computer_backend"]
-    qc = IQCC_Cloud(quantum_computer_backend=quantum_computer_backend)
 
-    # Get latest cloud state
-    latest_wiring = qc.state.get_latest("wiring")
-    latest_state = qc.state.get_latest("state")
+    # Upload state to cloud and get the latest cloud state back
+    make_client = partial(HTTPStateClient, cloud_url) if cloud_url else IQCCStateClient
+    result = upload_state(quam_state_folder_path, make_client, args.state_file, args.wiring_file)
 
-    # Verify data matches
-    assert latest_state.data == local_state, "The latest state dataset does not match the state.json data"
-    assert latest_wiring.data == local_wiring, "The latest wiring dataset does not match the wiring.json data"
+    # Verify data matches, listing what differs per qubit if it does not
+    local_wiring, _ = load_state_folder(quam_state_folder_path, args.state_file, args.wiring_file)
+    state_changes, wiring_changes = result['state_changes'], result['wiring_changes']
+    for name, changes in (("state", state_changes), ("wiring", wiring_changes)):
+        if changes:
+            print(f"\nCloud {name} differs from the local {name} file (local -> cloud):")
+            print(format_changes(group_by_qubit(changes, local_wiring)))
+    assert not state_changes, f"The latest state dataset does not match the state.json data ({len(state_changes)} differences)"
+    assert not wiring_changes, f"The latest wiring dataset does not match the wiring.json data ({len(wiring_changes)} differences)"
 
     print("Successfully uploaded and verified state data")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+import os
+import json
+import stat
+import time
+import shutil
+import argparse
+import threading
+from pathlib import Path
+from collections import namedtuple
+from .snapshot import refresh_snapshot
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows): writes stay atomic and lost updates are still detected
+    fcntl = None
+
+# Longest time to wait for a lock before giving up (s)
+DEFAULT_LOCK_TIMEOUT = 10.0
+
+# Files of a state directory covered by the lock
+STATE_FILES = ("state.json", "wiring.json")
+
+LOCK_FILE = ".state.lock"
+
+# Longest pause between attempts to take a busy lock (s)
+LOCK_POLL_INTERVAL = 0.005
+
+# Revision of a state directory: the counter kept in the lock file and the size and mtime
+# of the state files, which also changes when a program writes them without the lock
+Revision = namedtuple('Revision', ['number', 'fingerprint'])
+
+class LockTimeoutError(TimeoutError):
+    """The lock was not acquired within the timeout"""
+
+class LostUpdateError(RuntimeError):
+    """The state was written by someone else since it was read"""
+
+# Lock contention of this process, see lock_metrics()
+_metrics = {'acquired': 0, 'contended': 0, 'timeouts': 0, 'lost_updates': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+_metrics_lock = threading.Lock()
+
+def _record(**updates):
+    with _metrics_lock:
+        for key, value in updates.items():
+            if key == 'max_wait':
+                _metrics[key] = max(_metrics[key], value)
+            else:
+                _metrics[key] += value
+
+def lock_metrics():
+    """Return the lock acquisitions, contended acquisitions, timeouts, lost updates and
+    wait times (s) of this process"""
+    with _metrics_lock:
+        return dict(_metrics)
+
+def state_directory(path):
+    """Return the state directory of a state directory or state file path"""
+    path = Path(path)
+    return path if path.is_dir() or not path.suffix else path.parent
+
+def _fingerprint(directory):
+    fingerprint = []
+    for name in STATE_FILES:
+        try:
+            stat = os.stat(directory / name)
+            fingerprint.append((name, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            fingerprint.append((name, None, None))
+    return tuple(fingerprint)
+
+def state_fingerprint(path):
+    """Return the size and mtime of the state files, as recorded in a Revision"""
+    return _fingerprint(state_directory(path))
+
+def _copy_mode(source, target):
+    """Give a file about to replace `target` the permissions of `target`, if it exists"""
+    try:
+        mode = stat.S_IMODE(os.stat(target).st_mode)
+    except FileNotFoundError:
+        return
+    os.chmod(source, mode)
+
+def atomic_write_json(path, document, indent=4):
+    """Write JSON to a temporary file and rename it over the target, so readers never see
+    a truncated file. The target keeps its permissions."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(document, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        _copy_mode(tmp_path, path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def replace_files(source_dir, target_dir, names=STATE_FILES):
+    """Move the files written to a staging directory over those of the target directory,
+    keeping the permissions of the files they replace.
+
+    If a move fails, the files moved before it are rolled back, so the target directory
+    is left with either all of the new files or none of them.
+    """
+    source_dir, target_dir = Path(source_dir), Path(target_dir)
+    # The files being replaced, kept under a second name until every move succeeded
+    backups = {}
+    try:
+        for name in names:
+            source, target = source_dir / name, target_dir / name
+            if not source.exists():
+                continue
+            backups[name] = None
+            if target.exists():
+                backup = target_dir / f".{name}.{os.getpid()}.{threading.get_ident()}.bak"
+                try:
+                    os.link(target, backup)
+                except OSError:
+                    # No hard links on this filesystem
+                    shutil.copy2(target, backup)
+                backups[name] = backup
+            _copy_mode(source, target)
+            os.replace(source, target)
+    except BaseException:
+        for name, backup in backups.items():
+            if backup is not None:
+                os.replace(backup, target_dir / name)
+            else:
+                (target_dir / name).unlink(missing_ok=True)
+        raise
+    finally:
+        for backup in backups.values():
+            if backup is not None:
+                backup.unlink(missing_ok=True)
+
+class StateLock:
+    """Advisory lock on a state directory, shared for readers and exclusive for writers.
+
+    The lock is an flock on `.state.lock` in the directory, which also stores the
+    revision counter. Writers call `commit()` after replacing the state files to bump it.
+    """
+
+    def __init__(self, path, exclusive=False, timeout=DEFAULT_LOCK_TIMEOUT):
+        self.directory = state_directory(path)
+        self.exclusive = exclusive
+        self.timeout = timeout
+        self._file = None
+        self.revision = None
+
+    def __enter__(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.directory / LOCK_FILE, 'a+')
+        try:
+            self._acquire()
+        except BaseException:
+            self._file.close()
+            raise
+        self.revision = self._read_revision()
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+    def _acquire(self):
+        if fcntl is None:
+            _record(acquired=1)
+            return
+        operation = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+        start = time.monotonic()
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(self._file, operation | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                waited = time.monotonic() - start
+                if waited >= self.timeout:
+                    _record(timeouts=1, total_wait=waited, max_wait=waited)
+                    raise LockTimeoutError(f"Could not lock {self.directory} within {self.timeout} s")
+                time.sleep(min(delay, self.timeout - waited))
+                # Keep polling fast, a slow poller keeps losing the lock to a busy writer
+                delay = min(delay * 2, LOCK_POLL_INTERVAL)
+        waited = time.monotonic() - start
+        _record(acquired=1, contended=int(waited > 0.001), total_wait=waited, max_wait=waited)
+
+    def _read_revision(self):
+        self._file.seek(0)
+        content = self._file.read()
+        record = json.loads(content) if content.strip() else {'revision': 0, 'fingerprint': None}
+        fingerprint = _fingerprint(self.directory)
+        number = record['revision']
+        if record['fingerprint'] is not None and [list(entry) for entry in fingerprint] != record['fingerprint']:
+            # Written by a program that does not take the lock
+            number += 1
+        return Revision(number, fingerprint)
+
+    def check(self, expected_revision):
+        """Raise LostUpdateError if the state changed since `expected_revision` was read"""
+        if expected_revision is not None and expected_revision != self.revision:
+            _record(lost_updates=1)
+            raise LostUpdateError(
+                f"{self.directory} changed since it was read (revision {expected_revision.number} -> "
+                f"{self.revision.number}), reload it and apply the changes again"
+            )
+
+    def commit(self):
+        """Record the new revision after the state files were replaced"""
+        if not self.exclusive:
+            raise RuntimeError("Committing requires an exclusive lock")
+        self.revision = Revision(self.revision.number + 1, _fingerprint(self.directory))
+        self._file.seek(0)
+        self._file.truncate()
+        json.dump({'revision': self.revision.number, 'fingerprint': self.revision.fingerprint}, self._file)
+        self._file.flush()
+        return self.revision
+
+def read_state(path, timeout=DEFAULT_LOCK_TIMEOUT):
+    """Read state.json under a shared lock and return (state, revision)"""
+    with StateLock(path, timeout=timeout) as lock:
+        with open(lock.directory / "state.json", 'r') as f:
+            return json.load(f), lock.revision
+
+def write_state(path, state, expected_revision=None, timeout=DEFAULT_LOCK_TIMEOUT):
+    """Replace state.json under an exclusive lock and return the new revision.
+
+    With `expected_revision` (from read_state), raises LostUpdateError instead of
+    overwriting changes made since the state was read.
+    """
+    with StateLock(path, exclusive=True, timeout=timeout) as lock:
+        lock.check(expected_revision)
+        state_file = lock.directory / "state.json"
+        atomic_write_json(state_file, state)
+        revision = lock.commit()
+        if (lock.directory / "wiring.json").exists():
+            refresh_snapshot(state_file, state=state)
+        return revision
+
+class StateTransaction:
+    """Read-modify-write of state.json under an exclusive lock.
+
+        with StateTransaction(state_dir) as state:
+            state["qubits"]["q1"]["xy"]["intermediate_frequency"] = 50e6
+
+    The state is written back atomically, with a new revision, when the block exits
+    without an exception. With `expected_revision` the transaction fails with
+    LostUpdateError if the state changed since that revision was read.
+    """
+
+    def __init__(self, path, expected_revision=None, timeout=DEFAULT_LOCK_TIMEOUT):
+        self.lock = StateLock(path, exclusive=True, timeout=timeout)
+        self.expected_revision = expected_revision
+        self.state = None
+        self.revision = None
+
+    def __enter__(self):
+        self.lock.__enter__()
+        try:
+            self.lock.check(self.expected_revision)
+            with open(self.lock.directory / "state.json", 'r') as f:
+                self.state = json.load(f)
+        except BaseException:
+            self.lock.__exit__(None, None, None)
+            raise
+        return self.state
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                state_file = self.lock.directory / "state.json"
+                atomic_write_json(state_file, self.state)
+                self.revision = self.lock.commit()
+                if (self.lock.directory / "wiring.json").exists():
+                    refresh_snapshot(state_file, state=self.state)
+        finally:
+            self.lock.__exit__(exc_type, exc_value, traceback)
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the revision and lock status of a state directory')
+    parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
+                      help='Path to the directory containing state.json (default: QUAM_STATE_PATH environment variable)')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_LOCK_TIMEOUT, help='Lock timeout in seconds (default: 10)')
+    args = parser.parse_args()
+
+    if not args.state_path:
+        raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
+
+    state_dir = Path(args.state_path)
+    if not (state_dir / "state.json").exists():
+        raise FileNotFoundError(f"State file not found: {state_dir / 'state.json'}")
+
+    with StateLock(state_dir, timeout=args.timeout) as lock:
+        print(f"Revision {lock.revision.number} of {state_dir}")
+    metrics = lock_metrics()
+    print(f"Lock acquired after {metrics['total_wait'] * 1e3:.1f} ms")
+
+if __name__ == '__main__':
+    main()
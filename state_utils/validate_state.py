@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import sys
+import json
+import argparse
+import os
+from pathlib import Path
+from collections import defaultdict
+from .references import ReferenceIndex, load_documents, qubit_of
+from .modify_quam import get_band
+
+# Default limit on the absolute intermediate frequency (Hz)
+DEFAULT_IF_LIMIT = 400e6
+
+ERROR = 'error'
+WARNING = 'warning'
+
+def _finding(rule, severity, location, message, qubit=None):
+    return {'rule': rule, 'severity': severity, 'qubit': qubit, 'location': location, 'message': message}
+
+# Qubit rules, called once per qubit during the single pass over the qubits
+
+def check_wiring(qubit_name, qubit_data, wiring_qubit, index, if_limit):
+    """The qubit must be wired, and its XY/RR outputs must have an upconverter frequency"""
+    if wiring_qubit is None:
+        yield _finding('qubit_not_in_wiring', ERROR, f"#/qubits/{qubit_name}",
+                       f"{qubit_name} has no entry in wiring['wiring']['qubits']", qubit_name)
+        return
+    for line in ('xy', 'rr'):
+        reference = wiring_qubit.get(line, {}).get('opx_output')
+        if reference is None:
+            continue
+        port = index.get(reference)
+        # Dangling references are reported by check_references
+        if isinstance(port, dict) and port.get('upconverter_frequency') is None:
+            yield _finding('missing_upconverter_frequency', ERROR, reference,
+                           f"{qubit_name} {line} output {reference} has no upconverter_frequency", qubit_name)
+
+def check_intermediate_frequencies(qubit_name, qubit_data, wiring_qubit, index, if_limit):
+    """XY and resonator intermediate frequencies must stay within the IF limit"""
+    for element in ('xy', 'resonator'):
+        if_freq = qubit_data.get(element, {}).get('intermediate_frequency')
+        if isinstance(if_freq, (int, float)) and abs(if_freq) > if_limit:
+            yield _finding('if_out_of_range', ERROR, f"#/qubits/{qubit_name}/{element}/intermediate_frequency",
+                           f"{qubit_name} {element} IF {if_freq / 1e6:.3f} MHz exceeds ±{if_limit / 1e6:.0f} MHz",
+                           qubit_name)
+
+QUBIT_RULES = (check_wiring, check_intermediate_frequencies)
+
+# Document rules, called once for the whole document set
+
+def check_references(state, wiring, index, grid_locations):
+    """Every "#/..." reference must resolve"""
+    for location, reference in index.dangling_references():
+        yield _finding('dangling_reference', ERROR, location, f"{location} points to missing {reference}",
+                       qubit_of(location))
+
+def check_port_bands(state, wiring, index, grid_locations):
+    """Configured port bands must match the band of their LO frequency"""
+    for group, frequency_key in (('mw_outputs', 'upconverter_frequency'), ('mw_inputs', 'downconverter_frequency')):
+        stack = [(f"#/ports/{group}", state.get('ports', {}).get(group, {}))]
+        while stack:
+            location, node = stack.pop()
+            if not isinstance(node, dict):
+                continue
+            if frequency_key not in node:
+                stack.extend((f"{location}/{key}", value) for key, value in node.items())
+                continue
+            frequency = node[frequency_key]
+            if isinstance(frequency, str) and frequency.startswith('#/'):
+                # Check the referenced value, dangling references are reported by check_references
+                frequency = index.get(frequency)
+            if frequency is None:
+                # Unset on a port no line uses, used ones are reported by check_wiring
+                continue
+            if not isinstance(frequency, (int, float)) or isinstance(frequency, bool):
+                yield _finding('invalid_lo_frequency', ERROR, location,
+                               f"{frequency_key} is {frequency!r}, not a frequency in Hz")
+                continue
+            try:
+                band = get_band(frequency)
+            except ValueError as e:
+                yield _finding('lo_out_of_range', ERROR, location, str(e))
+                continue
+            if 'band' in node and node['band'] != band:
+                yield _finding('band_mismatch', ERROR, location,
+                               f"{frequency_key} {frequency / 1e9:.3f} GHz is in band {band} but the port is set to band {node['band']}")
+
+def check_grid_locations(state, wiring, index, grid_locations):
+    """No two qubits may share a grid location"""
+    for location, qubits in grid_locations.items():
+        if len(qubits) > 1:
+            for qubit_name in qubits:
+                yield _finding('duplicate_grid_location', ERROR, f"#/qubits/{qubit_name}/grid_location",
+                               f"{qubit_name} shares grid location {location} with {', '.join(q for q in qubits if q != qubit_name)}",
+                               qubit_name)
+
+DOCUMENT_RULES = (check_references, check_port_bands, check_grid_locations)
+
+def validate(state, wiring, if_limit=DEFAULT_IF_LIMIT, index=None):
+    """Check the state and wiring documents for consistency and return a list of findings."""
+    if index is None:
+        index = ReferenceIndex(state, wiring)
+    wiring_qubits = wiring.get('wiring', {}).get('qubits', {})
+
+    findings = []
+    grid_locations = defaultdict(list)
+    for qubit_name, qubit_data in state.get('qubits', {}).items():
+        if 'grid_location' in qubit_data:
+            grid_locations[qubit_data['grid_location']].append(qubit_name)
+        wiring_qubit = wiring_qubits.get(qubit_name)
+        for rule in QUBIT_RULES:
+            findings.extend(rule(qubit_name, qubit_data, wiring_qubit, index, if_limit))
+
+    for qubit_name in wiring_qubits.keys() - state.get('qubits', {}).keys():
+        findings.append(_finding('qubit_not_in_state', WARNING, f"#/wiring/qubits/{qubit_name}",
+                                 f"{qubit_name} is wired but has no entry in state['qubits']", qubit_name))
+
+    for rule in DOCUMENT_RULES:
+        findings.extend(rule(state, wiring, index, grid_locations))
+
+    return findings
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate the consistency of a state and wiring file')
+    parser.add_argument('--state-path', type=str, default=os.environ.get('QUAM_STATE_PATH'),
+                      help='Path to the directory containing state.json (default: QUAM_STATE_PATH environment variable)')
+    parser.add_argument('--wiring-path', type=str, help='Path to the wiring file (default: wiring.json in state directory)')
+    parser.add_argument('--if-limit', type=float, default=DEFAULT_IF_LIMIT / 1e6,
+                      help='Limit on the absolute intermediate frequency in MHz (default: 400 MHz)')
+    parser.add_argument('--format', choices=['text', 'json'], default='text', help='Output format (default: text)')
+    parser.add_argument('--output', type=str, help='Path to save the findings as JSON (optional)')
+    parser.add_argument('--fail-on', choices=['error', 'warning'], default='error',
+                      help='Lowest severity that makes the exit code non-zero (default: error)')
+    args = parser.parse_args()
+
+    if not args.state_path:
+        raise ValueError("State path not provided and QUAM_STATE_PATH environment variable not set")
+
+    state_dir = Path(args.state_path)
+    state_path = state_dir / "state.json"
+    wiring_path = Path(args.wiring_path) if args.wiring_path else state_dir / "wiring.json"
+
+    if not state_path.exists():
+        raise FileNotFoundError(f"State file not found: {state_path}")
+    if not wiring_path.exists():
+        raise FileNotFoundError(f"Wiring file not found: {wiring_path}")
+
+    state, wiring = load_documents(state_path, wiring_path)
+    findings = validate(state, wiring, if_limit=args.if_limit * 1e6)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(findings, f, indent=2)
+        print(f"Findings saved to {args.output}")
+
+    if args.format == 'json':
+        print(json.dumps(findings, indent=2))
+    else:
+        for finding in findings:
+            print(f"{finding['severity'].upper():<8} {finding['rule']:<30} {finding['message']}")
+        errors = sum(1 for finding in findings if finding['severity'] == ERROR)
+        print(f"\n{errors} errors, {len(findings) - errors} warnings")
+
+    failing = {ERROR} if args.fail_on == 'error' else {ERROR, WARNING}
+    if any(finding['severity'] in failing for finding in findings):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
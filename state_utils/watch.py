@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+import time
+import threading
+from bisect import bisect_left, insort
+from pathlib import Path
+from collections import defaultdict
+from .references import resolve_pointer
+from .collect_frequencies import qubit_frequency_row
+
+# ANSI escape codes to redraw the terminal in place
+CLEAR_SCREEN = '\033[H\033[2J'
+
+# Delay that lets a writer finish and coalesces a burst of events into one update (s)
+DEBOUNCE = 0.02
+
+# Events that mean the file content may have changed
+WRITE_EVENTS = ('modified', 'created', 'moved', 'closed')
+
+def _watch_with_watchdog(paths, on_change, Observer, FileSystemEventHandler):
+    targets = set(paths)
+    changed = threading.Event()
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.event_type not in WRITE_EVENTS:
+                return
+            for path in (event.src_path, getattr(event, 'dest_path', None)):
+                if path and Path(path).resolve() in targets:
+                    changed.set()
+
+    observer = Observer()
+    for directory in {path.parent for path in paths}:
+        observer.schedule(Handler(), str(directory), recursive=False)
+    observer.start()
+    try:
+        while True:
+            changed.wait()
+            time.sleep(DEBOUNCE)
+            changed.clear()
+            on_change()
+    finally:
+        observer.stop()
+        observer.join()
+
+def _watch_with_polling(paths, on_change, poll_interval):
+    def signature():
+        stats = []
+        for path in paths:
+            try:
+                stat = path.stat()
+                stats.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stats.append(None)
+        return stats
+
+    last = signature()
+    while True:
+        time.sleep(poll_interval)
+        current = signature()
+        if current != last:
+            time.sleep(DEBOUNCE)
+            last = signature()
+            on_change()
+
+def watch_files(paths, on_change, poll_interval=0.05):
+    """Call `on_change()` whenever one of the files is written, until interrupted.
+
+    Uses watchdog (inotify on Linux) when it is installed and polls the modification
+    time and size of the files otherwise.
+    """
+    paths = [Path(path).resolve() for path in paths]
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        _watch_with_polling(paths, on_change, poll_interval)
+    else:
+        _watch_with_watchdog(paths, on_change, Observer, FileSystemEventHandler)
+
+class _PointerResolver:
+    """Resolves references by walking the document, as an update only touches a few ports"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get(self, reference, default=None):
+        return resolve_pointer(self.root, reference, default)
+
+class FrequencyTable:
+    """Frequency rows of all qubits, kept sorted by XY total frequency.
+
+    `update` diffs a new version of the documents against the previous one and only
+    recomputes the rows of qubits whose state entry or ports changed.
+    """
+
+    def __init__(self):
+        self.state = None
+        self.wiring = None
+        self.index = None
+        self.rows = {}
+        self.order = []
+        # XY total frequency of every qubit, updated in place so a PairTable can share it
+        self.xy_frequencies = {}
+
+    def update(self, state, wiring):
+        """Apply new documents and return the set of qubits whose rows were recomputed"""
+        index = _PointerResolver(state)
+        new_qubits = state['qubits']
+        wiring_qubits = wiring['wiring']['qubits']
+
+        if self.state is None or wiring != self.wiring:
+            affected = set(self.rows) | set(new_qubits)
+        else:
+            old_qubits = self.state['qubits']
+            affected = {q for q in old_qubits.keys() | new_qubits.keys() if old_qubits.get(q) != new_qubits.get(q)}
+            if self.state.get('ports') != state.get('ports'):
+                # Find the qubits whose XY or RR port changed
+                for qubit in new_qubits.keys() - affected:
+                    lines = wiring_qubits.get(qubit, {})
+                    for line in ('xy', 'rr'):
+                        reference = lines.get(line, {}).get('opx_output')
+                        if reference and self.index.get(reference) != index.get(reference):
+                            affected.add(qubit)
+                            break
+
+        for qubit in affected:
+            old_row = self.rows.pop(qubit, None)
+            if old_row is not None:
+                del self.order[bisect_left(self.order, (old_row[2], qubit))]
+                del self.xy_frequencies[qubit]
+            if qubit in new_qubits:
+                row = qubit_frequency_row(qubit, new_qubits[qubit], wiring_qubits, index)
+                if row is not None:
+                    self.rows[qubit] = row
+                    self.xy_frequencies[qubit] = row[2]
+                    insort(self.order, (row[2], qubit))
+
+        self.state, self.wiring, self.index = state, wiring, index
+        return affected
+
+    def sorted_rows(self):
+        """Return (qubit, *row) tuples sorted by XY total frequency"""
+        return [(qubit,) + self.rows[qubit] for _, qubit in self.order]
+
+class PairTable:
+    """Nearest-neighbor qubit pairs and their control/target orientation.
+
+    `update` only re-pairs qubits whose grid location changed and only re-orients the
+    pairs of qubits whose XY frequency changed.
+    """
+
+    def __init__(self):
+        self.qubit_order = {}
+        self.locations = {}
+        self.by_location = defaultdict(set)
+        self.pairs_of_qubit = defaultdict(set)
+        self.frequencies = {}
+        self.pairs = {}
+        # (position of q1, position of q2, key) of every pair, kept sorted for display
+        self.ordered = []
+
+    def _position(self, key):
+        return (self.qubit_order[key[0]], self.qubit_order[key[1]], key)
+
+    def _key(self, q1, q2):
+        return (q1, q2) if self.qubit_order[q1] < self.qubit_order[q2] else (q2, q1)
+
+    def _orient(self, q1, q2):
+        f1, f2 = self.frequencies.get(q1), self.frequencies.get(q2)
+        if f1 is None or f2 is None:
+            return None
+        return (q1, q2) if f1 > f2 else (q2, q1)
+
+    def _unpair(self, qubit):
+        for key in self.pairs_of_qubit.pop(qubit, set()):
+            del self.pairs[key]
+            del self.ordered[bisect_left(self.ordered, self._position(key))]
+            self.pairs_of_qubit[key[0] if key[1] == qubit else key[1]].discard(key)
+
+    def update(self, state, frequencies, changed):
+        """Apply a new state given the qubits whose state entry or frequency changed.
+
+        `frequencies` maps qubits to their XY total frequency, as kept by FrequencyTable.
+        """
+        qubits = state['qubits']
+        if list(self.qubit_order) != list(qubits):
+            changed = set(changed) | (self.locations.keys() ^ qubits.keys())
+            # Drop the pairs of removed qubits before the order forgets them
+            for qubit in self.locations.keys() - qubits.keys():
+                self._unpair(qubit)
+            self.qubit_order = {qubit: i for i, qubit in enumerate(qubits)}
+            self.ordered = sorted(map(self._position, self.pairs))
+
+        # Re-pair the qubits that moved, appeared or disappeared
+        moved = set()
+        for qubit in changed:
+            grid_location = qubits.get(qubit, {}).get('grid_location')
+            location = tuple(map(int, grid_location.split(','))) if grid_location else None
+            if location == self.locations.get(qubit):
+                continue
+            moved.add(qubit)
+            self._unpair(qubit)
+            if qubit in self.locations:
+                self.by_location[self.locations.pop(qubit)].discard(qubit)
+            if location is not None:
+                self.locations[qubit] = location
+                self.by_location[location].add(qubit)
+
+        self.frequencies = frequencies
+        for qubit in moved:
+            if qubit not in self.locations:
+                continue
+            x, y = self.locations[qubit]
+            for location in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+                for other in self.by_location.get(location, ()):
+                    key = self._key(qubit, other)
+                    self.pairs_of_qubit[qubit].add(key)
+                    self.pairs_of_qubit[other].add(key)
+                    if key not in self.pairs:
+                        insort(self.ordered, self._position(key))
+                    self.pairs[key] = self._orient(*key)
+
+        # Re-orient the pairs of qubits whose frequency changed
+        for qubit in changed:
+            for key in self.pairs_of_qubit.get(qubit, ()):
+                self.pairs[key] = self._orient(*key)
+
+    def qubit_pairs(self):
+        """Return the pairs in the qubit_pairs format of collect_qubit_pairs, in qubit order"""
+        qubit_pairs = {}
+        for _, _, (q1, q2) in self.ordered:
+            orientation = self.pairs[(q1, q2)]
+            if orientation is None:
+                continue
+            pair_key = f"{q1}-{q2}"
+            qubit_pairs[pair_key] = {
+                "id": pair_key,
+                "qubit_control": f"#/qubits/{orientation[0]}",
+                "qubit_target": f"#/qubits/{orientation[1]}"
+            }
+        return qubit_pairs
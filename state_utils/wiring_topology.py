@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+import json
+import argparse
+from collections import Counter, defaultdict
+
+# Port ranges of the OPX1000 front-end modules (inclusive)
+MW_FEM_OUTPUT_PORTS = (1, 8)
+MW_FEM_INPUT_PORTS = (1, 2)
+LF_FEM_OUTPUT_PORTS = (1, 8)
+
+# Topology of the 21-qubit chip with a single feed-line per qubit group
+DEFAULT_TOPOLOGY = {
+    "controllers": [
+        {"con": 1, "mw_fem": [1, 2, 3, 4], "lf_fem": [5, 6, 7, 8]},
+    ],
+    "feedlines": [
+        {"prefix": "A", "count": 6, "mw_slot": 4, "lf_slot": 8},
+        {"prefix": "B", "count": 5, "mw_slot": 1, "lf_slot": 5},
+        {"prefix": "C", "count": 5, "mw_slot": 2, "lf_slot": 7},
+        {"prefix": "D", "count": 5, "mw_slot": 3, "lf_slot": 6},
+    ],
+}
+
+def load_topology(topology_path):
+    """Load a topology spec from a JSON file."""
+    with open(topology_path, 'r') as f:
+        return json.load(f)
+
+def expand_qubits(feedline):
+    """Return the qubit names of a feed-line given either explicitly or as prefix/count"""
+    if 'qubits' in feedline:
+        return list(feedline['qubits'])
+    start = feedline.get('start', 1)
+    return [f"{feedline['prefix']}{i}" for i in range(start, start + feedline['count'])]
+
+def _port_list(port_range, limits, what):
+    """Turn an inclusive [first, last] port range into a list of ports"""
+    first, last = port_range
+    if first < limits[0] or last > limits[1] or first > last:
+        raise ValueError(f"Invalid {what} port range {port_range}, must lie within {list(limits)}")
+    return list(range(first, last + 1))
+
+def _free_ports(topology):
+    """Build the pools of free ports per (controller, slot)"""
+    mw_out, mw_in, lf_out = {}, {}, {}
+    seen = set()
+    for controller in topology['controllers']:
+        con = controller['con']
+        mw_out_ports = _port_list(controller.get('mw_out_ports', topology.get('mw_out_ports', MW_FEM_OUTPUT_PORTS)),
+                                  MW_FEM_OUTPUT_PORTS, "MW-FEM output")
+        mw_in_ports = _port_list(controller.get('mw_in_ports', topology.get('mw_in_ports', MW_FEM_INPUT_PORTS)),
+                                 MW_FEM_INPUT_PORTS, "MW-FEM input")
+        lf_out_ports = _port_list(controller.get('lf_out_ports', topology.get('lf_out_ports', LF_FEM_OUTPUT_PORTS)),
+                                  LF_FEM_OUTPUT_PORTS, "LF-FEM output")
+        for slot in controller.get('mw_fem', []):
+            if (con, slot) in seen:
+                raise ValueError(f"Slot {slot} of controller {con} is declared more than once")
+            seen.add((con, slot))
+            mw_out[(con, slot)] = list(reversed(mw_out_ports))
+            mw_in[(con, slot)] = list(reversed(mw_in_ports))
+        for slot in controller.get('lf_fem', []):
+            if (con, slot) in seen:
+                raise ValueError(f"Slot {slot} of controller {con} is declared more than once")
+            seen.add((con, slot))
+            lf_out[(con, slot)] = list(reversed(lf_out_ports))
+    return mw_out, mw_in, lf_out
+
+def _pinned_slot(feedline, key, pools, default_con):
+    """Return the (controller, slot) a feed-line is pinned to, if any"""
+    if key not in feedline:
+        return None
+    slot = (feedline.get('con', default_con), feedline[key])
+    if slot not in pools:
+        raise ValueError(f"Feed-line {expand_qubits(feedline)[0]}...: no FEM of the right type in controller {slot[0]}, slot {slot[1]}")
+    return slot
+
+def validate_topology(topology):
+    """Check that the topology fits the available ports before anything is allocated"""
+    mw_out, mw_in, lf_out = _free_ports(topology)
+    feedlines = [expand_qubits(feedline) for feedline in topology['feedlines']]
+
+    # Feed-lines are named after their first qubit in the messages below
+    empty = [str(i + 1) for i, qubits in enumerate(feedlines) if not qubits]
+    if empty:
+        raise ValueError(f"Feed-lines without qubits: {', '.join(empty)} (numbered from 1)")
+
+    names =[qubit for qubits in feedlines for qubit in qubits]
+    duplicates = sorted(qubit for qubit, count in Counter(names).items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Qubits appear in more than one feed-line: {', '.join(duplicates)}")
+
+    errors = []
+    # Every feed-line uses one MW input and one MW output, every qubit one MW output and one LF output
+    available_mw_in = sum(len(ports) for ports in mw_in.values())
+    available_mw_out = sum(len(ports) for ports in mw_out.values())
+    available_lf_out = sum(len(ports) for ports in lf_out.values())
+    if len(feedlines) > available_mw_in:
+        errors.append(f"{len(feedlines)} feed-lines need MW-FEM inputs but only {available_mw_in} are available")
+    if len(feedlines) + len(names) > available_mw_out:
+        errors.append(f"{len(feedlines)} feed-lines and {len(names)} drive lines need "
+                      f"{len(feedlines) + len(names)} MW-FEM outputs but only {available_mw_out} are available")
+    if len(names) > available_lf_out:
+        errors.append(f"{len(names)} flux lines need LF-FEM outputs but only {available_lf_out} are available")
+
+    # Pinned feed-lines must not overbook the inputs of their slot
+    pinned_inputs = defaultdict(int)
+    default_con = topology['controllers'][0]['con']
+    for feedline in topology['feedlines']:
+        _pinned_slot(feedline, 'lf_slot', lf_out, default_con)
+        slot = _pinned_slot(feedline, 'mw_slot', mw_in, default_con)
+        if slot is not None:
+            pinned_inputs[slot] += 1
+    for (con, slot), count in sorted(pinned_inputs.items()):
+        if count > len(mw_in[(con, slot)]):
+            errors.append(f"{count} feed-lines are pinned to controller {con}, slot {slot} "
+                          f"which only has {len(mw_in[(con, slot)])} MW-FEM inputs")
+
+    if errors:
+        raise ValueError("Topology does not fit the available instruments:\n  " + "\n  ".join(errors))
+
+def _spill_order(home, pools, demand):
+    """Slots to take ports from: the home slot, the rest of its controller, then other controllers.
+
+    Overflow goes to the slots with the most ports to spare first.
+    """
+    spare = lambda slot: -(len(pools[slot]) - demand[slot])
+    same_con = sorted((slot for slot in pools if slot[0] == home[0] and slot != home), key=spare)
+    other_con = sorted((slot for slot in pools if slot[0] != home[0]), key=spare)
+    return [home] + same_con + other_con
+
+def _take_ports(count, home, pools, demand):
+    """Take `count` free ports starting from the home slot"""
+    demand[home] -= count
+    taken = []
+    for slot in _spill_order(home, pools, demand):
+        ports = pools[slot]
+        while ports and len(taken) < count:
+            taken.append((slot[0], slot[1], ports.pop()))
+        if len(taken) == count:
+            break
+    return taken
+
+def _best_slot(candidates, pools, demand, controller_load):
+    """Pick the slot with the most spare ports, spreading ties over the least loaded controller"""
+    return max(candidates, key=lambda slot: (len(pools[slot]) - demand[slot], -controller_load[slot[0]]))
+
+def plan_wiring(topology):
+    """Allocate ports for every feed-line and qubit of a topology spec.
+
+    Returns a plan with the instruments per controller, the resonator channel of each
+    feed-line and the drive/flux channels of each qubit.
+    """
+    validate_topology(topology)
+    mw_out, mw_in, lf_out = _free_ports(topology)
+    default_con = topology['controllers'][0]['con']
+    feedlines = [(feedline, expand_qubits(feedline)) for feedline in topology['feedlines']]
+
+    # Place the resonator of each feed-line, pinned feed-lines first
+    mw_demand = defaultdict(int)
+    lf_demand = defaultdict(int)
+    controller_load = defaultdict(int)
+    homes = {}
+    order = sorted(range(len(feedlines)), key=lambda i: 'mw_slot' not in feedlines[i][0])
+    for i in order:
+        feedline, qubits = feedlines[i]
+        slot = _pinned_slot(feedline, 'mw_slot', mw_in, default_con)
+        if slot is None:
+            candidates = [s for s in mw_in if mw_in[s] and mw_out[s]]
+            if not candidates:
+                raise ValueError(f"No MW-FEM slot left with a free input/output pair for feed-line {qubits[0]}...")
+            slot = _best_slot(candidates, mw_out, mw_demand, controller_load)
+        if not mw_in[slot] or not mw_out[slot]:
+            raise ValueError(f"No free input/output pair left in controller {slot[0]}, slot {slot[1]} for feed-line {qubits[0]}...")
+        homes[i] = (slot, (slot[0], slot[1], mw_in[slot].pop(), mw_out[slot].pop()))
+        mw_demand[slot] += len(qubits)
+        controller_load[slot[0]] += len(qubits)
+
+    # Place the flux lines of each feed-line, preferring an LF-FEM on the resonator's controller
+    lf_homes = {}
+    for i in order:
+        feedline, qubits = feedlines[i]
+        slot = _pinned_slot(feedline, 'lf_slot', lf_out, default_con)
+        if slot is None:
+            candidates = [s for s in lf_out if s[0] == homes[i][0][0]] or list(lf_out)
+            slot = _best_slot(candidates, lf_out, lf_demand, controller_load)
+        lf_homes[i] = slot
+        lf_demand[slot] += len(qubits)
+
+    plan_feedlines = []
+    plan_qubits = []
+    for i, (feedline, qubits) in enumerate(feedlines):
+        home, resonator = homes[i]
+        drives = _take_ports(len(qubits), home, mw_out, mw_demand)
+        fluxes = _take_ports(len(qubits), lf_homes[i], lf_out, lf_demand)
+        plan_feedlines.append({'qubits': qubits, 'resonator': resonator})
+        for qubit, drive, flux in zip(qubits, drives, fluxes):
+            plan_qubits.append({'qubit': qubit, 'drive': drive, 'flux': flux})
+
+    instruments = {}
+    for controller in topology['controllers']:
+        instruments[controller['con']] = {
+            'mw_fem': list(controller.get('mw_fem', [])),
+            'lf_fem': list(controller.get('lf_fem', [])),
+        }
+
+    return {'instruments': instruments, 'feedlines': plan_feedlines, 'qubits': plan_qubits}
+
+def main():
+    parser = argparse.ArgumentParser(description='Allocate ports for a wiring topology spec')
+    parser.add_argument('--topology', type=str, help='Path to the topology JSON file (default: built-in 21-qubit chip)')
+    parser.add_argument('--output', type=str, help='Path to save the port plan as JSON (optional)')
+    args = parser.parse_args()
+
+    topology = load_topology(args.topology) if args.topology else DEFAULT_TOPOLOGY
+    plan = plan_wiring(topology)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(plan, f, indent=4)
+        print(f"Port plan saved to {args.output}")
+
+    print(f"\n{'Qubit':<8} {'Drive (con/slot/port)':>22} {'Flux (con/slot/port)':>22}")
+    print("-" * 54)
+    for entry in plan['qubits']:
+        drive = '/'.join(map(str, entry['drive']))
+        flux = '/'.join(map(str, entry['flux']))
+        print(f"{entry['qubit']:<8} {drive:>22} {flux:>22}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import copy
+import random
+import pytest
+from state_utils.state_diff import (
+    ADD, REMOVE, REPLACE, MerkleTree, apply_changes, diff_documents, diff_trees, invert_changes,
+)
+
+OLD = {
+    'qubits': {
+        'q1': {'xy': {'intermediate_frequency': 50e6}, 'grid_location': "0,0"},
+        'q2': {'xy': {'intermediate_frequency': 60e6}, 'grid_location': "0,1"},
+        'a/b': {'thread': "a~b"},
+    },
+    'active_qubit_names': ['q1', 'q2', 'a/b'],
+    'ports': {'mw_outputs': {'con1': {'1': {'1': {'band': 2}}}}},
+}
+
+NEW = {
+    'qubits': {
+        'q1': {'xy': {'intermediate_frequency': 55e6}, 'grid_location': "0,0"},
+        'q3': {'xy': {'intermediate_frequency': 70e6}},
+        'a/b': {'thread': "b~a"},
+    },
+    'active_qubit_names': ['q1'],
+    'ports': {'mw_outputs': {'con1': {'1': {'1': {'band': 2}}}}},
+    'wiring': None,
+}
+
+def _random_document(rng, depth=0):
+    if depth > 3 or rng.random() < 0.3:
+        return rng.choice([rng.random(), rng.randint(-5, 5), "text", None, True])
+    if rng.random() < 0.5:
+        return [_random_document(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {rng.choice("abc/~"): _random_document(rng, depth + 1) for _ in range(rng.randint(0, 4))}
+
+def test_diff_finds_every_change():
+    changes = diff_documents(OLD, NEW)
+    assert {(change['op'], change['path']) for change in changes} == {
+        (REPLACE, "#/qubits/q1/xy/intermediate_frequency"),
+        (REMOVE, "#/qubits/q2"),
+        (ADD, "#/qubits/q3"),
+        (REPLACE, "#/qubits/a~1b/thread"),
+        (REMOVE, "#/active_qubit_names/2"),
+        (REMOVE, "#/active_qubit_names/1"),
+        (ADD, "#/wiring"),
+    }
+    assert diff_documents(OLD, copy.deepcopy(OLD)) == []
+
+def test_numbers_compare_by_value():
+    assert diff_documents({'a': [1, 2.0]}, {'a': [1.0, 2]}) == []
+    assert diff_documents({'a': True}, {'a': 1}) != []
+
+def test_apply_and_invert_round_trip():
+    old, new = copy.deepcopy(OLD), copy.deepcopy(NEW)
+    changes = diff_documents(old, new)
+    assert apply_changes(old, changes) == new
+    assert apply_changes(new, invert_changes(changes)) == old
+    # Neither document is modified
+    assert old == OLD and new == NEW
+
+def test_apply_shares_unchanged_branches():
+    changes = diff_documents(OLD, NEW)
+    applied = apply_changes(OLD, changes)
+    assert applied['ports'] is OLD['ports']
+    assert applied['qubits'] is not OLD['qubits']
+
+def test_replace_of_missing_path_raises():
+    with pytest.raises(KeyError):
+        apply_changes(OLD, [{'op': REPLACE, 'path': "#/qubits/q9", 'old': None, 'new': {}}])
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_documents_round_trip(seed):
+    rng = random.Random(seed)
+    old, new = _random_document(rng), _random_document(rng)
+    old, new = {'root': old}, {'root': new}
+    changes = diff_documents(old, new)
+    assert apply_changes(old, changes) == new
+    assert apply_changes(new, invert_changes(changes)) == old
+    assert diff_documents(old, old) == []
+
+@pytest.mark.parametrize('seed', range(10))
+def test_updated_tree_matches_rebuilt_tree(seed):
+    rng = random.Random(seed)
+    tree = MerkleTree({'root': _random_document(rng)})
+    for _ in range(5):
+        new = {'root': _random_document(rng)}
+        changes = diff_trees(tree, MerkleTree(new))
+        tree.update(changes)
+        rebuilt = MerkleTree(new)
+        assert tree.document == new
+        assert tree.root == rebuilt.root
+        # Only the containers of the current document keep a hash
+        assert len(tree.hashes) == len(rebuilt.hashes)
@@ -0,0 +1,136 @@
+import json
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+from state_utils.state_editor import app as editor_app
+from state_utils.state_editor.assets import etag_matches
+from state_utils.state_editor.registry import ChipRegistry
+from state_utils.transaction import StateTransaction
+
+def _qubit(amplitude, xy_if):
+    return {
+        'resonator': {'operations': {'readout': {'amplitude': amplitude, 'length': 1000}}, 'intermediate_frequency': 50e6},
+        'xy': {'intermediate_frequency': xy_if},
+    }
+
+STATE = {
+    'qubits': {'q1': _qubit(0.1, 100e6), 'q2': _qubit(0.2, 110e6)},
+    'active_qubit_names': ['q1', 'q2'],
+}
+
+def _amplitude(document, qubit='q1'):
+    return document['qubits'][qubit]['resonator']['operations']['readout']['amplitude']
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    with open(tmp_path / "state.json", 'w') as f:
+        json.dump(STATE, f)
+    monkeypatch.setattr(editor_app, 'registry', ChipRegistry({'chip': tmp_path}))
+    client = TestClient(editor_app.app)
+    client.state_dir = tmp_path
+    return client
+
+def _save(client, qubit, amplitude):
+    values = dict(client.get("/api/qubits").json()[qubit])
+    del values['active']
+    values['amplitude'] = amplitude
+    return client.post("/api/save", json={'qubits': {qubit: values}})
+
+def _state(client):
+    with open(client.state_dir / "state.json", 'r') as f:
+        return json.load(f)
+
+def test_api_save_undo_redo(client):
+    assert _save(client, 'q1', 0.3).json()['revision'] == 1
+    assert _save(client, 'q1', 0.4).json()['revision'] == 2
+
+    response = client.post("/api/undo")
+    assert response.status_code == 200
+    assert response.json() == {'revision': 1, 'can_undo': True, 'can_redo': True}
+    assert _amplitude(_state(client)) == 0.3
+    assert client.get("/api/qubits").json()['q1']['amplitude'] == 0.3
+
+    assert client.post("/api/redo").json()['revision'] == 2
+    assert _amplitude(_state(client)) == 0.4
+    assert client.post("/api/redo").status_code == 400
+
+    client.post("/api/undo")
+    client.post("/api/undo")
+    assert _state(client) == STATE
+    assert client.post("/api/undo").status_code == 400
+
+def test_api_history_and_revisions(client):
+    _save(client, 'q1', 0.3)
+    _save(client, 'q2', 0.7)
+    history = client.get("/chips/chip/api/history").json()
+    assert history['revision'] == 2
+    assert [entry['qubits'] for entry in history['revisions']] == [['q1'], ['q2']]
+    assert client.get("/api/history/1").json()['q1']['amplitude'] == 0.3
+    assert client.get("/api/history/0").json()['q2']['amplitude'] == 0.2
+    assert client.get("/api/history/5").status_code == 404
+    # Viewing a revision leaves the state alone
+    assert _amplitude(_state(client), 'q2') == 0.7
+
+def test_api_undo_after_external_write_is_refused(client):
+    _save(client, 'q1', 0.3)
+    with StateTransaction(client.state_dir) as state:
+        state['qubits']['q2']['xy']['intermediate_frequency'] = 1e6
+
+    response = client.post("/api/undo")
+    assert response.status_code == 409
+    # The external write is kept and became a revision of the history
+    state = _state(client)
+    assert state['qubits']['q2']['xy']['intermediate_frequency'] == 1e6
+    assert _amplitude(state) == 0.3
+    history = client.get("/api/history").json()
+    assert history['revision'] == 2
+    assert history['revisions'][-1]['source'] == 'external'
+
+    # Once seen, undoing goes back over the external write, then the edit
+    assert client.post("/api/undo").status_code == 200
+    assert _state(client)['qubits']['q2']['xy']['intermediate_frequency'] == 110e6
+    assert client.post("/api/undo").status_code == 200
+    assert _state(client) == STATE
+
+def test_api_save_rebases_on_external_write(client):
+    _save(client, 'q1', 0.3)
+    with StateTransaction(client.state_dir) as state:
+        state['qubits']['q2']['xy']['intermediate_frequency'] = 1e6
+
+    # The edit is applied to the state on disk, keeping the external change
+    assert _save(client, 'q1', 0.5).json()['revision'] == 3
+    state = _state(client)
+    assert _amplitude(state) == 0.5
+    assert state['qubits']['q2']['xy']['intermediate_frequency'] == 1e6
+    sources = [entry['source'] for entry in client.get("/api/history").json()['revisions']]
+    assert sources == ['editor', 'external', 'editor']
+
+def test_api_unknown_qubit(client):
+    response = client.post("/api/save", json={'qubits': {'q9': {'amplitude': 0.1, 'length': 100, 'resonator_if': 0, 'xy_if': 0}}})
+    assert response.status_code == 400
+    assert _state(client) == STATE
+
+@pytest.mark.parametrize('header, matches', [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", "abc"', True),
+    ('"xyz",W/"abc"', True),
+    ('*', True),
+    ('"xyz"', False),
+    ('"ab"', False),
+    ('', False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"abc"') is matches
+
+def test_page_is_revalidated_by_etag(client):
+    response = client.get("/", headers={'Accept-Encoding': 'identity'})
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+    for header in (etag, f'"other", {etag}', f'W/{etag}', '*'):
+        response = client.get("/", headers={'Accept-Encoding': 'identity', 'If-None-Match': header})
+        assert response.status_code == 304
+        assert response.content == b''
+    assert client.get("/", headers={'Accept-Encoding': 'identity', 'If-None-Match': '"other"'}).status_code == 200
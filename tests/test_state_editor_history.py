@@ -0,0 +1,110 @@
+import copy
+import pytest
+from state_utils.state_diff import apply_changes
+from state_utils.state_editor.history import StateHistory
+
+def _qubit(amplitude, xy_if):
+    return {
+        'resonator': {'operations': {'readout': {'amplitude': amplitude, 'length': 1000}}, 'intermediate_frequency': 50e6},
+        'xy': {'intermediate_frequency': xy_if},
+    }
+
+STATE = {
+    'qubits': {'q1': _qubit(0.1, 100e6), 'q2': _qubit(0.2, 110e6)},
+    'active_qubit_names': ['q1', 'q2'],
+}
+
+def _edit(document, qubit, amplitude):
+    changes = [{
+        'op': 'replace',
+        'path': f"#/qubits/{qubit}/resonator/operations/readout/amplitude",
+        'old': document['qubits'][qubit]['resonator']['operations']['readout']['amplitude'],
+        'new': amplitude,
+    }]
+    return apply_changes(document, changes), changes
+
+def _amplitude(document, qubit='q1'):
+    return document['qubits'][qubit]['resonator']['operations']['readout']['amplitude']
+
+def test_undo_redo():
+    history = StateHistory(STATE)
+    document = STATE
+    for amplitude in (0.3, 0.4, 0.5):
+        document, changes = _edit(document, 'q1', amplitude)
+        history.record(document, changes=changes)
+    assert history.revision == 3
+
+    assert _amplitude(history.undo()) == 0.4
+    assert _amplitude(history.undo()) == 0.3
+    assert _amplitude(history.redo()) == 0.4
+    assert history.can_undo() and history.can_redo()
+    assert _amplitude(history.document_at(0)) == 0.1
+    assert _amplitude(history.document_at(3)) == 0.5
+    # Viewing a revision does not move the cursor
+    assert history.revision == 2
+
+    # A new revision drops those that were undone
+    document, changes = _edit(history.document, 'q2', 0.9)
+    assert history.record(document, changes=changes) == 3
+    assert not history.can_redo()
+    assert _amplitude(history.document, 'q2') == 0.9
+    assert _amplitude(history.document) == 0.4
+
+def test_undo_and_redo_at_the_ends():
+    history = StateHistory(STATE)
+    with pytest.raises(IndexError):
+        history.undo()
+    with pytest.raises(IndexError):
+        history.redo()
+    with pytest.raises(IndexError):
+        history.document_at(1)
+
+def test_record_diffs_documents():
+    history = StateHistory(STATE)
+    assert history.record(copy.deepcopy(STATE)) is None
+    external = copy.deepcopy(STATE)
+    external['qubits']['q2']['xy']['intermediate_frequency'] = 120e6
+    assert history.record(external, source='external') == 1
+    entry = history.summary()['revisions'][0]
+    assert entry['source'] == 'external'
+    assert entry['qubits'] == ['q2']
+    assert entry['num_changes'] == 1
+    assert history.undo() == STATE
+
+def test_revision_cap_evicts_oldest():
+    history = StateHistory(STATE, max_revisions=3)
+    document = STATE
+    for i in range(5):
+        document, changes = _edit(document, 'q1', i)
+        history.record(document, changes=changes)
+    assert (history.first_revision, history.last_revision) == (2, 5)
+    assert _amplitude(history.document_at(2)) == 1
+    with pytest.raises(IndexError):
+        history.document_at(1)
+    for _ in range(3):
+        history.undo()
+    assert not history.can_undo()
+
+def test_byte_cap_evicts_oldest():
+    history = StateHistory(STATE, max_bytes=1000)
+    document = STATE
+    for i in range(20):
+        document, changes = _edit(document, 'q1', i)
+        history.record(document, changes=changes)
+    assert history.size <= 1000
+    assert history.size == sum(entry['size'] for entry in history.entries)
+    assert 0 < len(history.entries) < 20
+    assert history.last_revision == 20
+    assert _amplitude(history.document_at(history.first_revision)) == history.first_revision - 1
+
+def test_patches_share_values_with_documents():
+    big = copy.deepcopy(STATE)
+    big['ports'] = {str(i): {'band': 2, 'delay': i} for i in range(1000)}
+    history = StateHistory(big)
+    document = big
+    for i in range(100):
+        document, changes = _edit(document, 'q1', i)
+        history.record(document, changes=changes)
+    # A hundred revisions of a large state cost a few kilobytes of patches
+    assert history.size < 20_000
+    assert history.document['ports'] is big['ports']
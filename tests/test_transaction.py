@@ -0,0 +1,206 @@
+import os
+import json
+import stat
+import threading
+import multiprocessing
+import pytest
+from state_utils import transaction
+from state_utils.transaction import (
+    LOCK_FILE, LockTimeoutError, LostUpdateError, StateLock, StateTransaction,
+    atomic_write_json, lock_metrics, read_state, replace_files, write_state,
+)
+
+def _write(path, document):
+    with open(path, 'w') as f:
+        json.dump(document, f)
+
+def _read(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+@pytest.fixture
+def state_dir(tmp_path):
+    _write(tmp_path / "state.json", {'qubits': {'q1': {'x': 1}}, 'counter': 0})
+    return tmp_path
+
+def _increment(path, times):
+    """Add 1 to the counter of a state `times` times, one transaction each"""
+    for _ in range(times):
+        with StateTransaction(path, timeout=30) as state:
+            state['counter'] += 1
+
+def test_exclusive_lock_times_out_while_held(state_dir):
+    timeouts = lock_metrics()['timeouts']
+    with StateLock(state_dir, exclusive=True):
+        with pytest.raises(LockTimeoutError):
+            with StateLock(state_dir, timeout=0.05):
+                pass
+    assert lock_metrics()['timeouts'] == timeouts + 1
+
+def test_shared_locks_are_held_together(state_dir):
+    with StateLock(state_dir, timeout=0.05) as first:
+        with StateLock(state_dir, timeout=0.05) as second:
+            assert first.revision == second.revision
+        with pytest.raises(LockTimeoutError):
+            with StateLock(state_dir, exclusive=True, timeout=0.05):
+                pass
+
+def test_contended_lock_is_acquired_when_released(state_dir):
+    contended = lock_metrics()['contended']
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with StateLock(state_dir, exclusive=True):
+            held.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait()
+    threading.Timer(0.1, release.set).start()
+    with StateLock(state_dir, exclusive=True, timeout=5):
+        assert release.is_set()
+    holder.join()
+    metrics = lock_metrics()
+    assert metrics['contended'] > contended
+    assert metrics['max_wait'] >= 0.05
+
+def test_commit_requires_exclusive_lock(state_dir):
+    with StateLock(state_dir) as lock:
+        with pytest.raises(RuntimeError):
+            lock.commit()
+
+def test_write_bumps_revision(state_dir):
+    _, revision = read_state(state_dir)
+    new_revision = write_state(state_dir, {'counter': 1})
+    assert new_revision.number == revision.number + 1
+    state, current = read_state(state_dir)
+    assert state == {'counter': 1}
+    assert current == new_revision
+
+def test_stale_write_raises_lost_update(state_dir):
+    lost_updates = lock_metrics()['lost_updates']
+    _, revision = read_state(state_dir)
+    write_state(state_dir, {'counter': 1})
+    with pytest.raises(LostUpdateError):
+        write_state(state_dir, {'counter': 2}, expected_revision=revision)
+    with pytest.raises(LostUpdateError):
+        with StateTransaction(state_dir, expected_revision=revision) as state:
+            state['counter'] = 3
+    assert _read(state_dir / "state.json") == {'counter': 1}
+    assert lock_metrics()['lost_updates'] == lost_updates + 2
+
+def test_unlocked_write_changes_fingerprint(state_dir):
+    write_state(state_dir, {'counter': 0})
+    _, revision = read_state(state_dir)
+    # A program that does not take the lock
+    _write(state_dir / "state.json", {'counter': 0, 'written': 'elsewhere'})
+    _, current = read_state(state_dir)
+    assert current.number == revision.number + 1
+    assert current.fingerprint != revision.fingerprint
+    with pytest.raises(LostUpdateError):
+        write_state(state_dir, {'counter': 1}, expected_revision=revision)
+
+def test_transaction_writes_on_success_only(state_dir):
+    with pytest.raises(KeyError):
+        with StateTransaction(state_dir) as state:
+            state['counter'] = 5
+            raise KeyError('abort')
+    assert _read(state_dir / "state.json")['counter'] == 0
+
+    locked = StateTransaction(state_dir)
+    with locked as state:
+        state['counter'] = 5
+    assert _read(state_dir / "state.json")['counter'] == 5
+    assert locked.revision.number == 1
+
+def test_writes_keep_permissions(state_dir):
+    state_file = state_dir / "state.json"
+    os.chmod(state_file, 0o640)
+    write_state(state_dir, {'counter': 1})
+    assert stat.S_IMODE(os.stat(state_file).st_mode) == 0o640
+    with StateTransaction(state_dir) as state:
+        state['counter'] = 2
+    assert stat.S_IMODE(os.stat(state_file).st_mode) == 0o640
+
+    staging = state_dir / "staging"
+    staging.mkdir()
+    _write(staging / "state.json", {'counter': 3})
+    os.chmod(staging / "state.json", 0o600)
+    replace_files(staging, state_dir)
+    assert stat.S_IMODE(os.stat(state_file).st_mode) == 0o640
+    assert _read(state_file) == {'counter': 3}
+
+def test_replace_files_rolls_back_on_failure(state_dir, monkeypatch):
+    _write(state_dir / "wiring.json", {'wiring': 'old'})
+    staging = state_dir / "staging"
+    staging.mkdir()
+    _write(staging / "state.json", {'state': 'new'})
+    _write(staging / "wiring.json", {'wiring': 'new'})
+    replace = os.replace
+
+    def failing_replace(source, target):
+        if str(source).startswith(str(staging)) and str(target).endswith("wiring.json"):
+            raise OSError("disk full")
+        replace(source, target)
+
+    monkeypatch.setattr(transaction.os, 'replace', failing_replace)
+    with pytest.raises(OSError):
+        replace_files(staging, state_dir)
+    monkeypatch.undo()
+
+    assert _read(state_dir / "state.json") == {'qubits': {'q1': {'x': 1}}, 'counter': 0}
+    assert _read(state_dir / "wiring.json") == {'wiring': 'old'}
+    assert sorted(p.name for p in state_dir.iterdir()) == ["staging", "state.json", "wiring.json"]
+
+def test_replace_files_removes_new_files_on_failure(tmp_path, monkeypatch):
+    staging = tmp_path / "staging"
+    staging.mkdir()
+    _write(staging / "state.json", {'state': 'new'})
+    _write(staging / "wiring.json", {'wiring': 'new'})
+    replace = os.replace
+
+    def interrupted_replace(source, target):
+        if str(target).endswith("wiring.json"):
+            raise KeyboardInterrupt
+        replace(source, target)
+
+    monkeypatch.setattr(transaction.os, 'replace', interrupted_replace)
+    with pytest.raises(KeyboardInterrupt):
+        replace_files(staging, tmp_path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["staging"]
+
+def test_crash_while_writing_keeps_old_state(state_dir):
+    # json.dump fails half-way through the document
+    with pytest.raises(TypeError):
+        atomic_write_json(state_dir / "state.json", {'counter': 1, 'bad': object()})
+    with pytest.raises(TypeError):
+        with StateTransaction(state_dir) as state:
+            state['bad'] = object()
+    assert _read(state_dir / "state.json") == {'qubits': {'q1': {'x': 1}}, 'counter': 0}
+    assert sorted(p.name for p in state_dir.iterdir()) == [LOCK_FILE, "state.json"]
+    _, revision = read_state(state_dir)
+    assert revision.number == 0
+
+def test_writer_threads_do_not_lose_updates(state_dir):
+    threads = [threading.Thread(target=_increment, args=(state_dir, 25)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    state, revision = read_state(state_dir)
+    assert state['counter'] == 100
+    assert revision.number == 100
+
+def test_writer_processes_do_not_lose_updates(state_dir):
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_increment, args=(str(state_dir), 20)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    assert [process.exitcode for process in processes] == [0, 0]
+    state, revision = read_state(state_dir)
+    assert state['counter'] == 40
+    assert revision.number == 40